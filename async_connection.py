@@ -0,0 +1,282 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from typing import Final
+
+from multiplexed_connection import (CHANNEL_CONTROL, CHANNEL_DATA, CONNECT_RETRY_INTERVAL_IN_SECONDS,
+                                    CONNECT_TIMEOUT_IN_SECONDS, CONTROL_CLOSE, DEFAULT_PORT, FRAME_HEADER,
+                                    FRAME_KIND_DATA, FRAME_KIND_FILE, FRAME_QUEUE_SIZE, HELLO, BasePeerConnector, BaseSharedListener,
+                                    create_frame_header, create_hello, discard_frame, get_incoming_route,
+                                    get_outgoing_route, is_close_notice, parse_hello, read_frame, save_frame)
+from flow_control import ConnectionClosed
+from p2p import RECV_CHUNK_SIZE
+
+# Put on the queues of a connection once it closes, to wake up whoever waits on them
+CONNECTION_CLOSED: Final[object] = object()
+
+# A reader and writer pair of an asyncio stream
+Stream = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+# AsyncFramedConnection is the asyncio version of FramedConnection, with the same frames on the wire
+# (so an asyncio peer can talk to a threaded one). Frames are read by a task of the event loop and
+# handed to whoever awaits their route as soon as they arrive, without polling.
+class AsyncFramedConnection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    chunk_size: int
+    spool_directory: Path
+    running: bool
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 chunk_size: int = RECV_CHUNK_SIZE, spool_directory: str | Path | None = None) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.spool_directory = Path(spool_directory or tempfile.gettempdir())
+        self.running = True
+        self.__queues: dict[int, asyncio.Queue] = {}
+        self.__send_lock = asyncio.Lock()
+        self.__reader_task = asyncio.get_running_loop().create_task(self.__receive_frames())
+
+    # Sends a frame holding the given data
+    async def send_frame(self, route: int, data: bytes | bytearray | memoryview) -> None:
+        async with self.__send_lock:
+            self.writer.write(create_frame_header(route, FRAME_KIND_DATA, len(data)))
+            self.writer.write(data)
+            await self.writer.drain()
+
+    # Sends a frame holding the content of a file, without reading it into memory at once
+    async def send_file_frame(self, route: int, file_path: str | Path) -> None:
+        with open(file_path, 'rb') as file:
+            file_size = os.fstat(file.fileno()).st_size
+            async with self.__send_lock:
+                self.writer.write(create_frame_header(route, FRAME_KIND_FILE, file_size))
+                await self.writer.drain()
+                await asyncio.get_running_loop().sendfile(self.writer.transport, file, count=file_size)
+
+    # Waits for the next frame received on a route (a buffer, or the path of a file frame).
+    # Frames that arrived before the connection closed are still returned; after them, raises ConnectionClosed.
+    async def get_frame(self, route: int) -> bytearray | Path:
+        frames = self.__get_queue(route)
+        if frames.empty() and not self.running:
+            raise ConnectionClosed("Connection closed")
+        frame = await frames.get()
+        if frame is CONNECTION_CLOSED:
+            frames.put_nowait(frame)  # For the next caller
+            raise ConnectionClosed("Connection closed")
+        return frame
+
+    # Tells the peer the connection is closing, then closes it.
+    # Received frames that were never collected are dropped (and their files removed).
+    async def close(self) -> None:
+        if self.running:
+            try:
+                await self.send_frame(CHANNEL_CONTROL, CONTROL_CLOSE)
+            except OSError:
+                pass  # The peer already closed it
+        self.writer.close()
+        self.__reader_task.cancel()
+
+        for frames in self.__queues.values():
+            while not frames.empty():
+                frame = frames.get_nowait()
+                if frame is not CONNECTION_CLOSED:
+                    discard_frame(frame)
+        self.__stop()
+
+    # Reader task: receives frames until the connection closes and queues each one under its route
+    async def __receive_frames(self) -> None:
+        try:
+            while self.running:
+                route, kind, length = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+                if kind == FRAME_KIND_FILE:
+                    frame = await self.__receive_to_file(length)
+                else:
+                    frame = bytearray(await self.reader.readexactly(length))
+
+                if is_close_notice(route, frame):
+                    break
+                # Stops reading while the route's queue is full (see FRAME_QUEUE_SIZE)
+                await self.__get_queue(route).put(frame)
+        except (asyncio.IncompleteReadError, OSError):
+            pass  # The connection closed
+        self.__stop()
+
+    # Receives a file frame straight into a new file in the spool directory, one chunk at a time
+    async def __receive_to_file(self, size: int) -> Path:
+        file_descriptor, file_path = tempfile.mkstemp(prefix='p2p-', dir=self.spool_directory)
+        try:
+            with open(file_descriptor, 'wb') as file:
+                remaining_size = size
+                while remaining_size:
+                    chunk = await self.reader.readexactly(min(self.chunk_size, remaining_size))
+                    file.write(chunk)
+                    remaining_size -= len(chunk)
+        except BaseException:
+            os.remove(file_path)
+            raise
+        return Path(file_path)
+
+    # Marks the connection closed and wakes up every waiting reader
+    # (nobody waits on a full queue, whose frames are taken before get_frame sees the connection closed)
+    def __stop(self) -> None:
+        self.running = False
+        for frames in self.__queues.values():
+            if not frames.full():
+                frames.put_nowait(CONNECTION_CLOSED)
+
+    # Returns the queue of a route, creating it on first use
+    def __get_queue(self, route: int) -> asyncio.Queue:
+        if route not in self.__queues:
+            self.__queues[route] = asyncio.Queue(maxsize=FRAME_QUEUE_SIZE)
+        return self.__queues[route]
+
+
+# AsyncChannelEndpoint is the asyncio version of ChannelEndpoint:
+# one side (sending or receiving) of a session over an AsyncFramedConnection
+class AsyncChannelEndpoint:
+    connection: AsyncFramedConnection
+    is_sender: bool
+
+    def __init__(self, connection: AsyncFramedConnection, is_sender: bool) -> None:
+        self.connection = connection
+        self.is_sender = is_sender
+
+    # Sends a message to the other side of the session
+    async def send_message(self, data: bytes | bytearray | memoryview, channel: int = CHANNEL_DATA) -> None:
+        await self.connection.send_frame(get_outgoing_route(channel, self.is_sender), data)
+
+    # Waits for the next message from the other side of the session
+    async def get_message(self, channel: int = CHANNEL_DATA) -> bytearray:
+        return read_frame(await self.connection.get_frame(get_incoming_route(channel, self.is_sender)))
+
+    # Sends a file as binary data, streamed from disk
+    async def send_file(self, file_path: str | Path, channel: int = CHANNEL_DATA) -> None:
+        await self.connection.send_file_frame(get_outgoing_route(channel, self.is_sender), file_path)
+
+    # Waits for a file from the other side of the session and moves it to the given output path
+    async def get_file(self, output_path: str | Path, channel: int = CHANNEL_DATA) -> None:
+        save_frame(await self.connection.get_frame(get_incoming_route(channel, self.is_sender)), output_path)
+
+    # Closes the underlying connection (both sides of the session share it)
+    async def close(self) -> None:
+        await self.connection.close()
+
+
+# AsyncPeerConnector is the asyncio version of PeerConnector (see BasePeerConnector):
+# the peer is dialed by a task while the listener accepts the peer's connection
+class AsyncPeerConnector(BasePeerConnector):
+    def __init__(self, peer_ip: str, port: int = DEFAULT_PORT, peer_port: int | None = None,
+                 chunk_size: int = RECV_CHUNK_SIZE, spool_directory: str | Path | None = None) -> None:
+        super().__init__(peer_ip, port, peer_port, chunk_size, spool_directory)
+        self.__connected = asyncio.Event()
+
+    # Connects to the peer and returns the (sending, receiving) endpoints of the session.
+    # Raises TimeoutError if the peer can't be reached within CONNECT_TIMEOUT_IN_SECONDS.
+    async def connect(self) -> tuple[AsyncChannelEndpoint, AsyncChannelEndpoint]:
+        listener = await AsyncSharedListener.acquire(self.port)
+        listener.register(self)
+        dial_task = asyncio.create_task(self.__dial())
+        try:
+            await asyncio.wait_for(self.__connected.wait(), CONNECT_TIMEOUT_IN_SECONDS)
+        except TimeoutError:
+            self.give_up()
+            raise TimeoutError(f"Could not connect to peer at {self.peer_ip}:{self.peer_port}") from None
+        finally:
+            dial_task.cancel()
+            listener.unregister(self)
+            listener.release()
+
+        print(f"Connected to peer at {self.peer_ip}:{self.peer_port}")
+        sender_stream, receiver_stream = self.result
+        sender_connection = AsyncFramedConnection(*sender_stream, self.chunk_size, self.spool_directory)
+        receiver_connection = sender_connection if receiver_stream is sender_stream else \
+            AsyncFramedConnection(*receiver_stream, self.chunk_size, self.spool_directory)
+        return AsyncChannelEndpoint(sender_connection, True), AsyncChannelEndpoint(receiver_connection, False)
+
+    # Keeps dialing the peer until it answers or the session got its connection
+    async def __dial(self) -> None:
+        while self.is_waiting():
+            try:
+                stream = await asyncio.open_connection(self.peer_address, self.peer_port)
+            except OSError:
+                await asyncio.sleep(CONNECT_RETRY_INTERVAL_IN_SECONDS)  # Wait before retrying
+                continue
+            try:
+                stream[1].write(create_hello(self.nonce, self.port))
+                peer_nonce, _ = await receive_hello(stream[0])
+            except OSError:
+                # The peer's listener turned the connection down (its session isn't waiting yet)
+                stream[1].close()
+                await asyncio.sleep(CONNECT_RETRY_INTERVAL_IN_SECONDS)
+                continue
+            self._add_connection(stream, peer_nonce, dialed=True)
+            return
+
+    def _add_connection(self, stream: Stream, peer_nonce: bytes, dialed: bool) -> None:
+        if not self._keeps(stream, peer_nonce, dialed):
+            stream[1].close()
+        elif self.result is not None:
+            self.__connected.set()
+
+
+# AsyncSharedListener is the asyncio version of SharedListener (see BaseSharedListener):
+# one server per port for every session of the event loop
+class AsyncSharedListener(BaseSharedListener):
+    server: asyncio.Server | None
+
+    __listeners: dict[int, 'AsyncSharedListener'] = {}
+
+    def __init__(self, port: int) -> None:
+        super().__init__(port)
+        self.server = None
+
+    # Returns the listener of a port, starting its server if no session listens on it yet
+    @classmethod
+    async def acquire(cls, port: int) -> 'AsyncSharedListener':
+        listener = cls.__listeners.get(port)
+        if listener is None:
+            listener = cls.__listeners[port] = AsyncSharedListener(port)
+            try:
+                listener.server = await asyncio.start_server(listener.__route, '0.0.0.0', port, reuse_address=True)
+            except OSError:
+                del cls.__listeners[port]
+                raise
+        listener._users += 1
+        return listener
+
+    # Gives back a listener obtained from acquire; the last user closes it.
+    # Only the listening socket is closed: the connections it accepted were handed to their sessions
+    # (which is also why this doesn't wait for the server to close: from Python 3.12 on, that waits
+    # for every accepted connection to be closed as well).
+    def release(self) -> None:
+        self._users -= 1
+        if self._users == 0:
+            del AsyncSharedListener.__listeners[self.port]
+            self.server.close()
+
+    # Hands an accepted connection to the session it belongs to, or closes it if there is none
+    async def __route(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        address = writer.get_extra_info('peername')[0]
+        try:
+            hello = await asyncio.wait_for(reader.readexactly(HELLO.size), CONNECT_TIMEOUT_IN_SECONDS)
+            session = self._find_session(hello, address)
+        except (asyncio.IncompleteReadError, OSError, TimeoutError):
+            writer.close()
+            return
+        if session is None:
+            writer.close()
+            return
+        writer.write(create_hello(session.nonce, self.port))
+        session.add_accepted((reader, writer), parse_hello(hello)[0])
+
+
+# Receives the hello that opens a connection and returns the peer's session nonce and listening port.
+# Raises ConnectionError if the connection closed or isn't from a peer.
+async def receive_hello(reader: asyncio.StreamReader) -> tuple[bytes, int]:
+    try:
+        return parse_hello(await reader.readexactly(HELLO.size))
+    except asyncio.IncompleteReadError as e:
+        return parse_hello(e.partial)
@@ -0,0 +1,335 @@
+import asyncio
+import shutil
+from pathlib import Path
+from queue import Full
+from typing import Any
+
+from async_connection import CONNECTION_CLOSED, AsyncChannelEndpoint, AsyncPeerConnector
+from flow_control import CREDIT_GRANT, AsyncCreditGate, ConnectionClosed
+from multiplexed_connection import CHANNEL_CONTROL, CHANNEL_HANDSHAKE
+from picture_encryption_socket import TILE_FORMAT_STREAM, KeyExchange, PictureEncryptionSocket, advance_key_exchange
+from pipeline_stage import AsyncPipelineStage, run_job
+from session_cipher import SessionCipher
+from utils import create_random_name_directory, generate_random_filename, get_temp_dir
+
+
+class AsyncPictureEncryptionSocket(PictureEncryptionSocket):
+    """
+    asyncio version of PictureEncryptionSocket, with the same options and the same protocol
+    (an AsyncPictureEncryptionSocket can talk to a PictureEncryptionSocket).
+
+    The whole session runs on the event loop, without a thread of its own: the key exchange and
+    every pipeline stage are tasks, connected by asyncio queues, and the network reads and writes
+    are awaited. The CPU-heavy steps (hiding in and revealing from images, encoding and decoding
+    the parts, encryption and compression) run as jobs on the scheduler given with the scheduler
+    option (or on the event loop's default executor) and the tile encoding processes, so they never
+    block the event loop.
+
+        sock = AsyncPictureEncryptionSocket(peer_ip)
+        await sock.connect()
+        await sock.send_text('hello')
+        async for message in sock:
+            ...
+        await sock.close()
+    """
+
+    def __init__(self, peer_ip: str, **options: Any) -> None:
+        """
+        Initialize the socket with the target peer's IP address and the options of PictureEncryptionSocket.
+        """
+        super().__init__(peer_ip, **options)
+        self.send_credit = AsyncCreditGate()  # Messages the peer can still accept
+        self.send_queue = asyncio.Queue()  # Messages to send, bounded by the peer's credit
+        self.recv_queue = asyncio.Queue(maxsize=self.receive_window.high_watermark)  # Decrypted messages
+        self.__stages: list[AsyncPipelineStage] = []
+        self.__tasks: set[asyncio.Task] = set()  # Key exchanges and credit grants in progress
+
+    async def connect(self) -> None:
+        """
+        Connects to the peer on the running event loop, then starts the send and receive pipelines.
+        Raises TimeoutError if the peer can't be reached.
+        """
+        connector = AsyncPeerConnector(self.peer_ip, self.port, self.peer_port, self.transfer_chunk_size)
+        await self.attach(*await connector.connect())
+
+    async def attach(self, sender: AsyncChannelEndpoint, receiver: AsyncChannelEndpoint) -> None:
+        """
+        Starts the send and receive pipelines on a connection with the peer that is already
+        established (e.g. accepted by a hub), given as its sending and receiving endpoints.
+        """
+        self.peer_send = sender
+        self.peer_receive = receiver
+        self.peer_connected.set()
+
+        self.__start_task(self.__send_loop())
+        self.__start_task(self.__receive_loop())
+
+    async def send(self, data: bytes | bytearray | memoryview, block: bool = True, timeout: float | None = None) -> None:
+        """
+        Queues data to be sent; see PictureEncryptionSocket.send.
+        Waiting for credit doesn't block the event loop.
+        """
+        await self.__queue_message(data, block, timeout)
+
+    async def send_text(self, text: str, block: bool = True, timeout: float | None = None) -> None:
+        """
+        Queues text to be sent; see PictureEncryptionSocket.send_text.
+        """
+        await self.__queue_message(text, block, timeout)
+
+    async def receive(self) -> bytes:
+        """
+        Waits for the next message. Messages received before the connection stopped are still returned.
+        Raises ConnectionClosed once the connection is closed.
+        """
+        if self.recv_queue.empty() and not self.is_connected:
+            raise ConnectionClosed("Connection closed")
+        message = await self.recv_queue.get()
+        if message is CONNECTION_CLOSED:
+            self.recv_queue.put_nowait(message)  # For the next caller
+            raise ConnectionClosed("Connection closed")
+        self._consume_credit()
+        return message
+
+    async def receive_text(self) -> str:
+        """
+        Waits for the next message and decodes it with the text encoding agreed with the peer.
+        """
+        return (await self.receive()).decode(self.receive_encoding)
+
+    def __aiter__(self) -> 'AsyncPictureEncryptionSocket':
+        return self
+
+    async def __anext__(self) -> bytes:
+        """
+        Iterates over the received messages until the connection is closed.
+        """
+        try:
+            return await self.receive()
+        except ConnectionClosed:
+            raise StopAsyncIteration
+
+    async def close(self) -> None:
+        """
+        Cleanly closes the connection, cancelling the pipeline tasks and closing the connection.
+        It may be called at any time, and more than once.
+        """
+        was_connected = self.is_connected
+        self.__stop()
+        await asyncio.gather(*self.__tasks, *(stage.join() for stage in self.__stages), return_exceptions=True)
+
+        if self.peer_connected.is_set():
+            self.peer_connected.clear()
+            await self.peer_receive.close()
+            await self.peer_send.close()
+
+        if self.owns_tile_encoder:
+            await asyncio.to_thread(self.tile_encoder.close)
+        if was_connected:
+            print("Connection closed.")
+
+    def _send_credit(self, credit: int) -> None:
+        """
+        Grants the peer credit without waiting for it to be sent.
+        """
+        self.__start_task(self.__grant_credit(credit))
+
+    async def __grant_credit(self, credit: int) -> None:
+        """
+        Sends a credit grant; it's lost if the connection already stopped.
+        """
+        try:
+            await self.peer_receive.send_message(CREDIT_GRANT.pack(credit), CHANNEL_CONTROL)
+        except OSError:
+            pass
+
+    async def __queue_message(self, content: bytes | bytearray | memoryview | str, block: bool,
+                              timeout: float | None) -> None:
+        """
+        Takes one credit for a message (see PictureEncryptionSocket.send) and adds it to the send queue.
+        """
+        if not self.is_connected:
+            raise Exception("Socket not connected")
+        if not await self.send_credit.acquire(block, timeout):
+            raise Full("The peer's receive window is full")
+        self.send_queue.put_nowait(content)
+
+    async def __send_loop(self) -> None:
+        """
+        Runs the key exchange of the send direction, then starts the send pipeline stages
+        (see PictureEncryptionSocket).
+        """
+        try:
+            # Start the tile encoding processes while the key exchange is running
+            if self.owns_tile_encoder:
+                tile_encoder_started = asyncio.ensure_future(asyncio.to_thread(self.tile_encoder.start))
+            self.send_cipher = SessionCipher(await self.__run_key_exchange(self._send_key_exchange(), self.peer_send))
+            if self.owns_tile_encoder:
+                await tile_encoder_started
+        except Exception:
+            self.__stop()
+            return
+
+        # Bounded queues between the stages
+        compressed_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+        hidden_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+        packaged_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+
+        self.__start_stages([
+            AsyncPipelineStage('send-credit', self.__credit_stage, None, None, self.__on_stage_error),
+            AsyncPipelineStage('send-compress', self._compress_stage, self.send_queue, compressed_queue,
+                               self.__on_stage_error, executor=self.stage_executor),
+            AsyncPipelineStage('send-hide', self._hide_stage, compressed_queue, hidden_queue,
+                               self.__on_stage_error, executor=self.stage_executor),
+            AsyncPipelineStage('send-package', self._package_stage, hidden_queue, packaged_queue,
+                               self.__on_stage_error, fan_out=self.tile_format == TILE_FORMAT_STREAM,
+                               executor=self.stage_executor),
+            AsyncPipelineStage('send-transmit', self.__transmit_stage, packaged_queue, None, self.__on_stage_error),
+        ])
+
+    async def __receive_loop(self) -> None:
+        """
+        Runs the key exchange of the receive direction, opens the receive window, then starts
+        the receive pipeline stages (see PictureEncryptionSocket).
+        """
+        try:
+            self.receive_cipher = SessionCipher(await self.__run_key_exchange(self._receive_key_exchange(),
+                                                                              self.peer_receive))
+        except Exception:
+            self.__stop()
+            return
+
+        # Open the receive window: the peer may send up to the high watermark
+        credit = self.receive_window.open()
+        if credit:
+            self._send_credit(credit)
+
+        # Bounded queues between the stages
+        received_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+        unpacked_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+        revealed_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+        decrypted_queue = asyncio.Queue(maxsize=self.stage_queue_size)
+
+        self.__start_stages([
+            AsyncPipelineStage('receive-read', self.__read_stage, None, received_queue, self.__on_stage_error),
+            AsyncPipelineStage('receive-unpack', self._unpack_stage, received_queue, unpacked_queue,
+                               self.__on_stage_error, executor=self.stage_executor),
+            AsyncPipelineStage('receive-reveal', self._reveal_stage, unpacked_queue, revealed_queue,
+                               self.__on_stage_error, executor=self.stage_executor),
+            AsyncPipelineStage('receive-decrypt', self._decrypt_stage, revealed_queue, decrypted_queue,
+                               self.__on_stage_error, executor=self.stage_executor),
+            AsyncPipelineStage('receive-decompress', self._decompress_stage, decrypted_queue, self.recv_queue,
+                               self.__on_stage_error, executor=self.stage_executor),
+        ])
+
+    async def __run_key_exchange(self, key_exchange: KeyExchange, endpoint: AsyncChannelEndpoint) -> bytes:
+        """
+        Runs a key exchange (see advance_key_exchange) over the handshake channel of one side of
+        the session, and returns the shared secret key. Its computing steps (generating the
+        Diffie-Hellman keys) run as jobs, between the awaited messages.
+        """
+        message = None
+        while True:
+            done, request = await run_job(self.stage_executor, advance_key_exchange, key_exchange, message)
+            if done:
+                return request
+            message = None
+            if request is None:
+                message = await endpoint.get_message(CHANNEL_HANDSHAKE)
+            else:
+                await endpoint.send_message(request, CHANNEL_HANDSHAKE)
+
+    async def __credit_stage(self) -> None:
+        """
+        Source stage of the send pipeline: adds the credit the peer grants as it reads the messages.
+        """
+        (credit,) = CREDIT_GRANT.unpack(await self.peer_send.get_message(CHANNEL_CONTROL))
+        self.send_credit.grant(credit)
+
+    async def __transmit_stage(self, packaged: bytes | tuple[Path, Path]) -> None:
+        """
+        Last send stage: sends the packaged image parts (or one stream frame) to the peer,
+        followed by the tag that authenticates the transfer.
+        """
+        if isinstance(packaged, bytes):
+            await self.peer_send.send_message(packaged)
+            await self.peer_send.send_message(self.send_cipher.sign_transfer(packaged))
+            return
+
+        temp_directory, parts_zip_path = packaged
+
+        # Send the zip file containing image parts to the peer
+        await self.peer_send.send_file(parts_zip_path)
+        tag = await run_job(self.stage_executor, self.send_cipher.sign_transfer_file, parts_zip_path)
+        await self.peer_send.send_message(tag)
+
+        # Clean up temporary files and directory
+        await run_job(self.stage_executor, shutil.rmtree, temp_directory)
+
+    async def __read_stage(self) -> bytearray | tuple[Path, Path]:
+        """
+        First receive stage: reads the next package of image parts from the network and checks
+        the tag that follows it (see PictureEncryptionSocket).
+        """
+        if self.in_memory:
+            package = await self.peer_receive.get_message()
+            self.receive_cipher.verify_transfer(package, await self.peer_receive.get_message())
+            return package
+
+        # Create temporary directory for received files
+        temp_directory = create_random_name_directory(16, get_temp_dir())
+
+        parts_zip_path = temp_directory / generate_random_filename(16, 'zip')
+
+        # Receive the zip file containing the image parts
+        await self.peer_receive.get_file(parts_zip_path)
+        try:
+            await run_job(self.stage_executor, self.receive_cipher.verify_transfer_file, parts_zip_path,
+                          await self.peer_receive.get_message())
+        except ValueError:
+            shutil.rmtree(temp_directory)
+            raise
+
+        return temp_directory, parts_zip_path
+
+    def __start_stages(self, stages: list[AsyncPipelineStage]) -> None:
+        """
+        Starts pipeline stages, unless the socket already stopped.
+        """
+        if not self.is_connected:
+            return
+        self.__stages.extend(stages)
+        for stage in stages:
+            stage.start()
+
+    def __start_task(self, coroutine: Any) -> None:
+        """
+        Runs a coroutine as a task of the socket, which close() cancels if it is still running.
+        """
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    def __on_stage_error(self, error: Exception) -> None:
+        """
+        Called when a pipeline stage fails; stops the whole connection.
+        The connection closing (and anything failing once the socket is stopping) is a normal stop, not reported.
+        """
+        if not isinstance(error, ConnectionClosed) and self.is_connected:
+            print(f"Pipeline stage failed: {error}")
+        self.__stop()
+
+    def __stop(self) -> None:
+        """
+        Stops the session: cancels the key exchanges and pipeline stages, and wakes up
+        the senders waiting for credit and receive().
+        """
+        self.is_connected = False
+        self.stop_event.set()
+        self.send_credit.close()
+        for task in self.__tasks:
+            task.cancel()
+        for stage in self.__stages:
+            stage.cancel()
+        if self.recv_queue.empty():
+            self.recv_queue.put_nowait(CONNECTION_CLOSED)
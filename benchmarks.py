@@ -0,0 +1,471 @@
+# Benchmarks for the performance-sensitive parts of the picture encryption pipeline.
+# Usage: python benchmarks.py [benchmark_name ...]   (runs every benchmark when no name is given)
+import asyncio
+import contextlib
+import io
+import math
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from queue import Full
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+from async_picture_encryption_socket import AsyncPictureEncryptionSocket
+from dh_key_exchange import MODP_GROUPS, DH_Endpoint, generate_private_key
+from multiplexed_connection import PeerConnector
+from p2p import Peer2Peer
+from payload_codec import compress_payload, decompress_payload, get_available_codecs
+from picture_encryption_hub import PictureEncryptionHub
+from picture_encryption_socket import MAX_CONTENT_LENGTH, PictureEncryptionSocket
+from session_cache import derive_resumed_key, derive_resumption_secret
+from steganography import get_carrier_size, hide_bytes_in_image, reveal_bytes_from_image
+from utils import find_primitive_root, get_primes_in_range, random_prime_number
+
+
+# Runs `function` `repeat` times and returns the best wall-clock time in seconds
+def measure(function: Callable[[], object], repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Prints one result line in a fixed-width table layout
+def report(name: str, seconds: float, extra: str = '') -> None:
+    print(f"  {name:<40} {seconds * 1000:>10.2f} ms  {extra}")
+
+
+# Compares the NumPy LSB engine with stegano.lsb at the maximum content length (640x480 carrier)
+def benchmark_steganography() -> None:
+    print(f"Steganography, {MAX_CONTENT_LENGTH} byte payload in a 640x480 carrier:")
+    carrier = Image.fromarray(np.random.randint(0, 256, (480, 640, 3), dtype=np.uint8))
+    # ASCII payload, so stegano (which hides UTF-8 text) stores exactly the same number of bytes
+    payload = np.random.randint(ord('a'), ord('z') + 1, MAX_CONTENT_LENGTH, dtype=np.uint8).tobytes()
+
+    secret_image = hide_bytes_in_image(carrier, payload)
+    assert reveal_bytes_from_image(secret_image) == payload
+    numpy_hide = measure(lambda: hide_bytes_in_image(carrier, payload))
+    numpy_reveal = measure(lambda: reveal_bytes_from_image(secret_image))
+    report('numpy hide', numpy_hide)
+    report('numpy reveal', numpy_reveal)
+
+    try:
+        from stegano import lsb
+    except ImportError:
+        print("  stegano is not installed, skipping the comparison")
+        return
+
+    message = payload.decode('latin1')
+    # stegano closes the image it is given, so hand it a copy
+    stegano_hide = measure(lambda: lsb.hide(carrier.copy(), message), repeat=1)
+    stegano_image = lsb.hide(carrier.copy(), message)
+    stegano_reveal = measure(lambda: lsb.reveal(stegano_image), repeat=1)
+    report('stegano hide', stegano_hide, f"numpy is {stegano_hide / numpy_hide:.0f}x faster")
+    report('stegano reveal', stegano_reveal, f"numpy is {stegano_reveal / numpy_reveal:.0f}x faster")
+
+
+# Compares the payload codecs on UTF-16 chat text: compressed size, carrier size and time
+def benchmark_compression() -> None:
+    words = ['hello', 'how', 'are', 'you', 'the', 'picture', 'message', 'send', 'today', 'see']
+    for text_length in (200, 5000, MAX_CONTENT_LENGTH // 2):
+        text = ' '.join(np.random.choice(words, text_length // 5))[:text_length]
+        content = text.encode('utf-16')
+        print(f"Compression, {len(content)} byte UTF-16 text:")
+        for codec in get_available_codecs():
+            payload = compress_payload(content, codec)
+            assert decompress_payload(payload) == content
+            width, height = get_carrier_size(len(payload))
+            report(f'{codec} compress', measure(lambda: compress_payload(content, codec)),
+                   f"{len(payload)} bytes, {width}x{height} carrier")
+
+
+# Runs both sides of a Diffie-Hellman exchange with the given parameters and checks they agree
+def run_key_exchange(p: int, g: int) -> None:
+    sender = DH_Endpoint(p, g, generate_private_key(p))
+    receiver = DH_Endpoint(p, g, generate_private_key(p))
+    sender_public_key, receiver_public_key = sender.generate_public_key(), receiver.generate_public_key()
+    assert sender.generate_full_key(receiver_public_key) == receiver.generate_full_key(sender_public_key)
+
+
+# The prime search that used to run on every connect: trial division of every number in the range
+def trial_division_primes(min_value: int, max_value: int) -> list[int]:
+    return [num for num in range(max(min_value, 2), max_value + 1)
+            if all(num % i for i in range(2, math.isqrt(num) + 1))]
+
+
+# Measures the key exchange part of connecting: legacy small primes (with their prime search and
+# the old g ** x % p arithmetic) against modular exponentiation over the RFC 3526 groups
+def benchmark_handshake() -> None:
+    print("Diffie-Hellman handshake (both sides):")
+    report('legacy parameters, trial division', measure(
+        lambda: find_primitive_root.__wrapped__(random.choice(trial_division_primes(100, 99999))), repeat=1),
+        "before: searched on every connect")
+    get_primes_in_range.cache_clear()
+    find_primitive_root.cache_clear()
+    report('legacy parameters, first connect', measure(lambda: find_primitive_root(random_prime_number()), repeat=1),
+           "sieve, computed once")
+    report('legacy parameters, later connects', measure(lambda: find_primitive_root(random_prime_number())),
+           "cached primes (and roots of primes seen before)")
+
+    p = random_prime_number()
+    g = find_primitive_root(p)
+    private_keys = [random.randint(10000, 99999) for _ in range(2)]
+    # The original arithmetic: raise to the full power, then reduce
+    report('legacy g ** x % p', measure(lambda: [g ** private_key % p for private_key in private_keys], repeat=1),
+           f"{p.bit_length()}-bit prime")
+    report('legacy with pow(g, x, p)', measure(lambda: run_key_exchange(p, g)), f"{p.bit_length()}-bit prime")
+
+    for group, (p, g) in MODP_GROUPS.items():
+        report(f'MODP group {group}', measure(lambda: run_key_exchange(p, g)), f"{p.bit_length()}-bit prime")
+
+    # Resuming a cached session replaces the exchange with key derivation from fresh nonces
+    resumption_secret = derive_resumption_secret(secrets.token_bytes(32))
+    report('resumed session', measure(lambda: derive_resumed_key(resumption_secret, secrets.token_bytes(16),
+                                                                 secrets.token_bytes(16))), "no Diffie-Hellman")
+
+
+# Third-party packages that are slow to import
+HEAVY_DEPENDENCIES = ('numpy', 'PIL', 'Crypto', 'requests', 'sympy', 'stegano')
+
+
+# Imports a module in a fresh interpreter with -X importtime and returns its cumulative import time
+# in seconds, along with the heavy dependencies the import pulled in
+def measure_import(module_name: str) -> tuple[float, list[str]]:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                            capture_output=True, text=True, check=True, cwd=Path(__file__).parent)
+    # Each line reads "import time: <self us> | <cumulative us> | <indented module name>"
+    import_times = [line.split('|') for line in result.stderr.splitlines() if line.startswith('import time:')]
+    imported_modules = {name.strip() for _, _, name in import_times}
+    cumulative_time = next(int(cumulative) for _, cumulative, name in import_times if name.strip() == module_name)
+    return cumulative_time / 1e6, [name for name in HEAVY_DEPENDENCIES if name in imported_modules]
+
+
+# Measures cold-start import times: ui is what runs before the configuration dialog appears,
+# picture_encryption_socket is loaded in the background and on connect
+def benchmark_startup() -> None:
+    print("Cold-start import time (python -X importtime, best of 3):")
+    for module_name in ('ui', 'picture_encryption_socket'):
+        measurements = [measure_import(module_name) for _ in range(3)]
+        seconds = min(import_time for import_time, _ in measurements)
+        report(f'import {module_name}', seconds, f"loads: {', '.join(measurements[0][1]) or 'no heavy dependencies'}")
+
+
+# Peer2Peer with the receive loop it used to have: 1024-byte reads appended to a bytes object
+class LegacyPeer2Peer(Peer2Peer):
+    def _recv_exactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            packet = self.connection_socket.recv(min(1024, size - len(data)))
+            if not packet:
+                return b""
+            data += packet
+        return data
+
+
+# Returns a TCP port that is currently free on this machine
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+# Connects a sending and a receiving Peer2Peer to each other over loopback
+def connect_loopback_peers(receiver_class: type[Peer2Peer] = Peer2Peer) -> tuple[Peer2Peer, Peer2Peer]:
+    first_port, second_port = get_free_port(), get_free_port()
+    peers = {}
+    # Each constructor waits for the other side to connect, so both are created at the same time
+    receiver_thread = threading.Thread(
+        target=lambda: peers.update(receiver=receiver_class('127.0.0.1', first_port, second_port)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        receiver_thread.start()
+        sender = Peer2Peer('127.0.0.1', second_port, first_port)
+        receiver_thread.join()
+    return sender, peers['receiver']
+
+
+# Measures message throughput over loopback, for the current receive path and the legacy one
+def benchmark_transfer() -> None:
+    print("Peer2Peer loopback transfer (send_message -> get_message):")
+    for receiver_name, receiver_class, max_size in (('recv_into', Peer2Peer, 50_000_000),
+                                                    ('legacy 1 KB reads', LegacyPeer2Peer, 1_000_000)):
+        sender, receiver = connect_loopback_peers(receiver_class)
+        for message_size in (100_000, 1_000_000, 10_000_000, 50_000_000):
+            if message_size > max_size:
+                continue
+            message = secrets.token_bytes(message_size)
+
+            def transfer() -> None:
+                sender.send_message(message)
+                assert len(receiver.get_message()) == message_size
+
+            seconds = measure(transfer, repeat=3)
+            report(f'{receiver_name}, {message_size / 1e6:g} MB', seconds, f"{message_size / seconds / 1e6:.0f} MB/s")
+        with contextlib.redirect_stdout(io.StringIO()):
+            sender.close()
+            receiver.close()
+
+    # File transfers are streamed from and to disk, so the memory they use is bounded by the chunk size
+    sender, receiver = connect_loopback_peers()
+    with tempfile.TemporaryDirectory() as directory:
+        source_path, output_path = Path(directory) / 'source', Path(directory) / 'output'
+        for file_size in (10_000_000, 50_000_000):
+            source_path.write_bytes(secrets.token_bytes(file_size))
+
+            def transfer_file() -> None:
+                sender.send_file(source_path)
+                receiver.get_file(output_path)
+
+            tracemalloc.start()
+            seconds = measure(transfer_file, repeat=3)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert output_path.stat().st_size == file_size
+            report(f'send_file -> get_file, {file_size / 1e6:g} MB', seconds,
+                   f"{file_size / seconds / 1e6:.0f} MB/s, peak {peak_memory / 1e6:.1f} MB allocated")
+    with contextlib.redirect_stdout(io.StringIO()):
+        sender.close()
+        receiver.close()
+
+
+# Connects both directions of a session between two peers the way the sockets used to:
+# two Peer2Peer objects per peer, so four TCP connections in all
+def connect_peer2peer_pairs() -> list[Peer2Peer]:
+    ports = [get_free_port() for _ in range(4)]
+    port_pairs = ((ports[0], ports[1]), (ports[1], ports[0]), (ports[2], ports[3]), (ports[3], ports[2]))
+    peers = []
+    threads = [threading.Thread(target=lambda send_port=send_port, receive_port=receive_port:
+                                peers.append(Peer2Peer('127.0.0.1', send_port, receive_port)))
+               for send_port, receive_port in port_pairs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return peers
+
+
+# Connects both directions of a session between two peers over a single multiplexed connection
+def connect_multiplexed_peers() -> list:
+    first_port, second_port = get_free_port(), get_free_port()
+    endpoints = []
+    threads = [threading.Thread(target=lambda port=port, peer_port=peer_port:
+                                endpoints.extend(PeerConnector('127.0.0.1', port, peer_port).connect()))
+               for port, peer_port in ((first_port, second_port), (second_port, first_port))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return endpoints
+
+
+# Compares the time to connect two peers (both directions) with four Peer2Peer connections and with one
+# multiplexed connection, then the round trip of a small message on each
+def benchmark_connect() -> None:
+    print("Connection setup between two peers over loopback:")
+    for name, connect in (('four Peer2Peer connections', connect_peer2peer_pairs),
+                          ('one multiplexed connection', connect_multiplexed_peers)):
+        def setup() -> None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for peer in connect():
+                    peer.close()
+
+        report(name, measure(setup, repeat=5))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        first_sender, first_receiver, second_sender, second_receiver = connect_multiplexed_peers()
+
+    def round_trip() -> None:
+        first_sender.send_message(b'ping')
+        second_receiver.get_message()
+        second_receiver.send_message(b'pong')
+        first_sender.get_message()
+
+    report('multiplexed round trip, 4 bytes', measure(round_trip, repeat=100))
+    for endpoint in (first_sender, first_receiver, second_sender, second_receiver):
+        endpoint.close()
+
+
+# Measures the round trip of a short message through a loopback socket (send to the socket's own
+# receiving side), for the threaded socket and the asyncio one
+def benchmark_latency() -> None:
+    print("Loopback message round trip (send -> receive, 1 byte):")
+    with contextlib.redirect_stdout(io.StringIO()):
+        sock = PictureEncryptionSocket('127.0.0.1', encode_workers=1, port=get_free_port())
+        sock.connect()
+        sock.peer_connected.wait()
+
+    def round_trip() -> None:
+        sock.send(b'x')
+        sock.receive()
+
+    report('PictureEncryptionSocket', measure(round_trip, repeat=20))
+    with contextlib.redirect_stdout(io.StringIO()):
+        sock.close()
+
+    async def measure_async() -> float:
+        with contextlib.redirect_stdout(io.StringIO()):
+            async_sock = AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=get_free_port())
+            await async_sock.connect()
+        best = float('inf')
+        for _ in range(20):
+            start = time.perf_counter()
+            await async_sock.send(b'x')
+            await async_sock.receive()
+            best = min(best, time.perf_counter() - start)
+        with contextlib.redirect_stdout(io.StringIO()):
+            await async_sock.close()
+        return best
+
+    report('AsyncPictureEncryptionSocket', asyncio.run(measure_async()))
+
+
+# Load test of a hub: N peers connect to one hub on loopback and each sends messages the hub echoes back.
+# The peers run in the same process as the hub, so the figures include their own work too.
+def benchmark_hub(peer_counts: tuple[int, ...] = (1, 2, 4, 8, 16, 32, 64), messages_per_peer: int = 5) -> None:
+    print(f"Hub load test ({messages_per_peer} echoed messages of 500 bytes per peer, shared workers):")
+    message = secrets.token_bytes(500)
+
+    async def run_peers(peer_count: int) -> tuple[float, float, list[float]]:
+        hub = PictureEncryptionHub(get_free_port())
+        await hub.start()
+
+        async def echo() -> None:
+            async for session, received in hub:
+                await session.send(received)
+
+        echo_task = asyncio.create_task(echo())
+        peer_port = get_free_port()
+        peers = [AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=peer_port, peer_port=hub.port)
+                 for _ in range(peer_count)]
+        start = time.perf_counter()
+        await asyncio.gather(*(peer.connect() for peer in peers))
+        connect_seconds = time.perf_counter() - start
+
+        async def exchange(peer: AsyncPictureEncryptionSocket) -> float:
+            round_trip_seconds = 0.0
+            for _ in range(messages_per_peer):
+                sent = time.perf_counter()
+                await peer.send(message)
+                assert await peer.receive() == message
+                round_trip_seconds += time.perf_counter() - sent
+            return round_trip_seconds / messages_per_peer
+
+        start = time.perf_counter()
+        round_trips = await asyncio.gather(*(exchange(peer) for peer in peers))
+        exchange_seconds = time.perf_counter() - start
+
+        await asyncio.gather(*(peer.close() for peer in peers))
+        await hub.close()
+        echo_task.cancel()
+        return connect_seconds, exchange_seconds, round_trips
+
+    for peer_count in peer_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            connect_seconds, exchange_seconds, round_trips = asyncio.run(run_peers(peer_count))
+        # With fair scheduling the slowest peer's round trip stays close to the mean
+        report(f'{peer_count} peers', exchange_seconds,
+               f"{peer_count * messages_per_peer / exchange_seconds:.0f} msg/s, round trip mean "
+               f"{sum(round_trips) / peer_count * 1000:.1f} ms / slowest peer {max(round_trips) * 1000:.1f} ms, "
+               f"connect all {connect_seconds * 1000:.0f} ms")
+
+
+# Cost of idle hub sessions: N peers connect to one hub on loopback and then send nothing.
+# Reports the threads of the process (hub and peers together) and the CPU they use while idle.
+def benchmark_idle_sessions(session_counts: tuple[int, ...] = (1, 10, 50), idle_seconds: float = 2.0) -> None:
+    print(f"Idle hub sessions (threads of the process and CPU use over {idle_seconds:.0f} s without traffic):")
+
+    async def run_idle(session_count: int) -> tuple[int, int, float]:
+        threads_before = threading.active_count()
+        hub = PictureEncryptionHub(get_free_port())
+        await hub.start()
+        peer_port = get_free_port()
+        peers = [AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=peer_port, peer_port=hub.port)
+                 for _ in range(session_count)]
+        await asyncio.gather(*(peer.connect() for peer in peers))
+        # Let every key exchange finish before measuring
+        for peer in peers:
+            await peer.send(b'x')
+        for _ in range(session_count):
+            await hub.receive()
+
+        start_cpu, start = time.process_time(), time.perf_counter()
+        await asyncio.sleep(idle_seconds)
+        cpu_share = (time.process_time() - start_cpu) / (time.perf_counter() - start)
+        thread_count = threading.active_count() - threads_before
+
+        await asyncio.gather(*(peer.close() for peer in peers))
+        await hub.close()
+        return session_count, thread_count, cpu_share
+
+    for session_count in session_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            session_count, thread_count, cpu_share = asyncio.run(run_idle(session_count))
+        print(f"  {f'{session_count} idle sessions':<40} {thread_count:>6} threads  {cpu_share * 100:>6.1f}% CPU")
+
+
+# Credit-based flow control on a loopback socket: how many messages a receiver that stopped reading lets
+# the sender queue (bounded by the high watermark), and the throughput with a reader, per receive window.
+def benchmark_flow_control(windows: tuple[tuple[int, int], ...] = ((4, 2), (8, 4), (32, 16)),
+                           message_count: int = 40) -> None:
+    print(f"Flow control ({message_count} messages of 500 bytes, receive window high/low watermark):")
+    message = secrets.token_bytes(500)
+    for high_watermark, low_watermark in windows:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sock = PictureEncryptionSocket('127.0.0.1', encode_workers=1, port=get_free_port(),
+                                           receive_high_watermark=high_watermark,
+                                           receive_low_watermark=low_watermark)
+            sock.connect()
+            sock.peer_connected.wait()
+
+        # Nobody reads: the sender runs out of credit once the receive window is full
+        accepted = 0
+        try:
+            while accepted < message_count:
+                sock.send(message, timeout=1)
+                accepted += 1
+        except Full:
+            pass
+        for _ in range(accepted):
+            sock.receive()
+
+        reader = threading.Thread(target=lambda: [sock.receive() for _ in range(message_count)])
+        start = time.perf_counter()
+        reader.start()
+        for _ in range(message_count):
+            sock.send(message)
+        reader.join()
+        seconds = time.perf_counter() - start
+
+        report(f'window {high_watermark}/{low_watermark}', seconds,
+               f"{message_count / seconds:.0f} msg/s, stalled receiver holds {accepted} messages")
+        with contextlib.redirect_stdout(io.StringIO()):
+            sock.close()
+
+
+BENCHMARKS: dict[str, Callable[[], None]] = {
+    'steganography': benchmark_steganography,
+    'compression': benchmark_compression,
+    'handshake': benchmark_handshake,
+    'startup': benchmark_startup,
+    'transfer': benchmark_transfer,
+    'connect': benchmark_connect,
+    'latency': benchmark_latency,
+    'hub': benchmark_hub,
+    'idle_sessions': benchmark_idle_sessions,
+    'flow_control': benchmark_flow_control,
+}
+
+if __name__ == '__main__':
+    for benchmark_name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[benchmark_name]()
@@ -1,5 +1,7 @@
 from dataclasses import dataclass
+from pathlib import Path
 
+import numpy as np
 from PIL.ImageFile import ImageFile
 
 
@@ -13,5 +15,46 @@ class SplittedImageInfo:
     # The column index of the sub-image in the original image grid
     column: int
 
-    # The actual image tile
-    image: ImageFile
+    # The actual image tile (or a pixel array view of it)
+    image: ImageFile | np.ndarray
+
+    # The pixel offset of the tile's top-left corner in the original image
+    left: int = 0
+    top: int = 0
+
+
+# ImageParts is a data container for the tiles of one carrier image that travel together
+# between the pipeline stages: the grid the carrier was split into and the tiles themselves.
+# Not every tile of the grid has to be present (e.g. when only the payload tiles are sent).
+@dataclass
+class ImageParts:
+    # The number of rows and columns of the full grid
+    rows: int
+    columns: int
+
+    # The exact size of the original image
+    width: int
+    height: int
+
+    # The tiles, sorted by (row, column)
+    parts: list[SplittedImageInfo]
+
+    # The temporary directory holding this message's files (only used by the disk-backed path)
+    temp_directory: Path | None = None
+
+
+# CachedSession is what one side keeps from a finished key exchange so the next connection
+# to the same peer can resume the session instead of running Diffie-Hellman again.
+@dataclass
+class CachedSession:
+    # The ticket the receiving side issued for this session
+    ticket: bytes
+
+    # The secret both sides derived from the session key, from which the next key is derived
+    resumption_secret: bytes
+
+    # The peer the session was established with
+    peer_ip: str
+
+    # When the session can no longer be resumed (time.monotonic() clock)
+    expires_at: float
@@ -1,3 +1,75 @@
+import secrets
+from typing import Final
+
+# Standard Diffie-Hellman groups from RFC 3526 (More Modular Exponential (MODP) Diffie-Hellman groups).
+# Each prime p is a safe prime and the generator is 2. The primes are precomputed here, so no
+# prime search or primitive root computation is needed when connecting.
+MODP_GENERATOR: Final[int] = 2
+
+# 2048-bit MODP group (group 14)
+MODP_2048_PRIME: Final[int] = int(
+    'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+    '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+    '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+    'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+    '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+    '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+    'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+    '3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF', 16)
+
+# 3072-bit MODP group (group 15)
+MODP_3072_PRIME: Final[int] = int(
+    'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+    '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+    '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+    'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+    '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+    '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+    'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+    '3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33'
+    'A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7'
+    'ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864'
+    'D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2'
+    '08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF', 16)
+
+# 4096-bit MODP group (group 16)
+MODP_4096_PRIME: Final[int] = int(
+    'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+    '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+    '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+    'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+    '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+    '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+    'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+    '3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33'
+    'A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7'
+    'ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864'
+    'D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2'
+    '08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A92108011A723C12A787E6D7'
+    '88719A10BDBA5B2699C327186AF4E23C1A946834B6150BDA2583E9CA2AD44CE8'
+    'DBBBC2DB04DE8EF92E8EFC141FBECAA6287C59474E6BC05D99B2964FA090C3A2'
+    '233BA186515BE7ED1F612970CEE2D7AFB81BDD762170481CD0069127D5B05AA9'
+    '93B4EA988D8FDDC186FFB7DC90A6C08F4DF435C934063199FFFFFFFFFFFFFFFF', 16)
+
+# The MODP groups by their RFC 3526 group number, as (p, g)
+MODP_GROUPS: Final[dict[int, tuple[int, int]]] = {
+    14: (MODP_2048_PRIME, MODP_GENERATOR),
+    15: (MODP_3072_PRIME, MODP_GENERATOR),
+    16: (MODP_4096_PRIME, MODP_GENERATOR),
+}
+DEFAULT_MODP_GROUP: Final[int] = 14
+
+# Size of a random private key. 256 bits matches the ~128-bit security of the 3072-bit group
+# and keeps each modular exponentiation short, instead of using exponents as long as p.
+PRIVATE_KEY_BITS: Final[int] = 256
+
+
+# Generates a random private key for the given prime, using a cryptographically secure source
+def generate_private_key(p: int) -> int:
+    # Small (legacy) primes get a key below p instead
+    bits = min(PRIVATE_KEY_BITS, p.bit_length() - 1)
+    return secrets.randbelow(2 ** bits - 2) + 2
+
 # DH_Endpoint implements one side of the Diffie-Hellman key exchange protocol.
 # It can generate a public key and compute the shared secret key using the peer's public key.
 class DH_Endpoint(object):
@@ -15,16 +87,20 @@ class DH_Endpoint(object):
 
     # Generates and returns the public key to be shared with the other party
     def generate_public_key(self):
-        # Compute (g ^ private_key) mod p
-        partial_key = self.g ** self.private_key
-        partial_key = partial_key % self.p
+        # Compute (g ^ private_key) mod p with modular exponentiation,
+        # which never builds numbers larger than p
+        partial_key = pow(self.g, self.private_key, self.p)
         return partial_key
 
     # Given the other party's public key, compute the full shared key
     def generate_full_key(self, partial_key_r):
+        # Reject public keys that would force the shared key into a tiny subgroup (1 or p - 1).
+        # Only for the MODP groups: with the small legacy primes, p - 1 is a valid public key
+        # that a random private key produces now and then.
+        if (self.p, self.g) in MODP_GROUPS.values() and not 1 < partial_key_r < self.p - 1:
+            raise ValueError("Invalid Diffie-Hellman public key")
         # Compute (partial_key_r ^ private_key) mod p
-        full_key = partial_key_r ** self.private_key
-        full_key = full_key % self.p
+        full_key = pow(partial_key_r, self.private_key, self.p)
         # Store the full shared key
         self.full_key = full_key
         return full_key
@@ -0,0 +1,90 @@
+import os
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Thread
+from typing import Any, Callable
+
+
+# FairScheduler runs the CPU-heavy work of many sessions on one shared pool of worker threads.
+# Each session queues its jobs in its own FIFO, and the workers serve the sessions that have jobs
+# in round-robin order, one job per turn: a session that queues many large messages can't hold up
+# the others, as every busy session gets a turn before any session gets a second one.
+class FairScheduler:
+    workers: int
+    running: bool
+
+    # Creates the pool; workers defaults to the number of CPU cores
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.running = True
+        self.__condition = Condition()
+        self.__ready_sessions: deque[SchedulerSession] = deque()  # Sessions with queued jobs, next turn first
+        self.__threads = [Thread(target=self.__work, name=f'scheduler-{index}', daemon=True)
+                          for index in range(self.workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    # Returns a new session whose jobs get their own turns
+    def open_session(self) -> 'SchedulerSession':
+        return SchedulerSession(self)
+
+    # Queues a job of a session and returns the future of its result
+    def submit(self, session: 'SchedulerSession', function: Callable[..., Any], *args: Any) -> Future:
+        future = Future()
+        with self.__condition:
+            if not self.running:
+                raise RuntimeError("Scheduler is closed")
+            if not session.jobs:
+                self.__ready_sessions.append(session)
+            session.jobs.append((function, args, future))
+            self.__condition.notify()
+        return future
+
+    # Stops the workers once their current jobs are done; the jobs still queued are cancelled
+    def close(self) -> None:
+        with self.__condition:
+            self.running = False
+            for session in self.__ready_sessions:
+                for _, _, future in session.jobs:
+                    future.cancel()
+                session.jobs.clear()
+            self.__ready_sessions.clear()
+            self.__condition.notify_all()
+
+    # Worker loop: runs the next job of the session whose turn it is
+    def __work(self) -> None:
+        while True:
+            with self.__condition:
+                while self.running and not self.__ready_sessions:
+                    self.__condition.wait()
+                if not self.running:
+                    return
+                session = self.__ready_sessions.popleft()
+                function, args, future = session.jobs.popleft()
+                # A session with more jobs waits for its next turn behind the other sessions
+                if session.jobs:
+                    self.__ready_sessions.append(session)
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+
+# SchedulerSession is the handle a session uses to run its jobs on a FairScheduler
+class SchedulerSession:
+    scheduler: FairScheduler
+    jobs: deque[tuple[Callable[..., Any], tuple, Future]]
+
+    def __init__(self, scheduler: FairScheduler) -> None:
+        self.scheduler = scheduler
+        self.jobs = deque()
+
+    # Queues a job to run on the scheduler's workers in this session's turn and returns the future of its result
+    def submit(self, function: Callable[..., Any], *args: Any) -> Future:
+        return self.scheduler.submit(self, function, *args)
+
+    # Runs a job on the scheduler's workers in this session's turn and returns its result
+    def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        return self.submit(function, *args).result()
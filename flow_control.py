@@ -0,0 +1,141 @@
+import asyncio
+import struct
+from threading import Condition, Lock
+from typing import Final
+
+# Messages a sender may send before the receiver granted any credit (every receive window holds at least this many)
+INITIAL_CREDIT: Final[int] = 4
+
+# Default receive window: at most HIGH undelivered messages; credit is returned once they drop to LOW
+DEFAULT_HIGH_WATERMARK: Final[int] = 8
+DEFAULT_LOW_WATERMARK: Final[int] = 4
+
+# Control message granting credit for a number of messages
+CREDIT_GRANT: Final[struct.Struct] = struct.Struct('!I')
+
+
+# Raised to whoever waits on a connection (for a message, or for the peer's credit) once it is closed,
+# whether the peer left or this side closed it: the normal end of a session, unlike the errors that cause one
+class ConnectionClosed(ConnectionError):
+    pass
+
+
+# CreditGate holds the sender's credit: the number of messages the receiver can still accept.
+# Every message takes one credit; the receiver grants more as its user consumes the messages.
+class CreditGate:
+    credit: int
+    closed: bool
+
+    def __init__(self, credit: int = INITIAL_CREDIT) -> None:
+        self.credit = credit
+        self.closed = False
+        self.__condition = Condition()
+
+    # Takes one credit. Without credit, waits for a grant (at most timeout seconds if given) when block is True.
+    # Returns False if no credit could be taken; raises ConnectionClosed if the gate was closed.
+    def acquire(self, block: bool = True, timeout: float | None = None) -> bool:
+        with self.__condition:
+            if block and not self.__condition.wait_for(lambda: self.credit or self.closed, timeout):
+                return False
+            if self.closed:
+                raise ConnectionClosed("Connection closed")
+            if not self.credit:
+                return False
+            self.credit -= 1
+            return True
+
+    # Waits until there is credit (or the gate is closed), at most timeout seconds if given, without taking it.
+    # Returns whether there is credit.
+    def wait(self, timeout: float | None = None) -> bool:
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.credit or self.closed, timeout) and bool(self.credit)
+
+    # Adds credit granted by the receiver
+    def grant(self, count: int) -> None:
+        with self.__condition:
+            self.credit += count
+            self.__condition.notify_all()
+
+    # Wakes up every waiting sender; no more credit can be taken
+    def close(self) -> None:
+        with self.__condition:
+            self.closed = True
+            self.__condition.notify_all()
+
+
+# AsyncCreditGate is the asyncio version of CreditGate, for senders on the event loop.
+# It must only be used from the event loop's thread.
+class AsyncCreditGate:
+    credit: int
+    closed: bool
+
+    def __init__(self, credit: int = INITIAL_CREDIT) -> None:
+        self.credit = credit
+        self.closed = False
+        self.__changed = asyncio.Event()  # Set while there is credit or the gate is closed
+
+    # Takes one credit. Without credit, waits for a grant (at most timeout seconds if given) when block is True.
+    # Returns False if no credit could be taken; raises ConnectionClosed if the gate was closed.
+    async def acquire(self, block: bool = True, timeout: float | None = None) -> bool:
+        if block:
+            try:
+                async with asyncio.timeout(timeout):
+                    while not (self.credit or self.closed):
+                        await self.__changed.wait()
+            except TimeoutError:
+                return False
+        if self.closed:
+            raise ConnectionClosed("Connection closed")
+        if not self.credit:
+            return False
+        self.credit -= 1
+        if not self.credit:
+            self.__changed.clear()
+        return True
+
+    # Adds credit granted by the receiver
+    def grant(self, count: int) -> None:
+        self.credit += count
+        if self.credit:
+            self.__changed.set()
+
+    # Wakes up every waiting sender; no more credit can be taken
+    def close(self) -> None:
+        self.closed = True
+        self.__changed.set()
+
+
+# CreditWindow tracks the receiver's side of the credit: how many messages the sender may still have
+# in flight or waiting to be delivered. Credit is returned in batches, once the outstanding messages
+# drop to the low watermark, which keeps the control traffic to one grant per (high - low) messages.
+class CreditWindow:
+    high_watermark: int
+    low_watermark: int
+    outstanding: int
+
+    def __init__(self, high_watermark: int = DEFAULT_HIGH_WATERMARK, low_watermark: int = DEFAULT_LOW_WATERMARK) -> None:
+        if high_watermark < INITIAL_CREDIT:
+            raise ValueError(f"The high watermark must be at least {INITIAL_CREDIT} messages")
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("The low watermark must be below the high watermark")
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.outstanding = INITIAL_CREDIT
+        self.__lock = Lock()
+
+    # Returns the credit to grant when the connection opens, which fills the window up to the high watermark
+    def open(self) -> int:
+        with self.__lock:
+            count = self.high_watermark - self.outstanding
+            self.outstanding = self.high_watermark
+            return count
+
+    # Records that a message was delivered to the user; returns the credit to grant (0 if none yet)
+    def consume(self) -> int:
+        with self.__lock:
+            self.outstanding -= 1
+            if self.outstanding > self.low_watermark:
+                return 0
+            count = self.high_watermark - self.outstanding
+            self.outstanding = self.high_watermark
+            return count
@@ -1,17 +1,25 @@
+from io import BytesIO
 from pathlib import Path
+from typing import BinaryIO
 
+import numpy as np
 from PIL import Image
 from PIL.ImageFile import ImageFile
 from PIL.PngImagePlugin import PngInfo
 
 # Adds textual metadata to a PNG image and saves it to a specified file path
-def add_metadata_to_image(image: ImageFile, metadata: str, output_image_filepath: str | Path) -> None:
+# - image may also be a pixel array (e.g. a tile view from split_image_array), materialised only here
+# - output_image_filepath may also be a binary file-like object such as BytesIO
+def add_metadata_to_image(image: ImageFile | np.ndarray, metadata: str,
+                          output_image_filepath: str | Path | BinaryIO) -> None:
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
     # Create a PNG metadata container
     png_info = PngInfo()
     # Add the metadata string under the key 'Description'
     png_info.add_text('Description', metadata)
     # Save the image with the added metadata
-    image.save(output_image_filepath, pnginfo=png_info)
+    image.save(output_image_filepath, format='PNG', pnginfo=png_info)
 
 # Reads and returns the 'Description' metadata from a PNG image
 def read_metadata_from_image(image_filepath: str | Path) -> str:
@@ -22,3 +30,22 @@ def read_metadata_from_image(image_filepath: str | Path) -> str:
     # Retrieve the value stored under the 'Description' key
     metadata = image_info['Description']
     return metadata
+
+# Encodes an image as PNG bytes with the given 'Description' metadata, entirely in memory
+def encode_image_with_metadata(image: ImageFile | np.ndarray, metadata: str) -> bytes:
+    image_bytes_io = BytesIO()
+    add_metadata_to_image(image, metadata, image_bytes_io)
+    return image_bytes_io.getvalue()
+
+# Encodes an image as plain PNG bytes, without any metadata, entirely in memory
+def encode_image(image: ImageFile | np.ndarray) -> bytes:
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    image_bytes_io = BytesIO()
+    image.save(image_bytes_io, format='PNG')
+    return image_bytes_io.getvalue()
+
+# Decodes PNG bytes once and returns both the image and its 'Description' metadata
+def decode_image_with_metadata(image_bytes: bytes) -> tuple[ImageFile, str]:
+    image = Image.open(BytesIO(image_bytes))
+    return image, image.info['Description']
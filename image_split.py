@@ -1,73 +1,68 @@
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
-from PIL.ImageFile import ImageFile
 
-# Splits an image into a grid of rows × cols and returns the parts as a 2D list
-def split_image(image_filepath: str | Path, rows: int = 6, cols: int = 8) -> list[list[ImageFile]]:
-    # Resolve the full path and extract the file stem (name without extension)
-    image_path = Path(image_filepath).resolve()
-    image_filename = image_path.stem
+from data_info import ImageParts
 
-    # Open the image using PIL
-    img = Image.open(image_path)
-    img_width, img_height = img.size
+# Splits an image into a grid of rows × cols tiles that are NumPy views onto one pixel buffer.
+# Nothing is copied per tile: the tiles are only materialised when they are encoded.
+# Returns the tiles as a 2D list; writing to a tile writes to the shared buffer.
+# - image: path to the image on disk, an opened PIL image, or a (height, width, 3) pixel array
+def split_image_array(image: str | Path | Image.Image | np.ndarray, rows: int = 6,
+                      cols: int = 8) -> list[list[np.ndarray]]:
+    if isinstance(image, np.ndarray):
+        pixels = image
+    else:
+        if not isinstance(image, Image.Image):
+            image = Image.open(Path(image).resolve())
+        # The only copy: decode the image once into a writable RGB buffer
+        pixels = np.array(image.convert('RGB') if image.mode != 'RGB' else image, dtype=np.uint8)
+    img_height, img_width = pixels.shape[:2]
 
-    # Calculate the width and height of each image part
-    part_width = img_width // cols
-    part_height = img_height // rows
-
-    # The list that will hold the 2D array of cropped image parts
-    output_images = []
-
-    # Loop over each row and column to crop the image
+    output_tiles = []
     for row in range(rows):
-        output_images.append([])  # Create a new row
+        output_tiles.append([])  # Create a new row
         for col in range(cols):
-            # Compute the coordinates of the crop box
-            left = col * part_width
-            upper = row * part_height
-            right = min((col + 1) * part_width, img_width)
-            lower = min((row + 1) * part_height, img_height)
-
-            # Crop the image using the bounding box
-            part = img.crop((left, upper, right, lower))
-            # Store the cropped part in the 2D list
-            output_images[row].append(part)
-
-    return output_images
+            left, upper, right, lower = get_tile_box(img_width, img_height, rows, cols, row, col)
+            # Basic slicing returns a view, not a copy
+            output_tiles[row].append(pixels[upper:lower, left:right])
 
-# Restores a full image from a 2D matrix of image parts and saves it to a file
-def restore_image(parts_image_matrix: list[list[ImageFile]], output_filepath: str | Path) -> None:
-    # Get number of rows and columns from the matrix
-    rows = len(parts_image_matrix)
-    cols = len(parts_image_matrix[0])
+    return output_tiles
 
-    # Estimate the full image size by summing dimensions of parts
-    image_width, image_height = 0, 0
-    for row in range(rows):
-        for col in range(cols):
-            width, height = parts_image_matrix[row][col].size
-            image_width += width
-            image_height += height
+# Returns the (left, upper, right, lower) box of a tile in a rows × cols grid.
+# The last row and column also take the remainder pixels, so the tiles always cover the whole image.
+def get_tile_box(width: int, height: int, rows: int, cols: int, row: int, col: int) -> tuple[int, int, int, int]:
+    # Calculate the width and height of each image part
+    part_width = width // cols
+    part_height = height // rows
 
-    # Compute the average size of the original image
-    image_size = image_width // rows, image_height // cols
+    left = col * part_width
+    upper = row * part_height
+    right = width if col == cols - 1 else left + part_width
+    lower = height if row == rows - 1 else upper + part_height
+    return left, upper, right, lower
 
-    # Create a new blank image to paste the parts into
-    restored_image = Image.new('RGB', image_size)
+# Restores a full image from tiles that carry the exact original size and their own offsets.
+# The pixels are copied once per tile into a single preallocated buffer, with no size estimation.
+def restore_image_from_parts(image_parts: ImageParts) -> Image.Image:
+    canvas = np.zeros((image_parts.height, image_parts.width, 3), dtype=np.uint8)
 
-    # Calculate the width and height of each part (should match original parts)
-    part_width = image_size[0] // cols
-    part_height = image_size[1] // rows
+    for part in image_parts.parts:
+        if isinstance(part.image, np.ndarray):
+            tile_pixels = part.image
+        else:
+            tile_pixels = np.asarray(part.image if part.image.mode == 'RGB' else part.image.convert('RGB'))
+        tile_height, tile_width = tile_pixels.shape[:2]
+        canvas[part.top:part.top + tile_height, part.left:part.left + tile_width] = tile_pixels
 
-    # Paste each image part into the correct position
-    for row in range(rows):
-        for col in range(cols):
-            # Calculate top-left corner where this part should be pasted
-            left = col * part_width
-            upper = row * part_height
-            restored_image.paste(parts_image_matrix[row][col], (left, upper))
+    return Image.fromarray(canvas)
 
-    # Save the reassembled image to the specified path
-    restored_image.save(Path(output_filepath))
+# Chooses a rows × cols grid for an image so that each tile is at most max_tile_size pixels
+# on each side (and, where the image is large enough, at least min_tile_size).
+# Using the fewest tiles that respect the maximum amortises the per-tile PNG header,
+# zlib stream and ZIP entry overhead over as many pixels as possible.
+def choose_grid(width: int, height: int, min_tile_size: int = 32, max_tile_size: int = 256) -> tuple[int, int]:
+    rows = max(1, min(-(-height // max_tile_size), height // min_tile_size))
+    cols = max(1, min(-(-width // max_tile_size), width // min_tile_size))
+    return rows, cols
@@ -0,0 +1,484 @@
+import os
+import secrets
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from queue import Empty, Full, Queue
+from typing import Any, Final
+
+from flow_control import DEFAULT_HIGH_WATERMARK, ConnectionClosed
+from p2p import RECV_CHUNK_SIZE, receive_exactly, receive_to_file
+
+# Port every session listens on (and dials on the peer) unless told otherwise
+DEFAULT_PORT: Final[int] = 5007
+
+# How long to keep trying to reach the peer, and how long to wait between attempts
+CONNECT_TIMEOUT_IN_SECONDS: Final[float] = 15
+CONNECT_RETRY_INTERVAL_IN_SECONDS: Final[float] = 0.2
+
+# Both ends of a new connection first send a hello with the magic, the nonce of their session
+# and the port their session listens on, which tells the accepting side which of its sessions it is for
+HELLO: Final[struct.Struct] = struct.Struct('!4s16sH')
+HELLO_MAGIC: Final[bytes] = b'PECH'
+NONCE_SIZE: Final[int] = 16
+# Nonce a listen-only node (a hub) answers with: being the lowest, the peer keeps the connection it dialed
+LISTENER_NONCE: Final[bytes] = bytes(NONCE_SIZE)
+
+# Every frame starts with its route, its kind and its length as a 4-byte big-endian integer.
+# The route is the logical channel, plus a flag telling whether the frame is addressed to
+# the receiving side of the peer (written by a sending side) or to its sending side (a reply).
+FRAME_HEADER: Final[struct.Struct] = struct.Struct('!BBI')
+FRAME_KIND_DATA: Final[int] = 0  # Received into memory and handed over as a buffer
+FRAME_KIND_FILE: Final[int] = 1  # Streamed to a file on disk as it arrives
+TO_RECEIVER_FLAG: Final[int] = 0x80
+
+# Most received frames kept waiting on one route. A data message takes two frames (the package and its
+# transfer tag), so a peer that respects the receive window never sends more; if a route fills up anyway,
+# the connection stops being read until it has room again, and the peer's writes block.
+FRAME_QUEUE_SIZE: Final[int] = 2 * DEFAULT_HIGH_WATERMARK
+
+# Logical channels of a connection
+CHANNEL_HANDSHAKE: Final[int] = 0  # Key exchange messages
+CHANNEL_DATA: Final[int] = 1  # Packages of image parts and their transfer tags
+CHANNEL_CONTROL: Final[int] = 2  # Connection management and flow control
+
+# Sent on the control channel when a side closes the connection
+CONTROL_CLOSE: Final[bytes] = b'close'
+
+
+# FramedConnection carries the frames of every channel, in both directions, over one TCP socket.
+# A single reader thread receives the frames and sorts them into a queue per route;
+# writes from different threads are serialized, so a frame is never interleaved with another.
+class FramedConnection:
+    connection_socket: socket.socket
+    chunk_size: int
+    spool_directory: Path
+    running: bool
+
+    def __init__(self, connection_socket: socket.socket, chunk_size: int = RECV_CHUNK_SIZE,
+                 spool_directory: str | Path | None = None) -> None:
+        self.connection_socket = connection_socket
+        self.chunk_size = chunk_size
+        self.spool_directory = Path(spool_directory or tempfile.gettempdir())
+        self.running = True
+        self.__queues: dict[int, Queue] = {}
+        self.__queues_lock = threading.Lock()
+        self.__send_lock = threading.Lock()
+        self.__reader_thread = threading.Thread(target=self.__receive_frames, daemon=True)
+        self.__reader_thread.start()
+
+    # Sends a frame holding the given data
+    def send_frame(self, route: int, data: bytes | bytearray | memoryview) -> None:
+        # Written separately, so the data isn't copied into a new buffer behind the header
+        with self.__send_lock:
+            self.connection_socket.sendall(create_frame_header(route, FRAME_KIND_DATA, len(data)))
+            self.connection_socket.sendall(data)
+
+    # Sends a frame holding the content of a file, without reading it into memory
+    # (the kernel copies it to the socket where socket.sendfile supports it)
+    def send_file_frame(self, route: int, file_path: str | Path) -> None:
+        with open(file_path, 'rb') as file:
+            file_size = os.fstat(file.fileno()).st_size
+            with self.__send_lock:
+                self.connection_socket.sendall(create_frame_header(route, FRAME_KIND_FILE, file_size))
+                self.connection_socket.sendfile(file, count=file_size)
+
+    # Takes the next frame received on a route (a buffer, or the path of a file frame),
+    # blocking until one is available. Frames that arrived before the connection closed are still returned;
+    # after them, raises ConnectionClosed.
+    def get_frame(self, route: int) -> bytearray | Path:
+        frames = self.__get_queue(route)
+        while True:
+            try:
+                return frames.get(timeout=1)
+            except Empty:
+                if not self.running:
+                    raise ConnectionClosed("Connection closed")
+
+    # Tells the peer the connection is closing, then closes the socket.
+    # Received files that were never collected are removed.
+    def close(self) -> None:
+        if self.running:
+            self.running = False
+            try:
+                self.send_frame(CHANNEL_CONTROL, CONTROL_CLOSE)
+            except OSError:
+                pass  # The peer already closed it
+        try:
+            # Also wakes up the reader thread
+            self.connection_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection_socket.close()
+
+        with self.__queues_lock:
+            for frames in self.__queues.values():
+                while not frames.empty():
+                    discard_frame(frames.get_nowait())
+
+    # Reader loop: receives frames until the connection closes and queues each one under its route
+    def __receive_frames(self) -> None:
+        try:
+            while self.running:
+                header = receive_exactly(self.connection_socket, FRAME_HEADER.size, self.chunk_size)
+                if not header:
+                    break
+
+                route, kind, length = FRAME_HEADER.unpack(header)
+                if kind == FRAME_KIND_FILE:
+                    frame = receive_to_file(self.connection_socket, length, self.chunk_size, self.spool_directory)
+                    if frame is None:
+                        break
+                else:
+                    frame = receive_exactly(self.connection_socket, length, self.chunk_size)
+                    if len(frame) != length:
+                        break
+
+                if is_close_notice(route, frame):
+                    break
+                self.__queue_frame(route, frame)
+        except OSError:
+            pass  # The socket was closed under the reader
+        self.running = False
+
+    # Queues a received frame under its route, waiting while the route's queue is full.
+    # If the connection closes meanwhile, the frame is dropped.
+    def __queue_frame(self, route: int, frame: bytearray | Path) -> None:
+        frames = self.__get_queue(route)
+        while self.running:
+            try:
+                frames.put(frame, timeout=1)
+                return
+            except Full:
+                continue
+        discard_frame(frame)
+
+    # Returns the queue of a route, creating it on first use
+    def __get_queue(self, route: int) -> Queue:
+        with self.__queues_lock:
+            if route not in self.__queues:
+                self.__queues[route] = Queue(maxsize=FRAME_QUEUE_SIZE)
+            return self.__queues[route]
+
+
+# ChannelEndpoint is one side (sending or receiving) of a session over a FramedConnection.
+# The sending side of a peer talks to the receiving side of the other; each message goes on a
+# logical channel (CHANNEL_DATA unless stated), so the handshake and the data never mix.
+# It offers the same methods as Peer2Peer.
+class ChannelEndpoint:
+    connection: FramedConnection
+    is_sender: bool
+
+    def __init__(self, connection: FramedConnection, is_sender: bool) -> None:
+        self.connection = connection
+        self.is_sender = is_sender
+
+    # Sends a message to the other side of the session
+    def send_message(self, data: bytes | bytearray | memoryview, channel: int = CHANNEL_DATA) -> None:
+        self.connection.send_frame(get_outgoing_route(channel, self.is_sender), data)
+
+    # Retrieves the next message from the other side of the session, blocking until one is available.
+    # The message is the buffer it was received into, handed over without copying.
+    def get_message(self, channel: int = CHANNEL_DATA) -> bytearray:
+        return read_frame(self.connection.get_frame(get_incoming_route(channel, self.is_sender)))
+
+    # Sends a file as binary data, streamed from disk
+    def send_file(self, file_path: str | Path, channel: int = CHANNEL_DATA) -> None:
+        self.connection.send_file_frame(get_outgoing_route(channel, self.is_sender), file_path)
+
+    # Receives a file from the other side of the session and writes it to the given output path.
+    # The file was already streamed to disk as it arrived, so it only has to be moved into place.
+    def get_file(self, output_path: str | Path, channel: int = CHANNEL_DATA) -> None:
+        save_frame(self.connection.get_frame(get_incoming_route(channel, self.is_sender)), output_path)
+
+    # Closes the underlying connection (both sides of the session share it)
+    def close(self) -> None:
+        self.connection.close()
+
+
+# BasePeerConnector holds what establishing the single connection of a session with a peer takes,
+# whatever the transport (a socket for PeerConnector, an asyncio stream for AsyncPeerConnector).
+# Both peers listen and dial at the same time, so neither has to be started first. When both dials
+# succeed, each end learns the other's session nonce from the hellos, and both keep the connection
+# dialed by the side with the higher nonce and close the other one.
+# Dialing one's own port (a loopback session) is recognized by the hello carrying one's own nonce:
+# the dialed end then serves the sending side and the accepted end the receiving side.
+class BasePeerConnector:
+    peer_ip: str
+    peer_address: str
+    port: int
+    peer_port: int
+    nonce: bytes
+    result: tuple[Any, Any] | None
+
+    # - port: the local port to listen on, shared with every other session of the process on that port
+    # - peer_port: the port the peer listens on (the same as port by default)
+    def __init__(self, peer_ip: str, port: int = DEFAULT_PORT, peer_port: int | None = None,
+                 chunk_size: int = RECV_CHUNK_SIZE, spool_directory: str | Path | None = None) -> None:
+        self.peer_ip = peer_ip
+        self.peer_address = socket.gethostbyname(peer_ip)
+        self.port = port
+        self.peer_port = peer_port if peer_port is not None else port
+        self.chunk_size = chunk_size
+        self.spool_directory = spool_directory
+        self.nonce = secrets.token_bytes(NONCE_SIZE)
+        self.result = None  # The (sending, receiving) connections, once chosen
+        self.__loopback_connections: dict[str, Any] = {}
+
+    # Whether the session still waits for its connection
+    def is_waiting(self) -> bool:
+        return self.result is None
+
+    # Stops waiting: connections that arrive later get closed
+    def give_up(self) -> None:
+        if self.result is None:
+            self.result = (None, None)
+
+    # Called by the listener with a connection the peer dialed, once its hello was received
+    def add_accepted(self, connection: Any, peer_nonce: bytes) -> None:
+        self._add_connection(connection, peer_nonce, dialed=False)
+
+    # Takes a new connection of the session, which is connected once result is set
+    def _add_connection(self, connection: Any, peer_nonce: bytes, dialed: bool) -> None:
+        raise NotImplementedError
+
+    # Decides whether the session keeps a new connection; if not, it must be closed
+    def _keeps(self, connection: Any, peer_nonce: bytes, dialed: bool) -> bool:
+        if self.result is not None:
+            return False  # The session is already connected (or gave up)
+        if peer_nonce == self.nonce:
+            # Loopback: both ends of this connection belong to the session
+            self.__loopback_connections['sender' if dialed else 'receiver'] = connection
+            if len(self.__loopback_connections) == 2:
+                self.result = (self.__loopback_connections['sender'], self.__loopback_connections['receiver'])
+            return True
+        if keeps_connection(self.nonce, peer_nonce, dialed):
+            self.result = (connection, connection)
+            return True
+        return False  # The peer keeps the connection dialed the other way
+
+
+# PeerConnector establishes the single connection of a session with a peer over sockets
+# (see BasePeerConnector). The connection is dialed on a thread while the listener accepts the peer's.
+class PeerConnector(BasePeerConnector):
+    def __init__(self, peer_ip: str, port: int = DEFAULT_PORT, peer_port: int | None = None,
+                 chunk_size: int = RECV_CHUNK_SIZE, spool_directory: str | Path | None = None) -> None:
+        super().__init__(peer_ip, port, peer_port, chunk_size, spool_directory)
+        self.__condition = threading.Condition()
+
+    # Connects to the peer and returns the (sending, receiving) endpoints of the session.
+    # Raises TimeoutError if the peer can't be reached within CONNECT_TIMEOUT_IN_SECONDS.
+    def connect(self) -> tuple[ChannelEndpoint, ChannelEndpoint]:
+        listener = SharedListener.acquire(self.port)
+        listener.register(self)
+        try:
+            threading.Thread(target=self.__dial, daemon=True).start()
+            with self.__condition:
+                if not self.__condition.wait_for(lambda: self.result is not None, CONNECT_TIMEOUT_IN_SECONDS):
+                    self.give_up()
+                    raise TimeoutError(f"Could not connect to peer at {self.peer_ip}:{self.peer_port}")
+                sender_socket, receiver_socket = self.result
+        finally:
+            listener.unregister(self)
+            listener.release()
+
+        print(f"Connected to peer at {self.peer_ip}:{self.peer_port}")
+        sender_connection = FramedConnection(sender_socket, self.chunk_size, self.spool_directory)
+        receiver_connection = sender_connection if receiver_socket is sender_socket else \
+            FramedConnection(receiver_socket, self.chunk_size, self.spool_directory)
+        return ChannelEndpoint(sender_connection, True), ChannelEndpoint(receiver_connection, False)
+
+    # Keeps dialing the peer until it answers or the session got its connection
+    def __dial(self) -> None:
+        deadline = time.monotonic() + CONNECT_TIMEOUT_IN_SECONDS
+        while self.is_waiting() and time.monotonic() < deadline:
+            try:
+                connection_socket = socket.create_connection((self.peer_address, self.peer_port),
+                                                             CONNECT_TIMEOUT_IN_SECONDS)
+            except OSError:
+                time.sleep(CONNECT_RETRY_INTERVAL_IN_SECONDS)  # Wait before retrying
+                continue
+            try:
+                connection_socket.sendall(create_hello(self.nonce, self.port))
+                peer_nonce, _ = parse_hello(receive_exactly(connection_socket, HELLO.size))
+            except OSError:
+                # The peer's listener turned the connection down (its session isn't waiting yet)
+                connection_socket.close()
+                time.sleep(CONNECT_RETRY_INTERVAL_IN_SECONDS)
+                continue
+            self._add_connection(connection_socket, peer_nonce, dialed=True)
+            return
+
+    def _add_connection(self, connection_socket: socket.socket, peer_nonce: bytes, dialed: bool) -> None:
+        with self.__condition:
+            if not self._keeps(connection_socket, peer_nonce, dialed):
+                connection_socket.close()
+            elif self.result is not None:
+                for kept_socket in set(self.result):
+                    kept_socket.settimeout(None)
+                    # Send each frame as soon as it is written; a frame header and a file body are written separately
+                    kept_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.__condition.notify_all()
+
+
+# BaseSharedListener keeps the sessions of the process that wait for a connection on one port,
+# whatever the transport, and tells which of them an accepted connection is for: the session whose
+# own nonce is in the connection's hello (a loopback), otherwise the session whose peer listens on
+# the address the connection came from and the port in its hello.
+class BaseSharedListener:
+    port: int
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self._users = 0  # Sessions that acquired the listener and haven't released it
+        self.__sessions: list[BasePeerConnector] = []
+        self.__sessions_lock = threading.Lock()
+
+    # Adds a session waiting for a connection from its peer
+    def register(self, session: BasePeerConnector) -> None:
+        with self.__sessions_lock:
+            self.__sessions.append(session)
+
+    def unregister(self, session: BasePeerConnector) -> None:
+        with self.__sessions_lock:
+            self.__sessions.remove(session)
+
+    # Returns the waiting session a connection with the given hello is for, or None if no session waits for it
+    def _find_session(self, hello: bytes | bytearray, address: str) -> BasePeerConnector | None:
+        peer_nonce, peer_port = parse_hello(hello)
+        with self.__sessions_lock:
+            waiting_sessions = [session for session in self.__sessions if session.is_waiting()]
+        return next((session for session in waiting_sessions if session.nonce == peer_nonce),
+                    next((session for session in waiting_sessions
+                          if (session.peer_address, session.peer_port) == (address, peer_port)), None))
+
+
+# SharedListener accepts the connections of every session of the process that listens on one port,
+# on a thread, and hands each one to the session it is for (see BaseSharedListener).
+# The listening socket is opened by the first session on the port and closed after the last one.
+class SharedListener(BaseSharedListener):
+    listener_socket: socket.socket
+
+    __listeners: dict[int, 'SharedListener'] = {}
+    __listeners_lock = threading.Lock()
+
+    def __init__(self, port: int) -> None:
+        super().__init__(port)
+        self.listener_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener_socket.bind(('0.0.0.0', port))
+        self.listener_socket.listen()
+        threading.Thread(target=self.__accept_loop, daemon=True).start()
+
+    # Returns the listener of a port, opening it if no session listens on it yet
+    @classmethod
+    def acquire(cls, port: int) -> 'SharedListener':
+        with cls.__listeners_lock:
+            listener = cls.__listeners.get(port)
+            if listener is None:
+                listener = cls.__listeners[port] = SharedListener(port)
+            listener._users += 1
+            return listener
+
+    # Gives back a listener obtained from acquire; the last user closes it
+    def release(self) -> None:
+        with SharedListener.__listeners_lock:
+            self._users -= 1
+            if self._users == 0:
+                del SharedListener.__listeners[self.port]
+                try:
+                    # Wakes up the accept loop, which would otherwise keep the port open
+                    self.listener_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.listener_socket.close()
+
+    # Accepts connections until the listening socket is closed
+    def __accept_loop(self) -> None:
+        while True:
+            try:
+                connection_socket, (address, _) = self.listener_socket.accept()
+            except OSError:
+                return
+            # Reading the hello may take a while, so it doesn't hold up the next connection
+            threading.Thread(target=self.__route, args=(connection_socket, address), daemon=True).start()
+
+    # Hands an accepted connection to the session it belongs to, or closes it if there is none
+    def __route(self, connection_socket: socket.socket, address: str) -> None:
+        try:
+            connection_socket.settimeout(CONNECT_TIMEOUT_IN_SECONDS)
+            hello = receive_exactly(connection_socket, HELLO.size)
+            session = self._find_session(hello, address)
+            if session is None:
+                connection_socket.close()
+                return
+            connection_socket.sendall(create_hello(session.nonce, self.port))
+        except OSError:
+            connection_socket.close()
+            return
+        session.add_accepted(connection_socket, parse_hello(hello)[0])
+
+
+# Returns the route of the frames a side of the session sends on a channel
+def get_outgoing_route(channel: int, is_sender: bool) -> int:
+    return channel | TO_RECEIVER_FLAG if is_sender else channel
+
+# Returns the route of the frames a side of the session receives on a channel
+def get_incoming_route(channel: int, is_sender: bool) -> int:
+    return channel if is_sender else channel | TO_RECEIVER_FLAG
+
+# Whether a session keeps a connection with another peer: the one dialed by the side with the higher nonce
+def keeps_connection(nonce: bytes, peer_nonce: bytes, dialed: bool) -> bool:
+    return (nonce > peer_nonce) == dialed
+
+# Returns the hello that opens a connection of a session listening on the given port
+def create_hello(nonce: bytes, port: int) -> bytes:
+    return HELLO.pack(HELLO_MAGIC, nonce, port)
+
+# Returns the session nonce and listening port of a received hello;
+# raises ConnectionError if it isn't complete or not from a peer
+def parse_hello(hello: bytes | bytearray) -> tuple[bytes, int]:
+    if len(hello) != HELLO.size:
+        raise ConnectionError("Connection closed during the hello")
+    magic, nonce, port = HELLO.unpack(hello)
+    if magic != HELLO_MAGIC:
+        raise ConnectionError("Connection is not from a peer")
+    return nonce, port
+
+# Returns the header of a frame
+def create_frame_header(route: int, kind: int, length: int) -> bytes:
+    return FRAME_HEADER.pack(route, kind, length)
+
+# Whether a received frame is the close notice, which ends the connection
+# (other control messages go to their side of the session)
+def is_close_notice(route: int, frame: bytearray | Path) -> bool:
+    return route & ~TO_RECEIVER_FLAG == CHANNEL_CONTROL and frame == CONTROL_CLOSE
+
+# Returns a received frame as a message in memory: the buffer it was received into, handed over without
+# copying, or the content of a file frame (the peer sent a file, but it's wanted in memory)
+def read_frame(frame: bytearray | Path) -> bytearray:
+    if isinstance(frame, Path):
+        data = bytearray(frame.read_bytes())
+        frame.unlink()
+        return data
+    return frame
+
+# Writes a received frame to the given output path. A file frame was already streamed to disk
+# as it arrived, so it only has to be moved into place.
+def save_frame(frame: bytearray | Path, output_path: str | Path) -> None:
+    if isinstance(frame, Path):
+        shutil.move(frame, output_path)
+        return
+
+    # The peer sent the file as an in-memory message
+    with open(output_path, 'wb') as file:
+        file.write(frame)
+
+# Drops a frame that was never collected, removing its file
+def discard_frame(frame: bytearray | Path) -> None:
+    if isinstance(frame, Path):
+        frame.unlink(missing_ok=True)
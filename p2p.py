@@ -1,15 +1,32 @@
+import os
+import shutil
 import socket
 import struct
+import tempfile
 import threading
 from pathlib import Path
-from queue import Empty, Queue
+from queue import Empty, Full, Queue
 from time import sleep
 from typing import Final
 
+from flow_control import DEFAULT_HIGH_WATERMARK, ConnectionClosed
+
 # Constants for retry behavior and connection timeout
 MAX_RETRIES: Final[int] = 3
 CONNECT_TIMEOUT_IN_SECONDS: Final[int] = 5
 
+# Largest number of bytes asked from the socket in a single read (the default chunk size)
+RECV_CHUNK_SIZE: Final[int] = 1024 * 1024
+
+# Every message starts with its kind and its length as a 4-byte big-endian integer
+MESSAGE_HEADER: Final[struct.Struct] = struct.Struct('!BI')
+MESSAGE_KIND_DATA: Final[int] = 0  # Received into memory and handed over as a buffer
+MESSAGE_KIND_FILE: Final[int] = 1  # Streamed to a file on disk as it arrives
+
+# Most received messages kept waiting for get_message; while that many wait, the connection is no longer read,
+# so the peer's sends block instead of the messages piling up in memory
+RECEIVE_QUEUE_SIZE: Final[int] = DEFAULT_HIGH_WATERMARK
+
 # Peer2Peer manages a bidirectional connection using two sockets:
 # one for sending and one for receiving data, enabling peer-to-peer communication.
 class Peer2Peer:
@@ -22,15 +39,25 @@ class Peer2Peer:
     connection_socket: socket.socket
 
     received_messages_queue: Queue
+    chunk_size: int
+    spool_directory: Path
 
     # Initializes the sender and receiver sockets and starts threads to connect them
-    def __init__(self, peer_ip, send_port, receive_port):
+    # - chunk_size: largest single read from the socket; received files are written in chunks of this size,
+    #   so the memory a file transfer uses is bounded by it instead of by the file size
+    # - spool_directory: where received files are written until get_file moves them into place
+    def __init__(self, peer_ip, send_port, receive_port, chunk_size: int = RECV_CHUNK_SIZE,
+                 spool_directory: str | Path | None = None):
         self.peer_ip = peer_ip
         self.send_port = send_port
         self.receive_port = receive_port
+        self.chunk_size = chunk_size
+        self.spool_directory = Path(spool_directory or tempfile.gettempdir())
 
         # Socket for sending messages to the peer
         self.sender_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Send each message as soon as it is written; a message header and its body are written separately
+        self.sender_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         # Socket for listening for incoming connections
         self.receiver_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
@@ -52,7 +79,7 @@ class Peer2Peer:
         sender_connect_thread.join()
 
         # Queue to store received messages
-        self.received_messages_queue = Queue()
+        self.received_messages_queue = Queue(maxsize=RECEIVE_QUEUE_SIZE)
 
         # Start the background thread to continuously receive data
         self.receiver_thread = threading.Thread(target=self.receive_data, daemon=True)
@@ -76,72 +103,150 @@ class Peer2Peer:
                     raise  # Too many failures, give up
                 sleep(CONNECT_TIMEOUT_IN_SECONDS)  # Wait before retrying
 
-    # Send a message to the peer with a 4-byte length prefix
+    # Send a message to the peer with a header holding its kind and its length
     def send_message(self, data: bytes):
-        length_prefix = struct.pack("!I", len(data))  # 4-byte prefix in big-endian format
-        self.sender_socket.sendall(length_prefix + data)
+        header = MESSAGE_HEADER.pack(MESSAGE_KIND_DATA, len(data))  # Length in big-endian format
+        # Written separately, so the data isn't copied into a new buffer behind the header
+        self.sender_socket.sendall(header)
+        self.sender_socket.sendall(data)
 
     # Continuously listens for incoming data and pushes it into the message queue
     def receive_data(self):
         print(f"Listening for incoming connections on port {self.receive_port}...")
         while self.running:
             try:
-                # Receive 4 bytes indicating the message length
-                length_prefix = self._recv_exactly(4)
-                if not length_prefix:
+                # Receive the header indicating the message kind and length
+                header = self._recv_exactly(MESSAGE_HEADER.size)
+                if not header:
                     break
 
-                # Get message length and receive the message
-                message_length = struct.unpack("!I", length_prefix)[0]
-                message_data = self._recv_exactly(message_length)
-                if not message_data:
-                    break
+                # Get message length and receive the message (which may be empty)
+                message_kind, message_length = MESSAGE_HEADER.unpack(header)
+                if message_kind == MESSAGE_KIND_FILE:
+                    message_data = self._recv_to_file(message_length)
+                    if message_data is None:
+                        break
+                else:
+                    message_data = self._recv_exactly(message_length)
+                    if len(message_data) != message_length:
+                        break
 
-                # Put the complete message into the queue
-                self.received_messages_queue.put(message_data)
+                # Put the complete message (or the path of the received file) into the queue
+                self._queue_message(message_data)
 
             except Exception as e:
                 print(f"Error receiving message: {e}")
         self.close()
 
+    # Puts a received message into the queue, waiting while it is full (the peer then has to wait too).
+    # If the connection closes meanwhile, the message is dropped.
+    def _queue_message(self, message: bytearray | Path):
+        while self.running:
+            try:
+                self.received_messages_queue.put(message, timeout=1)
+                return
+            except Full:
+                continue  # Retry until there is room or the connection closes
+
+        if isinstance(message, Path):
+            message.unlink(missing_ok=True)
+
     # Helper method to ensure exactly 'size' bytes are received from the connection
-    def _recv_exactly(self, size: int) -> bytes:
-        data = b""
-        while len(data) < size:
-            chunk_size = min(1024, size - len(data))  # Read in chunks
-            packet = self.connection_socket.recv(chunk_size)
-            if not packet:
-                return b""  # Connection closed
-            data += packet
-        return data
-
-    # Retrieves a message from the queue, blocking until one is available
-    def get_message(self) -> bytes:
+    def _recv_exactly(self, size: int) -> bytearray:
+        return receive_exactly(self.connection_socket, size, self.chunk_size)
+
+    # Receives a message of 'size' bytes straight into a new file in the spool directory
+    def _recv_to_file(self, size: int) -> Path | None:
+        return receive_to_file(self.connection_socket, size, self.chunk_size, self.spool_directory)
+
+    # Retrieves a message from the queue, blocking until one is available.
+    # The message is the buffer it was received into, handed over without copying.
+    def get_message(self) -> bytearray:
+        message = self._get_next_message()
+        if isinstance(message, Path):
+            # The peer sent a file, but it's wanted in memory
+            data = bytearray(message.read_bytes())
+            message.unlink()
+            return data
+        return message
+
+    # Takes the next received message (or received file path) from the queue, blocking until one is available
+    def _get_next_message(self) -> bytearray | Path:
         while self.running:
             try:
                 return self.received_messages_queue.get(timeout=1)
             except Empty:
                 continue  # Retry until message is received or connection closes
 
-        raise Exception("Connection closed")
+        raise ConnectionClosed("Connection closed")
 
     # Gracefully shuts down all sockets and terminates the receive thread
     def close(self):
         self.running = False
         self.sender_socket.close()
         self.receiver_socket.close()
+
+        # Remove received files that were never collected
+        while not self.received_messages_queue.empty():
+            message = self.received_messages_queue.get_nowait()
+            if isinstance(message, Path):
+                message.unlink(missing_ok=True)
         print("Connections closed.")
 
-    # Sends a file as binary data over the connection
+    # Sends a file as binary data over the connection.
+    # The file is never read into memory: after the header, the kernel copies it to the socket
+    # (socket.sendfile falls back to sending chunks where that isn't supported).
     def send_file(self, file_path: str | Path):
         with open(file_path, "rb") as file:
-            file_data = file.read()
-
-        self.send_message(file_data)
+            file_size = os.fstat(file.fileno()).st_size
+            self.sender_socket.sendall(MESSAGE_HEADER.pack(MESSAGE_KIND_FILE, file_size))
+            self.sender_socket.sendfile(file, count=file_size)
 
-    # Receives a file from the peer and writes it to the given output path
+    # Receives a file from the peer and writes it to the given output path.
+    # The file was already streamed to disk as it arrived, so it only has to be moved into place.
     def get_file(self, output_path: str | Path):
-        file_data = self.get_message()
+        message = self._get_next_message()
+        if isinstance(message, Path):
+            shutil.move(message, output_path)
+            return
 
+        # The peer sent the file as an in-memory message
         with open(output_path, "wb") as file:
-            file.write(file_data)
+            file.write(message)
+
+
+# Receives exactly 'size' bytes from a connected socket.
+# The buffer for the whole message is allocated once and the socket writes straight into it,
+# so the data is never copied and the number of reads doesn't grow with small chunks.
+# Returns an empty buffer if the connection closed first.
+def receive_exactly(connection_socket: socket.socket, size: int, chunk_size: int = RECV_CHUNK_SIZE) -> bytearray:
+    data = bytearray(size)
+    data_view = memoryview(data)
+    received_size = 0
+    while received_size < size:
+        # Read in large chunks, directly into the unfilled part of the buffer
+        packet_size = connection_socket.recv_into(data_view[received_size:], min(chunk_size, size - received_size))
+        if not packet_size:
+            return bytearray()  # Connection closed
+        received_size += packet_size
+    return data
+
+# Receives 'size' bytes from a connected socket straight into a new file in the spool directory,
+# one chunk at a time through a single reused buffer. Returns None if the connection closed first.
+def receive_to_file(connection_socket: socket.socket, size: int, chunk_size: int, spool_directory: Path) -> Path | None:
+    file_descriptor, file_path = tempfile.mkstemp(prefix='p2p-', dir=spool_directory)
+    chunk = bytearray(max(1, min(chunk_size, size)))
+    chunk_view = memoryview(chunk)
+    remaining_size = size
+    with open(file_descriptor, 'wb') as file:
+        while remaining_size:
+            packet_size = connection_socket.recv_into(chunk_view, min(len(chunk), remaining_size))
+            if not packet_size:
+                break  # Connection closed
+            file.write(chunk_view[:packet_size])
+            remaining_size -= packet_size
+
+    if remaining_size:
+        os.remove(file_path)
+        return None
+    return Path(file_path)
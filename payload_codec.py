@@ -0,0 +1,77 @@
+import lzma
+import zlib
+from typing import Final
+
+try:
+    # zstd is optional: it is only offered when the zstandard package is installed
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codecs the payload can be compressed with; the id is stored in the first byte of the payload
+CODEC_NONE: Final[str] = 'none'
+CODEC_ZLIB: Final[str] = 'zlib'
+CODEC_LZMA: Final[str] = 'lzma'
+CODEC_ZSTD: Final[str] = 'zstd'
+CODEC_IDS: Final[dict[str, int]] = {CODEC_NONE: 0, CODEC_ZLIB: 1, CODEC_LZMA: 2, CODEC_ZSTD: 3}
+
+# Errors the codecs raise on malformed compressed data
+DECOMPRESSION_ERRORS: Final[tuple[type[Exception], ...]] = (
+    (zlib.error, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard is not None else ()))
+
+# Payloads shorter than this are not worth compressing (the codec's own header would outweigh the gain)
+DEFAULT_COMPRESSION_THRESHOLD: Final[int] = 64
+
+
+# Returns the codecs that can be used on this machine
+def get_available_codecs() -> list[str]:
+    return [codec for codec in CODEC_IDS if codec != CODEC_ZSTD or zstandard is not None]
+
+# Compresses a payload with the given codec and prepends a 1-byte flag naming the codec used.
+# The payload is stored as is (flagged CODEC_NONE) when it is shorter than threshold
+# or when compressing would not make it smaller.
+def compress_payload(data: bytes | bytearray | memoryview, codec: str = CODEC_ZLIB, threshold: int = DEFAULT_COMPRESSION_THRESHOLD) -> bytes:
+    if codec not in get_available_codecs():
+        raise ValueError(f"Compression codec '{codec}' is not available")
+
+    if codec != CODEC_NONE and len(data) >= threshold:
+        if codec == CODEC_ZLIB:
+            compressed = zlib.compress(data, 9)
+        elif codec == CODEC_LZMA:
+            compressed = lzma.compress(data, preset=6)
+        else:
+            compressed = zstandard.ZstdCompressor(level=19).compress(data)
+
+        if len(compressed) < len(data):
+            return bytes([CODEC_IDS[codec]]) + compressed
+
+    return bytes([CODEC_IDS[CODEC_NONE]]) + data
+
+# Reverses compress_payload, using the codec named by the payload's flag byte.
+# max_length limits the decompressed size, so a small malicious payload cannot expand without bound.
+# Raises ValueError if the payload is malformed or expands beyond max_length.
+def decompress_payload(payload: bytes | bytearray | memoryview, max_length: int | None = None) -> bytes:
+    if not payload:
+        raise ValueError("Payload is missing its codec flag")
+    # The codecs read straight from a view of the payload, without copying it first
+    codec_id, data = payload[0], memoryview(payload)[1:]
+    limit = -1 if max_length is None else max_length + 1
+
+    try:
+        if codec_id == CODEC_IDS[CODEC_NONE]:
+            decompressed = bytes(data)
+        elif codec_id == CODEC_IDS[CODEC_ZLIB]:
+            decompressed = zlib.decompressobj().decompress(data, max(limit, 0))
+        elif codec_id == CODEC_IDS[CODEC_LZMA]:
+            decompressed = lzma.LZMADecompressor().decompress(data, limit)
+        elif codec_id == CODEC_IDS[CODEC_ZSTD] and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                decompressed = reader.read(limit)
+        else:
+            raise ValueError(f"Unknown or unavailable payload codec {codec_id}")
+    except DECOMPRESSION_ERRORS as e:
+        raise ValueError(f"Payload could not be decompressed: {e}") from e
+
+    if max_length is not None and len(decompressed) > max_length:
+        raise ValueError(f"Payload expands beyond {max_length} bytes")
+    return decompressed
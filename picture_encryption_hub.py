@@ -0,0 +1,129 @@
+import asyncio
+from typing import Any
+
+from async_connection import AsyncChannelEndpoint, AsyncFramedConnection, receive_hello
+from async_picture_encryption_socket import AsyncPictureEncryptionSocket
+from fair_scheduler import FairScheduler
+from flow_control import DEFAULT_HIGH_WATERMARK
+from multiplexed_connection import CONNECT_TIMEOUT_IN_SECONDS, DEFAULT_PORT, LISTENER_NONCE, create_hello
+from tile_encoder import TileEncoderPool
+
+
+class PictureEncryptionHub:
+    """
+    PictureEncryptionHub is a server node that holds an encrypted picture session with
+    every peer that connects to its port, for as many peers as connect.
+
+    Each peer is an ordinary PictureEncryptionSocket (or AsyncPictureEncryptionSocket) whose
+    peer_port is the hub's port. The hub only listens: it answers every hello with the lowest
+    nonce, so the peer keeps the connection it dialed. Every session runs its own key exchange,
+    so it has its own keys, ticket and text encodings.
+
+    Every session runs on one asyncio event loop, as tasks that wait for their next frame or
+    message without polling, so an idle session holds no thread and uses no CPU. The image work
+    of all the sessions shares one pool of tile encoding processes and one FairScheduler, whose
+    threads serve the sessions in round-robin order, so a busy peer can't starve the others.
+
+        hub = PictureEncryptionHub(port)
+        await hub.start()
+        async for session, message in hub:
+            await session.send(message)
+        await hub.close()
+    """
+
+    def __init__(self, port: int = DEFAULT_PORT, workers: int | None = None, encode_workers: int | None = None,
+                 **session_options: Any) -> None:
+        """
+        Initialize the hub with the port it listens on.
+        workers is the number of threads that run the sessions' CPU-heavy stages and encode_workers the
+        number of tile encoding processes (both default to the number of CPU cores); every session shares them.
+        session_options are passed to each session (see PictureEncryptionSocket).
+        """
+        self.port = port
+        self.session_options = session_options
+        self.scheduler = FairScheduler(workers)
+        self.tile_encoder = TileEncoderPool(encode_workers)
+        self.server = None
+        self.sessions: set[AsyncPictureEncryptionSocket] = set()  # Sessions with the connected peers
+        # (session, message) pairs from every session. A session hands over its next message (and so grants
+        # its peer credit for another one) only once there is room, so a slow reader holds back the peers.
+        self.received_messages = asyncio.Queue(
+            maxsize=session_options.get('receive_high_watermark', DEFAULT_HIGH_WATERMARK))
+        self.__relay_tasks: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """
+        Starts the tile encoding processes and listening for peers on the running event loop.
+        """
+        await asyncio.to_thread(self.tile_encoder.start)
+        self.server = await asyncio.start_server(self.__accept, '0.0.0.0', self.port, reuse_address=True)
+        print(f"Hub listening on port {self.port}...")
+
+    async def receive(self) -> tuple[AsyncPictureEncryptionSocket, bytes]:
+        """
+        Waits for the next message from any peer and returns it with the session it came from.
+        """
+        return await self.received_messages.get()
+
+    def __aiter__(self) -> 'PictureEncryptionHub':
+        return self
+
+    async def __anext__(self) -> tuple[AsyncPictureEncryptionSocket, bytes]:
+        """
+        Iterates over the messages of every session until the hub is closed.
+        """
+        if self.server is None:
+            raise StopAsyncIteration
+        return await self.receive()
+
+    async def close(self) -> None:
+        """
+        Stops listening, closes every session and shuts down the shared workers.
+        """
+        if self.server is None:
+            return
+        server, self.server = self.server, None
+        server.close()
+
+        # The sessions' connections must be closed first: from Python 3.12 on, wait_closed waits for them
+        for task in self.__relay_tasks:
+            task.cancel()
+        await asyncio.gather(*self.__relay_tasks, return_exceptions=True)
+        await asyncio.gather(*(session.close() for session in list(self.sessions)))
+        self.sessions.clear()
+        await server.wait_closed()
+
+        self.scheduler.close()
+        await asyncio.to_thread(self.tile_encoder.close)
+        print("Hub closed.")
+
+    async def __accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Starts a session on a connection from a new peer, once its hello was received.
+        """
+        try:
+            await asyncio.wait_for(receive_hello(reader), CONNECT_TIMEOUT_IN_SECONDS)
+        except (OSError, TimeoutError):
+            writer.close()
+            return
+        writer.write(create_hello(LISTENER_NONCE, self.port))
+
+        session = AsyncPictureEncryptionSocket(writer.get_extra_info('peername')[0], tile_encoder=self.tile_encoder,
+                                               scheduler=self.scheduler, **self.session_options)
+        connection = AsyncFramedConnection(reader, writer, session.transfer_chunk_size)
+        await session.attach(AsyncChannelEndpoint(connection, True), AsyncChannelEndpoint(connection, False))
+        self.sessions.add(session)
+
+        relay_task = asyncio.create_task(self.__relay(session, connection))
+        self.__relay_tasks.add(relay_task)
+        relay_task.add_done_callback(self.__relay_tasks.discard)
+
+    async def __relay(self, session: AsyncPictureEncryptionSocket, connection: AsyncFramedConnection) -> None:
+        """
+        Passes on the messages of a session until it ends, then forgets it.
+        """
+        async for message in session:
+            await self.received_messages.put((session, message))
+        self.sessions.discard(session)
+        await session.close()
+        await connection.close()  # Also when the session failed or the peer left first
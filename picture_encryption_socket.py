@@ -1,26 +1,61 @@
 import os
+import secrets
 import shutil
-from queue import Empty, Queue
+from pathlib import Path
+from queue import Empty, Full, Queue
 from threading import Event, Thread
-from typing import Final
+from typing import Final, Generator, Iterator
 
+import numpy as np
 from PIL import Image
 
-from aes_cipher import AESCipher
-from data_info import SplittedImageInfo
-from dh_key_exchange import DH_Endpoint
-from image_metadata import add_metadata_to_image, read_metadata_from_image
-from image_split import restore_image, split_image
-from p2p import Peer2Peer
-from random_image import generate_random_image
-from steganography import hide_message_in_image, reveal_message_from_image
+from data_info import ImageParts, SplittedImageInfo
+from dh_key_exchange import DEFAULT_MODP_GROUP, MODP_GROUPS, DH_Endpoint, generate_private_key
+from fair_scheduler import FairScheduler
+from flow_control import (CREDIT_GRANT, DEFAULT_HIGH_WATERMARK, DEFAULT_LOW_WATERMARK, ConnectionClosed, CreditGate,
+                          CreditWindow)
+from image_metadata import decode_image_with_metadata, read_metadata_from_image
+from image_split import choose_grid, get_tile_box, split_image_array
+from multiplexed_connection import CHANNEL_CONTROL, CHANNEL_HANDSHAKE, DEFAULT_PORT, ChannelEndpoint, PeerConnector
+from p2p import RECV_CHUNK_SIZE
+from payload_codec import (CODEC_ZLIB, DEFAULT_COMPRESSION_THRESHOLD, compress_payload, decompress_payload,
+                           get_available_codecs)
+from pipeline_stage import PipelineStage
+from random_image import create_random_image, generate_random_image
+from session_cache import (RESUMPTION_NONCE_SIZE, SHARED_SESSION_CACHE, TICKET_SIZE, SessionCache,
+                           derive_resumed_key, derive_resumption_secret)
+from session_cipher import SessionCipher
+from steganography import get_carrier_size, get_tile_span, hide_bytes_in_tiles, reveal_bytes_from_tiles
+from tile_container import create_tile_container, is_tile_container, read_tile_container
+from tile_encoder import TileEncoderPool
+from tile_stream import TileStreamAssembler, create_stream_header, create_stream_tile_frame, is_tile_stream
 from utils import (bytes_to_int, create_random_name_directory, find_primitive_root, generate_random_filename,
-                   get_temp_dir, int_to_bytes, random_prime_number, row_and_column_to_str,
-                   str_to_row_and_column, generate_5_digit_number)
-from zip_files import create_zip_file, extract_zip_file
+                   get_temp_dir, grid_to_str, int_to_bytes, random_prime_number, str_to_grid,
+                   str_to_tile_position, tile_position_to_str)
+from zip_files import create_zip_bytes, create_zip_file, extract_zip_file, read_zip_bytes, read_zip_comment
 
 MAX_CONTENT_LENGTH: Final[int] = 115167  # Maximum allowed size for the content being sent
 
+# Text encodings this side can use for send_text/receive_text, most preferred first.
+# UTF-8 keeps ASCII text at one byte per character; UTF-16 is what earlier versions always used.
+SUPPORTED_TEXT_ENCODINGS: Final[tuple[str, ...]] = ('utf-8', 'utf-16')
+
+# The receiver's answer to the sender's first key exchange message
+HANDSHAKE_FULL: Final[bytes] = b'full'  # Diffie-Hellman follows
+HANDSHAKE_RESUMED: Final[bytes] = b'resumed'  # The ticket was accepted and the cached session is resumed
+
+# Formats the image parts can be packaged in for sending
+TILE_FORMAT_CONTAINER: Final[str] = 'container'
+TILE_FORMAT_ZIP: Final[str] = 'zip'
+TILE_FORMAT_STREAM: Final[str] = 'stream'
+
+# Grid (rows, columns) of a zip of parts that comes without a grid description:
+# a peer that sends every part of its carrier, split the way earlier versions did
+LEGACY_GRID: Final[tuple[int, int]] = (6, 8)
+
+# A key exchange in progress (see advance_key_exchange)
+KeyExchange = Generator[bytes | None, bytearray | None, bytes]
+
 
 class PictureEncryptionSocket:
     """
@@ -29,23 +64,93 @@ class PictureEncryptionSocket:
     It splits the image into parts, sends them over the network, and reconstructs
     and decrypts the message on the receiver side.
 
-    The connection uses Diffie-Hellman key exchange to agree on a shared secret
-    encryption key, which is then used for AES encryption of the message.
+    The connection uses Diffie-Hellman key exchange to agree on a shared
+    secret, from which each direction derives its session keys once: an AES-GCM key
+    for the messages and an HMAC key that authenticates every transfer.
     """
 
-    def __init__(self, peer_ip: str) -> None:
+    def __init__(self, peer_ip: str, in_memory: bool = True, encode_workers: int | None = None,
+                 stage_queue_size: int = 2, cull_tiles: bool = True, carrier_safety_margin: float = 0.1,
+                 min_tile_size: int = 32, max_tile_size: int = 256, tile_format: str = TILE_FORMAT_CONTAINER,
+                 compression: str = CODEC_ZLIB, compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+                 dh_group: int | None = DEFAULT_MODP_GROUP,
+                 session_cache: SessionCache | None = SHARED_SESSION_CACHE,
+                 transfer_chunk_size: int = RECV_CHUNK_SIZE, port: int = DEFAULT_PORT,
+                 peer_port: int | None = None, tile_encoder: TileEncoderPool | None = None,
+                 scheduler: FairScheduler | None = None, receive_high_watermark: int = DEFAULT_HIGH_WATERMARK,
+                 receive_low_watermark: int = DEFAULT_LOW_WATERMARK) -> None:
         """
         Initialize the socket with the target peer's IP address.
         Sets up threading events and queues for sending and receiving data.
+
+        When in_memory is False, every intermediate image and zip is written to a
+        temporary directory instead of being passed between stages in memory (debug option).
+        encode_workers sets the number of processes used to encode image parts
+        (defaults to the number of CPU cores, 1 encodes on the sender thread).
+        stage_queue_size bounds the queues between the send and receive pipeline stages.
+        When cull_tiles is True, only the image parts that hold the hidden content are sent.
+        carrier_safety_margin is the spare capacity (as a fraction) left when sizing the carrier image.
+        min_tile_size and max_tile_size (in pixels per side) limit the tiles the carrier is split into.
+        tile_format selects how the parts are packaged: TILE_FORMAT_CONTAINER (a compact binary container)
+        or TILE_FORMAT_ZIP (a zip of PNGs with metadata), or TILE_FORMAT_STREAM, which sends every part as its
+        own frame as soon as it is encoded. The receiver accepts all three.
+        compression selects the codec the content is compressed with before encryption ('none', 'zlib',
+        'lzma' or 'zstd' if installed); content shorter than compression_threshold bytes is sent uncompressed.
+        The receiver reads the codec from the payload, so the peers don't have to use the same one.
+        Raises ValueError if the compression codec isn't available (zstd needs the zstandard package).
+        dh_group is the RFC 3526 MODP group (14, 15 or 16) used for the Diffie-Hellman key exchange.
+        Any of them is accepted from the peer; None uses (and accepts) the legacy small random primes.
+        session_cache keeps the sessions that can be resumed on the next connection to the same peer
+        (shared by every socket of the process by default); None always runs the full key exchange.
+        transfer_chunk_size is the largest single network read; in disk mode, received packages are
+        streamed to disk in chunks of this size.
+        Both directions share a single connection with the peer. port is the local port to listen on;
+        every socket of the process listening on the same port shares it. peer_port is the port the
+        peer listens on (defaults to port).
+        tile_encoder and scheduler let many sockets share their workers (as a hub does): the given
+        TileEncoderPool encodes the parts instead of a pool of the socket's own (encode_workers is then
+        ignored, and the pool is left running on close), and the CPU-heavy pipeline stages run on the
+        FairScheduler's threads, taking turns with the other sockets' stages.
+        receive_high_watermark is the most received messages that may be waiting to be read with receive():
+        the peer only sends while it has credit, which this side grants back once the waiting messages
+        drop to receive_low_watermark (see CreditWindow).
         """
+        if compression not in get_available_codecs():
+            raise ValueError(f"Compression codec '{compression}' is not available")
+
         self.stop_event = Event()
         self.peer_ip = peer_ip
-        self.send_queue = Queue()  # Queue for outgoing data to send
-        self.recv_queue = Queue()  # Queue for incoming received data
+        self.in_memory = in_memory
+        self.owns_tile_encoder = tile_encoder is None
+        self.tile_encoder = tile_encoder or TileEncoderPool(encode_workers)  # Reused across all sent messages
+        self.stage_executor = scheduler.open_session() if scheduler else None  # Runs the CPU-heavy stages
+        self.stage_queue_size = stage_queue_size
+        self.cull_tiles = cull_tiles
+        self.carrier_safety_margin = carrier_safety_margin
+        self.min_tile_size = min_tile_size
+        self.max_tile_size = max_tile_size
+        self.tile_format = tile_format
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.dh_group = dh_group
+        self.session_cache = session_cache
+        self.transfer_chunk_size = transfer_chunk_size
+        self.port = port
+        self.peer_port = peer_port
+        self.send_encoding = None  # Text encoding agreed with the peer for each direction,
+        self.receive_encoding = None  # set during the key exchange
+        self.send_cipher = None  # Session keys of each direction, derived during the key exchange
+        self.receive_cipher = None
+        self.tile_stream = TileStreamAssembler()  # Rebuilds streamed messages on the receive side
+        self.receive_window = CreditWindow(receive_high_watermark, receive_low_watermark)
+        self.send_credit = CreditGate()  # Messages the peer can still accept
+        self.send_queue = Queue()  # Queue for outgoing data to send, bounded by the peer's credit
+        self.recv_queue = Queue(maxsize=receive_high_watermark)  # Queue for incoming received data
         self.sender_thread = Thread()
         self.receiver_thread = Thread()
         self.is_connected = True  # Mark connection status as connected immediately
-        self.peer_send = None
+        self.peer_connected = Event()  # Set once the connection with the peer is established
+        self.peer_send = None  # Sending and receiving sides of the session on that connection
         self.peer_receive = None
 
     def connect(self) -> None:
@@ -60,120 +165,131 @@ class PictureEncryptionSocket:
 
         self.is_connected = True
 
-    def send(self, data: bytes) -> None:
+    def send(self, data: bytes | bytearray | memoryview, block: bool = True, timeout: float | None = None) -> None:
         """
         Adds data to the send queue to be processed by the sender thread.
+        The data is sent as is, so it may be any binary content.
+        Every message takes one credit from the peer's receive window. When there is none left,
+        waits for the peer to grant more if block is True (at most timeout seconds if given),
+        and raises queue.Full if it didn't or block is False.
         Raises an exception if the socket is not connected.
         """
-        if not self.is_connected:
-            raise Exception("Socket not connected")
-        self.send_queue.put(data)
+        self.__queue_message(data, block, timeout)
+
+    def send_text(self, text: str, block: bool = True, timeout: float | None = None) -> None:
+        """
+        Adds text to the send queue. It is encoded with the text encoding agreed with
+        the peer during the key exchange (see send_encoding).
+        Waits for credit like send().
+        Raises an exception if the socket is not connected.
+        """
+        self.__queue_message(text, block, timeout)
 
     def receive(self) -> bytes:
         """
         Waits and returns data from the receive queue.
-        Raises an exception if the socket is disconnected.
+        Raises ConnectionClosed once the connection is closed.
         """
         if not self.is_connected:
             raise Exception("Socket not connected")
         while self.is_connected:
             try:
-                return self.recv_queue.get(timeout=0.2)
+                message = self.recv_queue.get(timeout=0.2)
             except Empty:
                 continue
-        raise Exception("Connection closed")
+            self._consume_credit()
+            return message
+        raise ConnectionClosed("Connection closed")
+
+    def receive_text(self) -> str:
+        """
+        Waits for the next message and decodes it with the text encoding agreed with
+        the peer during the key exchange (see receive_encoding).
+        Raises an exception if the socket is disconnected.
+        """
+        return self.receive().decode(self.receive_encoding)
+
+    def _consume_credit(self) -> None:
+        """
+        Records that a received message was read, and grants the peer credit
+        once the waiting messages drop to the low watermark.
+        """
+        credit = self.receive_window.consume()
+        if credit and self.is_connected:
+            self._send_credit(credit)
+
+    def _send_credit(self, credit: int) -> None:
+        """
+        Grants the peer credit for that many more messages.
+        """
+        self.peer_receive.send_message(CREDIT_GRANT.pack(credit), CHANNEL_CONTROL)
 
     def close(self) -> None:
         """
         Cleanly closes the connection, stopping threads and closing peer sockets.
+        Every resource is released even if the connection already stopped (the peer left
+        or a stage failed), so it may be called at any time, and more than once.
         """
-        if not self.is_connected:
-            return
+        was_connected = self.is_connected
         self.is_connected = False
         self.stop_event.set()  # Signal threads to stop
+        self.send_credit.close()  # Wake up the senders waiting for credit
 
-        self.peer_receive.close()
-        self.peer_send.close()
+        if self.peer_connected.is_set():
+            self.peer_receive.close()
+            self.peer_send.close()
 
         if self.sender_thread.is_alive():
             self.sender_thread.join(timeout=1)
         if self.receiver_thread.is_alive():
             self.receiver_thread.join(timeout=1)
-        print("Connection closed.")
+
+        # Once the send thread stopped, nothing starts the tile encoding processes again
+        if self.owns_tile_encoder:
+            self.tile_encoder.close()
+        if was_connected:
+            print("Connection closed.")
 
     def __send_loop(self):
         """
         Main loop for the sending thread.
-        Handles Diffie-Hellman key exchange to establish encryption key,
-        encrypts data, hides it in images using steganography,
-        splits images into parts, packages into a zip, and sends.
+        Handles the key exchange (Diffie-Hellman, or resuming a cached session with the peer)
+        to establish the encryption key, then runs the
+        send pipeline: compressing, encrypting and hiding in the parts of a carrier image,
+        packaging the parts, and sending each run as their own stage, so consecutive
+        messages overlap.
         """
-        p = random_prime_number()
-        g = find_primitive_root(p)
-        private_key = generate_5_digit_number()
-        self.peer_send = Peer2Peer(self.peer_ip, 5008, 5007)
-
-        send_key = DH_Endpoint(p, g, private_key)
-        public_key = send_key.generate_public_key()
-
-        # Convert integers to bytes for transmission
-        p = int_to_bytes(p)
-        g = int_to_bytes(g)
-        public_key = int_to_bytes(public_key)
-
-        # Send DH parameters and public key to receiver
-        self.peer_send.send_message(p)
-        self.peer_send.send_message(g)
-        self.peer_send.send_message(public_key)
-
-        # Receive the receiver's public key
-        key_public_receiver = self.peer_send.get_message()
-        key_public_receiver = bytes_to_int(key_public_receiver)
-
-        # Generate shared secret key
-        key = int_to_bytes(send_key.generate_full_key(key_public_receiver))
-
-        while not self.stop_event.is_set():
-            try:
-                content = self.send_queue.get(timeout=1)[:MAX_CONTENT_LENGTH]
-            except Empty:
-                continue
-
-            # Create temporary directory to store image parts and files
-            temp_directory = create_random_name_directory(16, get_temp_dir())
-
-            # Encrypt the content with AES using the shared key
-            cipher = AESCipher(key)
-            encrypted_content = cipher.encrypt(content.decode('utf-16'))
-
-            # Generate a random image as a carrier
-            image_path = temp_directory / generate_random_filename(16, 'png')
-            generate_random_image(image_path)
-
-            # Hide the encrypted content inside the image
-            temp_img_with_hidden_content_path = temp_directory / generate_random_filename(16, 'png')
-            hide_message_in_image(image_path, encrypted_content, temp_img_with_hidden_content_path)
-
-            # Split the steganographed image into parts
-            images_matrix = split_image(temp_img_with_hidden_content_path)
-            parts_paths = []
-
-            # Add metadata (row, column) to each image part and save
-            for i, row in enumerate(images_matrix):
-                for j, image in enumerate(row):
-                    part_path = temp_directory / generate_random_filename(16, 'png')
-                    parts_paths.append(part_path)
-                    add_metadata_to_image(image, row_and_column_to_str(i, j), part_path)
-
-            # Create a zip file containing all image parts
-            parts_zip_path = temp_directory / generate_random_filename(16, 'zip')
-            create_zip_file(parts_paths, parts_zip_path)
-
-            # Send the zip file containing image parts to the peer
-            self.peer_send.send_file(parts_zip_path)
-
-            # Clean up temporary files and directory
-            shutil.rmtree(temp_directory)
+        # Start the tile encoding processes while the key exchange is running
+        if self.owns_tile_encoder:
+            self.tile_encoder.start()
+
+        # The send thread establishes the connection for both directions (unless it was given one)
+        if not self.peer_connected.is_set():
+            connector = PeerConnector(self.peer_ip, self.port, self.peer_port, self.transfer_chunk_size)
+            self.peer_send, self.peer_receive = connector.connect()
+            self.peer_connected.set()
+
+        # Agree on the shared secret key and derive the session keys from it
+        self.send_cipher = SessionCipher(self.__run_key_exchange(self._send_key_exchange(), self.peer_send))
+
+        # Bounded queues between the stages
+        compressed_queue = Queue(maxsize=self.stage_queue_size)
+        hidden_queue = Queue(maxsize=self.stage_queue_size)
+        packaged_queue = Queue(maxsize=self.stage_queue_size)
+
+        self.__run_stages([
+            PipelineStage('send-credit', self.__credit_stage, None, None,
+                          self.stop_event, self.__on_stage_error),
+            PipelineStage('send-compress', self._compress_stage, self.send_queue, compressed_queue,
+                          self.stop_event, self.__on_stage_error, executor=self.stage_executor),
+            PipelineStage('send-hide', self._hide_stage, compressed_queue, hidden_queue,
+                          self.stop_event, self.__on_stage_error, executor=self.stage_executor),
+            PipelineStage('send-package', self._package_stage, hidden_queue, packaged_queue,
+                          self.stop_event, self.__on_stage_error,
+                          fan_out=self.tile_format == TILE_FORMAT_STREAM, executor=self.stage_executor),
+            PipelineStage('send-transmit', self.__transmit_stage, packaged_queue, None,
+                          self.stop_event, self.__on_stage_error),
+        ])
 
         self.peer_send.close()
 
@@ -187,6 +303,7 @@ class PictureEncryptionSocket:
         except:
             self.stop_event.set()
             self.is_connected = False
+            self.send_credit.close()
 
     def __safe_send_loop(self):
         """
@@ -198,94 +315,561 @@ class PictureEncryptionSocket:
         except:
             self.stop_event.set()
             self.is_connected = False
+            self.send_credit.close()
 
     def __receive_loop(self):
         """
         Main loop for the receiver thread.
-        Performs Diffie-Hellman key exchange to establish shared key,
-        receives zip files of image parts,
-        reconstructs images and extracts the hidden encrypted message,
-        then decrypts and puts the content into the receive queue.
+        Performs the key exchange (Diffie-Hellman, or resuming a cached session with the peer)
+        to establish the shared key, then runs the
+        receive pipeline: reading packages of image parts from the network,
+        unpacking the parts, revealing the hidden encrypted message from the parts
+        that hold it, decrypting it and decompressing it into the receive queue
+        each run as their own stage.
+        """
+        # Wait for the send thread to establish the connection
+        while not self.peer_connected.wait(timeout=0.2):
+            if self.stop_event.is_set():
+                return
+
+        # Agree on the shared secret key and derive the session keys from it
+        self.receive_cipher = SessionCipher(self.__run_key_exchange(self._receive_key_exchange(), self.peer_receive))
+
+        # Open the receive window: the peer may send up to the high watermark
+        credit = self.receive_window.open()
+        if credit:
+            self._send_credit(credit)
+
+        # Bounded queues between the stages
+        received_queue = Queue(maxsize=self.stage_queue_size)
+        unpacked_queue = Queue(maxsize=self.stage_queue_size)
+        revealed_queue = Queue(maxsize=self.stage_queue_size)
+        decrypted_queue = Queue(maxsize=self.stage_queue_size)
+
+        self.__run_stages([
+            PipelineStage('receive-read', self.__read_stage, None, received_queue,
+                          self.stop_event, self.__on_stage_error),
+            PipelineStage('receive-unpack', self._unpack_stage, received_queue, unpacked_queue,
+                          self.stop_event, self.__on_stage_error, executor=self.stage_executor),
+            PipelineStage('receive-reveal', self._reveal_stage, unpacked_queue, revealed_queue,
+                          self.stop_event, self.__on_stage_error, executor=self.stage_executor),
+            PipelineStage('receive-decrypt', self._decrypt_stage, revealed_queue, decrypted_queue,
+                          self.stop_event, self.__on_stage_error, executor=self.stage_executor),
+            PipelineStage('receive-decompress', self._decompress_stage, decrypted_queue, self.recv_queue,
+                          self.stop_event, self.__on_stage_error, executor=self.stage_executor),
+        ])
+
+        self.peer_receive.close()
+
+    def __run_key_exchange(self, key_exchange: KeyExchange, endpoint: ChannelEndpoint) -> bytes:
+        """
+        Runs a key exchange (see advance_key_exchange) over the handshake channel of one side of
+        the session, and returns the shared secret key.
+        """
+        message = None
+        while True:
+            done, request = advance_key_exchange(key_exchange, message)
+            if done:
+                return request
+            message = None
+            if request is None:
+                message = endpoint.get_message(CHANNEL_HANDSHAKE)
+            else:
+                endpoint.send_message(request, CHANNEL_HANDSHAKE)
+
+    def _send_key_exchange(self) -> KeyExchange:
         """
-        key_private = generate_5_digit_number()
-        self.peer_receive = Peer2Peer(self.peer_ip, 5007, 5008)
+        Key exchange of the send direction, run by the side that proposes the parameters.
+        The first message offers the supported text encodings and, if a session with the peer
+        can be resumed, its ticket. Without a ticket the Diffie-Hellman parameters and public key
+        follow right away; with one, the receiver either accepts it and both sides derive a new key
+        from the cached session (skipping Diffie-Hellman) or asks for a full exchange.
+        Either way the receiver ends by issuing a ticket for the next connection.
+        Returns the shared secret key. The exchange doesn't do any I/O itself (see advance_key_exchange),
+        so the threaded and the asyncio sockets run the same one.
+        """
+        cached_session = self.session_cache.get(('ticket', self.peer_ip)) if self.session_cache else None
+        sender_nonce = secrets.token_bytes(RESUMPTION_NONCE_SIZE)
+
+        # Offer the supported text encodings; the receiver picks the one used for this direction
+        yield ','.join(SUPPORTED_TEXT_ENCODINGS).encode('ascii')
+        yield cached_session.ticket if cached_session else b''
+        yield sender_nonce
+
+        send_key = None
+        if cached_session is None:
+            send_key = yield from self.__send_dh_parameters()
+
+        self.send_encoding = (yield).decode('ascii')
+        handshake_mode = yield
+
+        if handshake_mode == HANDSHAKE_RESUMED:
+            receiver_nonce = yield
+            key = derive_resumed_key(cached_session.resumption_secret, sender_nonce, receiver_nonce)
+        else:
+            if send_key is None:
+                # The ticket was refused (e.g. expired on the peer's side), so fall back to Diffie-Hellman
+                send_key = yield from self.__send_dh_parameters()
+
+            # Receive the receiver's public key
+            key_public_receiver = bytes_to_int((yield))
+
+            # Generate shared secret key
+            key = int_to_bytes(send_key.generate_full_key(key_public_receiver))
+
+        # Keep the ticket for the next connection to this peer
+        ticket = bytes((yield))
+        if self.session_cache is not None and ticket:
+            self.session_cache.put(('ticket', self.peer_ip), ticket, derive_resumption_secret(key), self.peer_ip)
 
+        return key
+
+    def __send_dh_parameters(self) -> Generator[bytes, None, DH_Endpoint]:
+        """
+        Sends the Diffie-Hellman parameters and this side's public key to the receiver.
+        """
+        if self.dh_group is None:
+            # Legacy parameters: a small random prime and one of its primitive roots
+            p = random_prime_number()
+            g = find_primitive_root(p)
+        else:
+            p, g = MODP_GROUPS[self.dh_group]
+
+        send_key = DH_Endpoint(p, g, generate_private_key(p))
+        public_key = send_key.generate_public_key()
+
+        # Send DH parameters and public key to receiver, converting integers to bytes for transmission
+        yield int_to_bytes(p)
+        yield int_to_bytes(g)
+        yield int_to_bytes(public_key)
+
+        return send_key
+
+    def _receive_key_exchange(self) -> KeyExchange:
+        """
+        Key exchange of the receive direction (see _send_key_exchange).
+        A ticket is accepted once, only from the peer it was issued to and only before it expires.
+        Returns the shared secret key.
+        """
+        # Pick the most preferred text encoding that the sender also offers
+        offered_encodings = (yield).decode('ascii').split(',')
+        self.receive_encoding = next(
+            (encoding for encoding in SUPPORTED_TEXT_ENCODINGS if encoding in offered_encodings), None)
+        if self.receive_encoding is None:
+            raise ValueError("No common text encoding")
+        ticket = bytes((yield))
+        sender_nonce = yield
+
+        cached_session = None
+        if self.session_cache is not None and ticket:
+            cached_session = self.session_cache.pop(('issued', ticket))
+            if cached_session is not None and cached_session.peer_ip != self.peer_ip:
+                cached_session = None
+
+        yield self.receive_encoding.encode('ascii')
+
+        if cached_session is not None:
+            # Resume: derive a new key from the cached session and fresh nonces, without Diffie-Hellman
+            receiver_nonce = secrets.token_bytes(RESUMPTION_NONCE_SIZE)
+            yield HANDSHAKE_RESUMED
+            yield receiver_nonce
+            key = derive_resumed_key(cached_session.resumption_secret, sender_nonce, receiver_nonce)
+        else:
+            yield HANDSHAKE_FULL
+            key = yield from self.__receive_dh_parameters()
+
+        # Issue a new ticket for the next connection from this peer
+        ticket = b''
+        if self.session_cache is not None:
+            ticket = secrets.token_bytes(TICKET_SIZE)
+            self.session_cache.put(('issued', ticket), ticket, derive_resumption_secret(key), self.peer_ip)
+        yield ticket
+
+        return key
+
+    def __receive_dh_parameters(self) -> KeyExchange:
+        """
+        Receives the Diffie-Hellman parameters and the sender's public key, replies with
+        this side's public key and returns the shared secret key.
+        """
         # Receive DH parameters and sender's public key
-        p = self.peer_receive.get_message()
-        g = self.peer_receive.get_message()
-        key_public_sender = self.peer_receive.get_message()
+        p = bytes_to_int((yield))
+        g = bytes_to_int((yield))
+        key_public_sender = bytes_to_int((yield))
 
-        p = bytes_to_int(p)
-        g = bytes_to_int(g)
-        key_public_sender = bytes_to_int(key_public_sender)
+        # Unless legacy parameters are allowed, only accept the standard groups
+        if self.dh_group is not None and (p, g) not in MODP_GROUPS.values():
+            raise ValueError("Peer proposed non-standard Diffie-Hellman parameters")
 
         # Generate receiver's DH key pair
-        receive_key = DH_Endpoint(p, g, key_private)
+        receive_key = DH_Endpoint(p, g, generate_private_key(p))
         public_key = receive_key.generate_public_key()
 
         # Send public key back to sender
-        public_key = int_to_bytes(public_key)
-        self.peer_receive.send_message(public_key)
+        yield int_to_bytes(public_key)
 
         # Generate shared secret key
-        key = int_to_bytes(receive_key.generate_full_key(key_public_sender))
+        return int_to_bytes(receive_key.generate_full_key(key_public_sender))
+
+    def __queue_message(self, content: bytes | bytearray | memoryview | str, block: bool,
+                        timeout: float | None) -> None:
+        """
+        Takes one credit for a message (see send) and adds it to the send queue.
+        """
+        if not self.is_connected:
+            raise Exception("Socket not connected")
+        if not self.send_credit.acquire(block, timeout):
+            raise Full("The peer's receive window is full")
+        self.send_queue.put(content)
+
+    def __run_stages(self, stages: list[PipelineStage]) -> None:
+        """
+        Starts the pipeline stages and blocks until the socket is stopped.
+        """
+        for stage in stages:
+            stage.start()
+
+        self.stop_event.wait()
+
+        for stage in stages:
+            stage.join(timeout=1)
 
-        while not self.stop_event.is_set():
-            # Create temporary directory for received files
-            temp_directory = create_random_name_directory(16, get_temp_dir())
+    def __on_stage_error(self, error: Exception) -> None:
+        """
+        Called when a pipeline stage fails; stops the whole connection
+        in the same way as the safe loop wrappers.
+        The connection closing (and anything failing once the socket is stopping) is a normal stop, not reported.
+        """
+        if not isinstance(error, ConnectionClosed) and not self.stop_event.is_set():
+            print(f"Pipeline stage failed: {error}")
+        self.stop_event.set()
+        self.is_connected = False
+        self.send_credit.close()
+
+    def _compress_stage(self, content: bytes | bytearray | memoryview | str) -> bytes:
+        """
+        First send stage: encodes text content, then compresses the content with the selected codec.
+        The payload starts with a flag byte naming the codec that was used.
+        """
+        if isinstance(content, str):
+            content = self.__encode_text(content)
+        else:
+            # Slice through a view, so large binary content isn't copied
+            content = memoryview(content).cast('B')[:MAX_CONTENT_LENGTH]
+
+        return compress_payload(content, self.compression, self.compression_threshold)
+
+    def __encode_text(self, text: str) -> bytes:
+        """
+        Encodes text with the agreed send encoding, shortened to MAX_CONTENT_LENGTH bytes
+        without cutting a character in half.
+        """
+        content = text.encode(self.send_encoding)
+        if len(content) > MAX_CONTENT_LENGTH:
+            # Dropping the incomplete last character keeps the content decodable
+            content = content[:MAX_CONTENT_LENGTH].decode(self.send_encoding, errors='ignore').encode(self.send_encoding)
+        return content
+
+    def _hide_stage(self, payload: bytes) -> ImageParts:
+        """
+        Second send stage: encrypts the payload, splits a random carrier image into parts
+        and hides the encrypted payload across the leading parts (row-major order).
+        When tile culling is enabled, only the parts that hold the payload are kept.
+        """
+        # Encrypt the payload with the session's AES-GCM key
+        encrypted_content = self.send_cipher.encrypt(payload)
+
+        # Pick the smallest carrier that fits the encrypted content, and a grid that suits its size
+        width, height = get_carrier_size(len(encrypted_content), self.carrier_safety_margin,
+                                         self.min_tile_size, self.max_tile_size)
+        rows, cols = choose_grid(width, height, self.min_tile_size, self.max_tile_size)
+
+        if self.in_memory:
+            # Generate a random image as a carrier and split it into parts
+            images_matrix = split_image_array(create_random_image(width, height), rows, cols)
+            return self.__hide_in_parts(images_matrix, width, height, encrypted_content)
+
+        # Create temporary directory to store image parts and files
+        temp_directory = create_random_name_directory(16, get_temp_dir())
+
+        # Generate a random image as a carrier
+        image_path = temp_directory / generate_random_filename(16, 'png')
+        generate_random_image(image_path, width, height)
+
+        # Split the carrier into parts and hide the encrypted content inside them
+        images_matrix = split_image_array(image_path, rows, cols)
+        image_parts = self.__hide_in_parts(images_matrix, width, height, encrypted_content)
+        image_parts.temp_directory = temp_directory
+        return image_parts
+
+    def _package_stage(self, image_parts: ImageParts) -> bytes | tuple[Path, Path] | Iterator[bytes]:
+        """
+        Third send stage: encodes each image part and packages the parts, either into a
+        tile container or, in zip format, into a zip of PNGs carrying their position as metadata.
+        Returns the packaged bytes, or (temporary directory, package path) in disk mode.
+        In stream format, returns the frames to send one by one instead.
+        """
+        if self.tile_format == TILE_FORMAT_STREAM:
+            return self.__stream_frames(image_parts)
+
+        images = [part.image for part in image_parts.parts]
+
+        if self.tile_format == TILE_FORMAT_CONTAINER:
+            # The container index holds every position, so the parts are encoded as plain PNG, in parallel
+            container = create_tile_container(image_parts, self.tile_encoder.encode(images))
+            if self.in_memory:
+                return container
+
+            container_path = image_parts.temp_directory / generate_random_filename(16, 'bin')
+            container_path.write_bytes(container)
+            return image_parts.temp_directory, container_path
+
+        parts_metadata = [tile_position_to_str(part.row, part.column, part.left, part.top)
+                          for part in image_parts.parts]
+        # The zip comment describes the full grid and image size
+        grid_description = grid_to_str(image_parts.rows, image_parts.columns, image_parts.width, image_parts.height)
+
+        if self.in_memory:
+            # Encode each image part as PNG bytes with its position metadata, in parallel
+            encoded_parts = self.tile_encoder.encode(images, parts_metadata)
+            parts = [(generate_random_filename(16, 'png'), part_bytes) for part_bytes in encoded_parts]
+
+            return create_zip_bytes(parts, grid_description)
+
+        temp_directory = image_parts.temp_directory
+
+        # Add position metadata to each image part and save, in parallel
+        parts_paths = [temp_directory / generate_random_filename(16, 'png') for _ in images]
+        self.tile_encoder.save(images, parts_metadata, parts_paths)
+
+        # Create a zip file containing all image parts
+        parts_zip_path = temp_directory / generate_random_filename(16, 'zip')
+        create_zip_file(parts_paths, parts_zip_path, grid_description)
+
+        return temp_directory, parts_zip_path
+
+    def __stream_frames(self, image_parts: ImageParts) -> Iterator[bytes]:
+        """
+        Yields a header frame with the grid geometry, then one frame per image part as soon as
+        that part is encoded, so the first parts are on the wire while the rest are still encoding.
+        """
+        yield create_stream_header(image_parts)
+
+        encoded_parts = self.tile_encoder.encode_iter([part.image for part in image_parts.parts])
+        for part, part_bytes in zip(image_parts.parts, encoded_parts):
+            yield create_stream_tile_frame(part, part_bytes)
+
+        if image_parts.temp_directory is not None:
+            # Clean up the carrier image once every part is encoded
+            shutil.rmtree(image_parts.temp_directory)
+
+    def __credit_stage(self) -> None:
+        """
+        Source stage of the send pipeline: adds the credit the peer grants as it reads the messages.
+        """
+        (credit,) = CREDIT_GRANT.unpack(self.peer_send.get_message(CHANNEL_CONTROL))
+        self.send_credit.grant(credit)
+
+    def __transmit_stage(self, packaged: bytes | tuple[Path, Path]) -> None:
+        """
+        Last send stage: sends the packaged image parts (or one stream frame) to the peer,
+        followed by the tag that authenticates the transfer.
+        """
+        if isinstance(packaged, bytes):
+            self.peer_send.send_message(packaged)
+            self.peer_send.send_message(self.send_cipher.sign_transfer(packaged))
+            return
 
-            parts_zip_path = temp_directory / generate_random_filename(16, 'zip')
+        temp_directory, parts_zip_path = packaged
 
-            # Receive the zip file containing the image parts
-            self.peer_receive.get_file(parts_zip_path)
+        # Send the zip file containing image parts to the peer
+        self.peer_send.send_file(parts_zip_path)
+        self.peer_send.send_message(self.send_cipher.sign_transfer_file(parts_zip_path))
 
-            # Extract the zip to a subdirectory
-            parts_directory = create_random_name_directory(16, temp_directory)
-            extract_zip_file(parts_zip_path, parts_directory)
+        # Clean up temporary files and directory
+        shutil.rmtree(temp_directory)
+
+    def __read_stage(self) -> bytearray | tuple[Path, Path]:
+        """
+        First receive stage: reads the next package of image parts from the network and checks
+        the tag that follows it, so a modified package is rejected before anything is decoded.
+        Returns the package bytes, or (temporary directory, package path) in disk mode.
+        """
+        if self.in_memory:
+            package = self.peer_receive.get_message()
+            self.receive_cipher.verify_transfer(package, self.peer_receive.get_message())
+            return package
+
+        # Create temporary directory for received files
+        temp_directory = create_random_name_directory(16, get_temp_dir())
+
+        parts_zip_path = temp_directory / generate_random_filename(16, 'zip')
+
+        # Receive the zip file containing the image parts
+        self.peer_receive.get_file(parts_zip_path)
+        try:
+            self.receive_cipher.verify_transfer_file(parts_zip_path, self.peer_receive.get_message())
+        except ValueError:
+            shutil.rmtree(temp_directory)
+            raise
+
+        return temp_directory, parts_zip_path
+
+    def _unpack_stage(self, received: bytearray | tuple[Path, Path]) -> ImageParts | None:
+        """
+        Second receive stage: reads the image parts out of a tile container or a zip
+        (whichever the peer sent) and orders them by (row, column).
+        The parts are opened lazily, so no pixel data is decoded yet.
+        Stream frames are decoded as they arrive instead; the parts are returned once the
+        parts that hold the message are complete, and None is returned for the other frames.
+        """
+        if not self.in_memory:
+            temp_directory, package_path = received
+            if self.tile_stream.is_receiving() or is_tile_stream(package_path):
+                # Stream frames are small and assembled in memory
+                received = package_path.read_bytes()
+                shutil.rmtree(temp_directory)
+
+        if not isinstance(received, tuple) and (self.tile_stream.is_receiving() or is_tile_stream(received)):
+            return self.tile_stream.add_frame(received)
+
+        if self.in_memory:
+            if is_tile_container(received):
+                return self.__check_parts(read_tile_container(received))
 
             metadata_images = []
 
-            # Read metadata and load each image part
-            for file in os.listdir(parts_directory):
-                file_path = parts_directory / file
-                index_str = read_metadata_from_image(file_path)
+            # Open each image part once, reading its metadata from the same object
+            for _, part_bytes in read_zip_bytes(received):
+                img, index_str = decode_image_with_metadata(part_bytes)
+                metadata_images.append(SplittedImageInfo(*self.__parse_tile_position(index_str, img)))
 
-                img = Image.open(file_path)
-                row, col = str_to_row_and_column(index_str)
-                metadata_images.append(SplittedImageInfo(row, col, img))
+            return self.__sort_parts(metadata_images, read_zip_comment(received))
 
-            # Sort images by row and column to restore original order
-            metadata_images.sort(key=lambda info: (info.row, info.column))
+        temp_directory, package_path = received
 
-            num_of_rows = metadata_images[-1].row + 1
-            num_of_cols = metadata_images[-1].column + 1
+        if is_tile_container(package_path):
+            image_parts = self.__check_parts(read_tile_container(package_path.read_bytes()))
+        else:
+            image_parts = self.__unpack_zip_file(temp_directory, package_path)
 
-            parts_matrix = []
+        image_parts.temp_directory = temp_directory
+        return image_parts
 
-            # Rebuild the matrix of image parts
-            img_index = 0
-            for i in range(num_of_rows):
-                row = []
-                for j in range(num_of_cols):
-                    row.append(metadata_images[img_index].image)
-                    img_index += 1
-                parts_matrix.append(row)
+    def __unpack_zip_file(self, temp_directory: Path, parts_zip_path: Path) -> ImageParts:
+        """
+        Extracts a zip of image parts into the temporary directory and opens each part.
+        """
+        # Extract the zip to a subdirectory
+        parts_directory = create_random_name_directory(16, temp_directory)
+        extract_zip_file(parts_zip_path, parts_directory)
 
-            # Restore the full image from parts
-            restored_img_path = temp_directory / generate_random_filename(16, 'png')
-            restore_image(parts_matrix, restored_img_path)
+        metadata_images = []
 
-            # Reveal the encrypted message hidden in the image
-            encrypted_content = reveal_message_from_image(restored_img_path)
+        # Read metadata and open each image part
+        for file in os.listdir(parts_directory):
+            file_path = parts_directory / file
+            index_str = read_metadata_from_image(file_path)
 
-            # Decrypt the content using AES with the shared key
-            cipher = AESCipher(key)
-            content = cipher.decrypt(encrypted_content)
+            img = Image.open(file_path)
+            metadata_images.append(SplittedImageInfo(*self.__parse_tile_position(index_str, img)))
 
-            # Put the decrypted content in the receive queue
-            self.recv_queue.put(content.encode('utf-16'))
+        return self.__sort_parts(metadata_images, read_zip_comment(parts_zip_path))
 
+    def _reveal_stage(self, image_parts: ImageParts) -> bytes:
+        """
+        Third receive stage: reveals the encrypted message hidden in the image parts.
+        Only the parts within the span recorded in the payload header are decoded.
+        """
+        encrypted_content = reveal_bytes_from_tiles([part.image for part in image_parts.parts])
+
+        if image_parts.temp_directory is not None:
             # Clean up temporary files and directory
-            shutil.rmtree(temp_directory)
+            shutil.rmtree(image_parts.temp_directory)
 
-        self.peer_receive.close()
+        return encrypted_content
+
+    def _decrypt_stage(self, encrypted_content: bytes) -> bytes:
+        """
+        Fourth receive stage: decrypts the payload with the session's AES-GCM key,
+        rejecting it if it was modified.
+        """
+        return self.receive_cipher.decrypt(encrypted_content)
+
+    @staticmethod
+    def _decompress_stage(payload: bytes) -> bytes:
+        """
+        Last receive stage: decompresses the payload with the codec named by its flag byte.
+        The result is put in the receive queue.
+        """
+        return decompress_payload(payload, MAX_CONTENT_LENGTH)
+
+    def __hide_in_parts(self, images_matrix: list[list[np.ndarray]], width: int, height: int,
+                        encrypted_content: bytes) -> ImageParts:
+        """
+        Hides the encrypted content across the image parts in (row, column) order and records
+        each part's exact offset in the carrier image of the given size.
+        With tile culling enabled, only the leading parts that hold the content are returned.
+        """
+        rows, cols = len(images_matrix), len(images_matrix[0])
+        images = hide_bytes_in_tiles([image for row in images_matrix for image in row], encrypted_content)
+
+        if self.cull_tiles:
+            images = images[:get_tile_span(images, len(encrypted_content))]
+
+        parts = []
+        for index, image in enumerate(images):
+            row, col = divmod(index, cols)
+            left, top, _, _ = get_tile_box(width, height, rows, cols, row, col)
+            parts.append(SplittedImageInfo(row, col, image, left, top))
+        return ImageParts(rows, cols, width, height, parts)
+
+    @staticmethod
+    def __parse_tile_position(position_str: str, img: Image.Image) -> tuple[int, int, Image.Image, int, int]:
+        """
+        Parses a part's "row_col_left_top" metadata into the fields of SplittedImageInfo.
+        """
+        row, col, left, top = str_to_tile_position(position_str)
+        return row, col, img, left, top
+
+    @staticmethod
+    def __sort_parts(metadata_images: list[SplittedImageInfo], grid_description: str) -> ImageParts:
+        """
+        Sorts the received image parts by row and column. The parts must be the leading parts,
+        in row-major order, of the grid described by grid_description ("rows_cols_width_height").
+        Without a description, every part of the LEGACY_GRID must be there, and the carrier size
+        is where the parts end.
+        """
+        metadata_images.sort(key=lambda info: (info.row, info.column))
+        if grid_description:
+            rows, cols, width, height = str_to_grid(grid_description)
+        else:
+            rows, cols = LEGACY_GRID
+            if len(metadata_images) != rows * cols:
+                raise ValueError(f"Expected every part of the {rows}x{cols} grid without a grid description")
+            width = max(info.left + info.image.width for info in metadata_images)
+            height = max(info.top + info.image.height for info in metadata_images)
+
+        return PictureEncryptionSocket.__check_parts(ImageParts(rows, cols, width, height, metadata_images))
+
+    @staticmethod
+    def __check_parts(image_parts: ImageParts) -> ImageParts:
+        """
+        Checks that the received parts are the leading parts of their grid in row-major order.
+        The payload is read in that order, so there must be no gaps before the last part.
+        """
+        for index, info in enumerate(image_parts.parts):
+            if info.row * image_parts.columns + info.column != index:
+                raise ValueError(f"Image part {index} of the {image_parts.rows}x{image_parts.columns} grid is missing")
+
+        return image_parts
+
+
+# Runs a key exchange up to its next I/O: it yields each message to send to the peer, and None when it
+# waits for the peer's next message, which is passed back in as message (None otherwise).
+# Returns (False, the message to send or None), or (True, the shared secret key) once the exchange is over.
+def advance_key_exchange(key_exchange: KeyExchange, message: bytearray | None = None) -> tuple[bool, bytes | None]:
+    try:
+        return False, key_exchange.send(message)
+    except StopIteration as result:
+        return True, result.value
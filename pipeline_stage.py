@@ -0,0 +1,167 @@
+import asyncio
+import inspect
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Any, Callable, Final, Iterable
+
+from fair_scheduler import SchedulerSession
+
+# How long a stage waits on a queue before re-checking the stop event
+QUEUE_POLL_TIMEOUT_IN_SECONDS: Final[float] = 0.2
+
+
+# PipelineStage runs one step of a processing pipeline on its own thread.
+# It takes items from an input queue, applies the worker function and puts the result
+# on the output queue. Bounded queues between stages let consecutive items overlap:
+# while one stage works on item N, the previous stage can already work on item N + 1.
+# Because every stage is a single thread reading a FIFO queue, the item order is preserved.
+class PipelineStage:
+    name: str
+    worker: Callable[..., Any]
+    input_queue: Queue | None
+    output_queue: Queue | None
+    stop_event: Event
+    on_error: Callable[[Exception], None]
+    fan_out: bool
+    executor: SchedulerSession | None
+    thread: Thread
+
+    # - worker: called with each input item (or with no arguments when input_queue is None,
+    #   which makes this a source stage, e.g. a network read); returning None emits nothing
+    # - on_error: called once if the worker raises, after which the stage stops
+    # - fan_out: the worker returns an iterable and each of its items is emitted separately,
+    #   as soon as it is produced (e.g. one network frame per encoded tile)
+    # - executor: runs the worker on a shared pool (see FairScheduler) instead of on the stage thread,
+    #   for CPU-heavy stages of sessions that share the machine with many others
+    def __init__(self, name: str, worker: Callable[..., Any], input_queue: Queue | None,
+                 output_queue: Queue | None, stop_event: Event, on_error: Callable[[Exception], None],
+                 fan_out: bool = False, executor: SchedulerSession | None = None) -> None:
+        self.name = name
+        self.worker = worker
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+        self.on_error = on_error
+        self.fan_out = fan_out
+        self.executor = executor
+        self.thread = Thread(target=self.__run, name=name, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def join(self, timeout: float | None = None) -> None:
+        if self.thread.is_alive():
+            self.thread.join(timeout=timeout)
+
+    # Main loop of the stage thread
+    def __run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                if self.input_queue is None:
+                    result = self.worker()
+                else:
+                    try:
+                        item = self.input_queue.get(timeout=QUEUE_POLL_TIMEOUT_IN_SECONDS)
+                    except Empty:
+                        continue
+                    result = self.worker(item) if self.executor is None else self.executor.run(self.worker, item)
+
+                if result is not None and self.output_queue is not None:
+                    if self.fan_out:
+                        self.__put_all(result)
+                    else:
+                        self.__put(result)
+            except Exception as e:
+                if not self.stop_event.is_set():
+                    self.on_error(e)
+                return
+
+    # Emits every item of a fanned-out result, stopping early if the pipeline is stopping
+    def __put_all(self, items: Iterable[Any]) -> None:
+        for item in items:
+            if self.stop_event.is_set():
+                return
+            self.__put(item)
+
+    # Puts an item on the (bounded) output queue, waiting for room unless the pipeline is stopping
+    def __put(self, item: Any) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.output_queue.put(item, timeout=QUEUE_POLL_TIMEOUT_IN_SECONDS)
+                return
+            except Full:
+                continue
+
+
+# AsyncPipelineStage is the asyncio version of PipelineStage: one step of a processing pipeline
+# run as a task of the event loop, taking items from an asyncio.Queue as soon as they arrive.
+# Workers that are coroutine functions (e.g. network reads) are awaited on the event loop; the others
+# are CPU-heavy and run as jobs on the executor (see run_job), so the stage holds no thread of its own.
+# The stage runs until it is cancelled.
+class AsyncPipelineStage:
+    name: str
+    worker: Callable[..., Any]
+    input_queue: asyncio.Queue | None
+    output_queue: asyncio.Queue | None
+    on_error: Callable[[Exception], None]
+    fan_out: bool
+    executor: SchedulerSession | None
+    task: asyncio.Task | None
+
+    # Same arguments as PipelineStage, except that there is no stop event: the stage stops when cancelled
+    def __init__(self, name: str, worker: Callable[..., Any], input_queue: asyncio.Queue | None,
+                 output_queue: asyncio.Queue | None, on_error: Callable[[Exception], None],
+                 fan_out: bool = False, executor: SchedulerSession | None = None) -> None:
+        self.name = name
+        self.worker = worker
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.on_error = on_error
+        self.fan_out = fan_out
+        self.executor = executor
+        self.task = None
+
+    def start(self) -> None:
+        self.task = asyncio.get_running_loop().create_task(self.__run(), name=self.name)
+
+    def cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+    # Waits until the stage task ended
+    async def join(self) -> None:
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    # Main loop of the stage task
+    async def __run(self) -> None:
+        try:
+            while True:
+                if self.input_queue is None:
+                    result = await self.__call_worker()
+                else:
+                    result = await self.__call_worker(await self.input_queue.get())
+
+                if result is not None and self.output_queue is not None:
+                    if self.fan_out:
+                        # Each item may take a while to produce (e.g. a tile to encode), so it's a job of its own
+                        items = iter(result)
+                        while (item := await run_job(self.executor, next, items, None)) is not None:
+                            await self.output_queue.put(item)
+                    else:
+                        await self.output_queue.put(result)
+        except Exception as e:
+            self.on_error(e)
+
+    async def __call_worker(self, *args: Any) -> Any:
+        if inspect.iscoroutinefunction(self.worker):
+            return await self.worker(*args)
+        return await run_job(self.executor, self.worker, *args)
+
+
+# Runs a blocking function as a job of the executor (see FairScheduler) without blocking the event loop,
+# or on the event loop's default executor when there is none, and returns its result
+async def run_job(executor: SchedulerSession | None, function: Callable[..., Any], *args: Any) -> Any:
+    if executor is None:
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+    return await asyncio.wrap_future(executor.submit(function, *args))
@@ -1,10 +1,10 @@
 from base64 import b64decode
+from io import BytesIO
 from pathlib import Path
 
-import requests
 from PIL import Image
 
-from utils import generate_random_color, jpg_to_png
+from utils import generate_random_color
 
 API_KEY = ""  # Fixme store in another place
 API_NINJAS_RANDOM_IMAGE_ENDPOINT = "https://api.api-ninjas.com/v1/randomimage?width={width}&height={height}"
@@ -13,6 +13,13 @@ headers = {"X-Api-Key": API_KEY}
 
 # Fetches an image from the API Ninjas random image endpoint as raw bytes
 def fetch_image_from_api(width: int, height: int) -> bytes:
+    # Without an API key the request can only fail, so skip the network round trip
+    if not API_KEY:
+        return b''
+
+    # requests is imported on first use, as most sessions never call the API
+    import requests
+
     # Format the endpoint URL with requested image dimensions
     formatted_endpoint = API_NINJAS_RANDOM_IMAGE_ENDPOINT.format(width=width, height=height)
     # Make the HTTP GET request with API key header
@@ -28,18 +35,22 @@ def fetch_image_from_api(width: int, height: int) -> bytes:
     img_bytes = b64decode(img_base64)
     return img_bytes
 
-# Generates a random image and saves it to the given path, falling back to a solid color if the API fails
-def generate_random_image(output_image_path: str | Path, width: int = 640, height: int = 480) -> None:
+# Generates a random image in memory, falling back to a solid color if the API fails
+def create_random_image(width: int = 640, height: int = 480) -> Image.Image:
     # Try fetching image bytes from the API
     img_bytes = fetch_image_from_api(width, height)
     # If the API fetch failed, generate a solid-color image as fallback
     if not img_bytes:
-        default_img = Image.new("RGB", (width, height), color=generate_random_color())
-        default_img.save(output_image_path, format="PNG")
-        return
-
-    # Convert the downloaded JPG bytes to PNG format bytes
-    png_img_bytes = jpg_to_png(img_bytes)
-    # Write the PNG image bytes to the output file
-    with open(output_image_path, 'wb') as f:
-        f.write(png_img_bytes)
+        return Image.new("RGB", (width, height), color=generate_random_color())
+
+    # Decode the downloaded JPG bytes directly, without a PNG round-trip
+    img = Image.open(BytesIO(img_bytes)).convert("RGB")
+    # The carrier size is chosen to fit the payload, so make sure the API honoured it
+    if img.size != (width, height):
+        img = img.resize((width, height))
+    return img
+
+# Generates a random image and saves it to the given path, falling back to a solid color if the API fails.
+# It is the same image create_random_image returns, so both modes get a carrier of the requested size.
+def generate_random_image(output_image_path: str | Path, width: int = 640, height: int = 480) -> None:
+    create_random_image(width, height).save(output_image_path, format="PNG")
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from threading import Lock
+from typing import Final
+
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+
+from data_info import CachedSession
+
+# Size of a resumption ticket and of the fresh nonces that each resumed key is derived from
+TICKET_SIZE: Final[int] = 16
+RESUMPTION_NONCE_SIZE: Final[int] = 16
+
+# How long a session can be resumed, and how many sessions are kept at most
+DEFAULT_SESSION_TTL_IN_SECONDS: Final[float] = 60 * 60
+DEFAULT_MAX_SESSIONS: Final[int] = 256
+
+# Labels that keep the derived secrets independent of the session keys
+RESUMPTION_SECRET_CONTEXT: Final[bytes] = b'picture-encryption-socket resumption secret v1'
+RESUMED_KEY_CONTEXT: Final[bytes] = b'picture-encryption-socket resumed key v1'
+
+
+# Derives the secret kept for resuming a session from that session's shared key
+def derive_resumption_secret(shared_key: bytes) -> bytes:
+    return HKDF(shared_key, 32, b'', SHA256, context=RESUMPTION_SECRET_CONTEXT)
+
+# Derives the shared key of a resumed session. Fresh nonces from both sides make every resumed
+# key different, even when the same resumption secret is used.
+def derive_resumed_key(resumption_secret: bytes, sender_nonce: bytes, receiver_nonce: bytes) -> bytes:
+    return HKDF(resumption_secret, 32, sender_nonce + receiver_nonce, SHA256, context=RESUMED_KEY_CONTEXT)
+
+
+# SessionCache keeps the sessions that can be resumed, with a time to live and least-recently-used eviction.
+# The side that sends the Diffie-Hellman parameters keeps its ticket by peer IP; the side that issues
+# tickets keeps them by ticket. One cache can be shared by every socket of a process (and is thread-safe),
+# so reconnecting with a new socket resumes the previous session.
+class SessionCache:
+    ttl: float
+    max_sessions: int
+    sessions: OrderedDict[Hashable, CachedSession]
+
+    def __init__(self, ttl: float = DEFAULT_SESSION_TTL_IN_SECONDS, max_sessions: int = DEFAULT_MAX_SESSIONS) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = Lock()
+
+    # Stores a session under the given key, evicting the least recently used session when full
+    def put(self, key: Hashable, ticket: bytes, resumption_secret: bytes, peer_ip: str) -> None:
+        with self.lock:
+            self.sessions[key] = CachedSession(ticket, resumption_secret, peer_ip, time.monotonic() + self.ttl)
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    # Returns the session stored under the key, or None if there is none or it expired
+    def get(self, key: Hashable) -> CachedSession | None:
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                return None
+            if session.expires_at <= time.monotonic():
+                del self.sessions[key]
+                return None
+            self.sessions.move_to_end(key)
+            return session
+
+    # Removes and returns the session stored under the key (None if there is none or it expired).
+    # Used for tickets, so each ticket can only be redeemed once.
+    def pop(self, key: Hashable) -> CachedSession | None:
+        with self.lock:
+            session = self.sessions.pop(key, None)
+        if session is None or session.expires_at <= time.monotonic():
+            return None
+        return session
+
+    # Forgets every session
+    def clear(self) -> None:
+        with self.lock:
+            self.sessions.clear()
+
+
+# The cache shared by the sockets of this process, unless a socket is given its own
+SHARED_SESSION_CACHE: Final[SessionCache] = SessionCache()
@@ -0,0 +1,138 @@
+import hashlib
+import hmac
+from pathlib import Path
+from typing import Final
+
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+
+# Encrypted message layout: nonce | ciphertext | GCM tag (the ciphertext is as long as the plain data)
+NONCE_SIZE: Final[int] = 12
+TAG_SIZE: Final[int] = 16
+TRANSFER_TAG_SIZE: Final[int] = hashlib.sha256().digest_size
+
+# Labels that keep the keys derived from the shared secret independent of each other
+KEY_DERIVATION_CONTEXT: Final[bytes] = b'picture-encryption-socket session v1'
+KEY_SIZE: Final[int] = 32
+
+# How much of a file is read at a time when authenticating it
+FILE_CHUNK_SIZE: Final[int] = 1024 * 1024
+
+
+# SessionEncryptor encrypts one message incrementally with AES-GCM.
+# Call update() with consecutive chunks of the message, then finalize() for the authentication tag.
+class SessionEncryptor:
+    nonce: bytes
+
+    def __init__(self, key: bytes, nonce: bytes) -> None:
+        self.nonce = nonce
+        self.__cipher = AES.new(key, AES.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+
+    # Encrypts the next chunk and returns its ciphertext (the same length as the chunk)
+    def update(self, chunk: bytes | bytearray | memoryview) -> bytes:
+        return self.__cipher.encrypt(chunk)
+
+    # Returns the tag that authenticates every chunk encrypted so far
+    def finalize(self) -> bytes:
+        return self.__cipher.digest()
+
+
+# SessionDecryptor decrypts one message incrementally with AES-GCM.
+# Call update() with consecutive chunks of the ciphertext, then finalize() with the tag:
+# the decrypted chunks must not be trusted until finalize() has returned.
+class SessionDecryptor:
+    def __init__(self, key: bytes, nonce: bytes) -> None:
+        self.__cipher = AES.new(key, AES.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+
+    # Decrypts the next chunk and returns its plain data
+    def update(self, chunk: bytes | bytearray | memoryview) -> bytes:
+        return self.__cipher.decrypt(chunk)
+
+    # Checks the tag; raises ValueError if the message was modified
+    def finalize(self, tag: bytes | bytearray | memoryview) -> None:
+        self.__cipher.verify(bytes(tag))
+
+
+# SessionCipher holds the keys of one direction of a connection.
+# The keys are derived once from the Diffie-Hellman shared secret (with HKDF-SHA256), and then used for
+# every message of the session: an AES-GCM key for the messages and an HMAC-SHA256 key for the transfers.
+# Each transfer tag also covers a sequence number, so a package that is modified, replayed or
+# reordered on the wire is rejected before any image part is decoded.
+class SessionCipher:
+    message_counter: int
+    transfer_sequence: int
+
+    def __init__(self, shared_key: bytes) -> None:
+        self.__encryption_key, self.__transfer_key = HKDF(shared_key, KEY_SIZE, b'', SHA256, num_keys=2,
+                                                          context=KEY_DERIVATION_CONTEXT)
+        self.message_counter = 0
+        self.transfer_sequence = 0
+
+    # Starts encrypting a new message; its nonce must be sent ahead of the ciphertext
+    def encryptor(self) -> SessionEncryptor:
+        # A counter nonce never repeats under the session key
+        self.message_counter += 1
+        return SessionEncryptor(self.__encryption_key, self.message_counter.to_bytes(NONCE_SIZE, 'big'))
+
+    # Starts decrypting a message that was encrypted with the given nonce
+    def decryptor(self, nonce: bytes | bytearray | memoryview) -> SessionDecryptor:
+        return SessionDecryptor(self.__encryption_key, bytes(nonce))
+
+    # Encrypts a whole message: returns nonce | ciphertext | tag
+    def encrypt(self, data: bytes | bytearray | memoryview) -> bytes:
+        encryptor = self.encryptor()
+        encrypted_data = encryptor.update(data)
+        return encryptor.nonce + encrypted_data + encryptor.finalize()
+
+    # Decrypts a whole message made by encrypt; raises ValueError if it was modified
+    def decrypt(self, encrypted_data: bytes | bytearray | memoryview) -> bytes:
+        encrypted_view = memoryview(encrypted_data).cast('B')
+        if len(encrypted_view) < NONCE_SIZE + TAG_SIZE:
+            raise ValueError("Encrypted message is truncated")
+        decryptor = self.decryptor(encrypted_view[:NONCE_SIZE])
+        data = decryptor.update(encrypted_view[NONCE_SIZE:-TAG_SIZE])
+        decryptor.finalize(encrypted_view[-TAG_SIZE:])
+        return data
+
+    # Returns the tag that authenticates the next transfer sent in this direction
+    def sign_transfer(self, data: bytes | bytearray | memoryview) -> bytes:
+        self.transfer_sequence += 1
+        return self.__transfer_mac(data).digest()
+
+    # Same as sign_transfer, for a transfer sent from a file
+    def sign_transfer_file(self, file_path: str | Path) -> bytes:
+        self.transfer_sequence += 1
+        return self.__file_transfer_mac(file_path).digest()
+
+    # Checks the tag of the next transfer received in this direction; raises ValueError if it doesn't match
+    def verify_transfer(self, data: bytes | bytearray | memoryview, tag: bytes) -> None:
+        self.transfer_sequence += 1
+        self.__check_tag(self.__transfer_mac(data).digest(), tag)
+
+    # Same as verify_transfer, for a transfer received into a file
+    def verify_transfer_file(self, file_path: str | Path, tag: bytes) -> None:
+        self.transfer_sequence += 1
+        self.__check_tag(self.__file_transfer_mac(file_path).digest(), tag)
+
+    # Starts the MAC of a transfer with its sequence number
+    def __new_transfer_mac(self) -> hmac.HMAC:
+        return hmac.new(self.__transfer_key, self.transfer_sequence.to_bytes(8, 'big'), hashlib.sha256)
+
+    def __transfer_mac(self, data: bytes | bytearray | memoryview) -> hmac.HMAC:
+        mac = self.__new_transfer_mac()
+        mac.update(data)
+        return mac
+
+    def __file_transfer_mac(self, file_path: str | Path) -> hmac.HMAC:
+        mac = self.__new_transfer_mac()
+        with open(file_path, 'rb') as file:
+            while chunk := file.read(FILE_CHUNK_SIZE):
+                mac.update(chunk)
+        return mac
+
+    @staticmethod
+    def __check_tag(expected_tag: bytes, tag: bytes) -> None:
+        # Constant-time comparison, so the tag can't be guessed byte by byte
+        if not hmac.compare_digest(expected_tag, tag):
+            raise ValueError("Transfer failed authentication; it was modified, replayed or reordered")
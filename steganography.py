@@ -1,17 +1,188 @@
+import math
+import struct
 from pathlib import Path
+from typing import Final, Sequence
 
-from stegano import lsb
+import numpy as np
+from PIL import Image
+
+from image_split import choose_grid
+
+# The hidden payload starts with its length as a 4-byte big-endian integer
+LENGTH_HEADER: Final[struct.Struct] = struct.Struct('!I')
 
 # Hide a byte message inside an image using LSB steganography
 def hide_message_in_image(input_image_path: str | Path, message: bytes, output_image_path: str | Path) -> None:
-    # The stegano library expects a string message, so decode bytes with 'latin1' to preserve byte values
-    secret_image = lsb.hide(str(input_image_path), message.decode('latin1'))
+    secret_image = hide_bytes_in_image(Image.open(input_image_path), message)
     # Save the resulting image containing the hidden message
     secret_image.save(str(output_image_path))
 
 # Reveal and extract the hidden byte message from a steganographic image
 def reveal_message_from_image(image_path: str | Path) -> bytes:
-    # Extract the hidden string message from the image
-    revealed_text = lsb.reveal(str(image_path))
-    # Encode the revealed string back to bytes using 'latin1' to preserve original byte values
-    return revealed_text.encode('latin1')
+    return reveal_bytes_from_image(Image.open(image_path))
+
+# Returns how many payload bytes (excluding the length header) fit in an image of the given size
+def get_image_capacity(width: int, height: int, channels: int = 3) -> int:
+    return width * height * channels // 8 - LENGTH_HEADER.size
+
+# Hides raw bytes in the least significant bit of every RGB channel value of the image.
+# All bits are written at once with NumPy operations over the whole pixel array.
+def hide_bytes_in_image(image: Image.Image | np.ndarray, message: bytes) -> Image.Image:
+    # Copy the pixels into a writable array (the input image is left untouched)
+    pixels = np.array(_to_rgb(image), dtype=np.uint8)
+    flat_pixels = pixels.reshape(-1)
+
+    # Prepend the payload length so the receiver knows how many bits to read
+    payload = LENGTH_HEADER.pack(len(message)) + message
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+    if bits.size > flat_pixels.size:
+        raise ValueError(f"Message of {len(message)} bytes does not fit in the image "
+                         f"(capacity is {get_image_capacity(pixels.shape[1], pixels.shape[0])} bytes)")
+
+    # Clear the lowest bit of the used channel values and set it to the payload bit
+    used_pixels = flat_pixels[:bits.size]
+    np.bitwise_and(used_pixels, 0xFE, out=used_pixels)
+    np.bitwise_or(used_pixels, bits, out=used_pixels)
+
+    return Image.fromarray(pixels)
+
+# Extracts the raw bytes hidden by hide_bytes_in_image.
+# Only the channel values that hold the header and the payload are read.
+def reveal_bytes_from_image(image: Image.Image | np.ndarray) -> bytes:
+    flat_pixels = np.asarray(_to_rgb(image), dtype=np.uint8).reshape(-1)
+
+    # Read the length header first
+    header_bits = LENGTH_HEADER.size * 8
+    if flat_pixels.size < header_bits:
+        raise ValueError("Image is too small to contain a hidden message")
+    message_length, = LENGTH_HEADER.unpack(np.packbits(flat_pixels[:header_bits] & 1).tobytes())
+
+    # Then read exactly the payload bits that follow it
+    payload_end = header_bits + message_length * 8
+    if payload_end > flat_pixels.size:
+        raise ValueError("Image does not contain a valid hidden message")
+    return np.packbits(flat_pixels[header_bits:payload_end] & 1).tobytes()
+
+# Returns the image as an RGB image or array, converting other PIL modes
+def _to_rgb(image: Image.Image | np.ndarray) -> Image.Image | np.ndarray:
+    if isinstance(image, Image.Image) and image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+# Tiled layout header: payload length and the number of tiles (in row-major order) the header and payload span
+TILED_HEADER: Final[struct.Struct] = struct.Struct('!IH')
+
+# Smallest carrier that is ever generated; any tile of it still holds the tiled header
+MIN_CARRIER_WIDTH: Final[int] = 32
+MIN_CARRIER_HEIGHT: Final[int] = 24
+
+# Returns the smallest carrier (width, height) whose tiles can hold a payload of the given length.
+# - safety_margin: extra capacity to reserve, as a fraction of the required bits
+# - min_tile_size, max_tile_size: limits passed to choose_grid; the size is rounded up to a multiple
+#   of the chosen grid so no pixels are lost at the right and bottom edges when splitting
+# - aspect_ratio: width / height of the generated carrier
+def get_carrier_size(message_length: int, safety_margin: float = 0.1, min_tile_size: int = 32,
+                     max_tile_size: int = 256, aspect_ratio: float = 4 / 3) -> tuple[int, int]:
+    # One bit is hidden in each of the 3 channel values of a pixel
+    required_bits = math.ceil((TILED_HEADER.size + message_length) * 8 * (1 + safety_margin))
+    required_pixels = math.ceil(required_bits / 3)
+
+    height = max(MIN_CARRIER_HEIGHT, math.ceil(math.sqrt(required_pixels / aspect_ratio)))
+    width = max(MIN_CARRIER_WIDTH, math.ceil(required_pixels / height))
+
+    # Round up to a multiple of the grid so every tile has the same size
+    rows, cols = choose_grid(width, height, min_tile_size, max_tile_size)
+    return math.ceil(width / cols) * cols, math.ceil(height / rows) * rows
+
+# Hides raw bytes across a list of image tiles (given in row-major grid order).
+# The header and payload are written to the first tile, then continue into the next ones,
+# so a short message only changes (and only needs to be read back from) the first few tiles.
+# NumPy tiles (e.g. views from split_image_array) are modified in place, without copying;
+# PIL tiles are copied. Returns the list of tiles; tiles that hold no payload are returned unchanged.
+def hide_bytes_in_tiles(tiles: list[Image.Image | np.ndarray], message: bytes) -> list[Image.Image | np.ndarray]:
+    tile_span = get_tile_span(tiles, len(message))
+    payload = TILED_HEADER.pack(len(message), tile_span) + message
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+
+    output_tiles = list(tiles)
+    bits_offset = 0
+    for index in range(tile_span):
+        tile = tiles[index]
+        pixels = tile if isinstance(tile, np.ndarray) else np.array(_to_rgb(tile), dtype=np.uint8)
+        tile_bits = bits[bits_offset:bits_offset + pixels.size]
+        _write_low_bits(pixels, tile_bits)
+
+        if not isinstance(tile, np.ndarray):
+            output_tiles[index] = Image.fromarray(pixels)
+        bits_offset += tile_bits.size
+
+    return output_tiles
+
+# Writes bits into the lowest bit of the leading channel values of a (height, width, 3) pixel array,
+# in row-major order. Works in place on non-contiguous views, one pixel row at a time.
+def _write_low_bits(pixels: np.ndarray, bits: np.ndarray) -> None:
+    # Each pixel row of a tile view is contiguous, so this reshape never copies
+    pixel_rows = pixels.reshape(pixels.shape[0], -1)
+    row_length = pixel_rows.shape[1]
+    full_rows, remainder = divmod(bits.size, row_length)
+
+    # Clear the lowest bit of the used channel values and set it to the payload bit
+    used_rows = pixel_rows[:full_rows]
+    np.bitwise_and(used_rows, 0xFE, out=used_rows)
+    np.bitwise_or(used_rows, bits[:full_rows * row_length].reshape(full_rows, row_length), out=used_rows)
+    if remainder:
+        used_values = pixel_rows[full_rows, :remainder]
+        np.bitwise_and(used_values, 0xFE, out=used_values)
+        np.bitwise_or(used_values, bits[full_rows * row_length:], out=used_values)
+
+# Returns how many leading tiles (in row-major order) hide_bytes_in_tiles needs for a message of the given length
+def get_tile_span(tiles: Sequence[Image.Image | np.ndarray], message_length: int) -> int:
+    # Number of channel values (one hidden bit each) available up to and including every tile
+    tile_capacities = np.cumsum([_get_channel_count(tile) for tile in tiles])
+
+    total_bits = (TILED_HEADER.size + message_length) * 8
+    if tile_capacities.size == 0 or total_bits > tile_capacities[-1]:
+        raise ValueError(f"Message of {message_length} bytes does not fit in the tiles")
+    if tile_capacities[0] < TILED_HEADER.size * 8:
+        raise ValueError("The first tile is too small to hold the payload header")
+
+    # The tile span is the number of leading tiles needed to hold every bit
+    return int(np.searchsorted(tile_capacities, total_bits)) + 1
+
+# Extracts the raw bytes hidden by hide_bytes_in_tiles.
+# Only the tiles within the span recorded in the header are accessed, so when the tiles are
+# lazily opened PNG files, the remaining tiles are never decoded.
+def reveal_bytes_from_tiles(tiles: Sequence[Image.Image | np.ndarray]) -> bytes:
+    header_bits = TILED_HEADER.size * 8
+    first_tile = np.asarray(_to_rgb(tiles[0]), dtype=np.uint8).reshape(-1)
+    message_length, tile_span = read_tiled_header(first_tile)
+    if tile_span > len(tiles):
+        raise ValueError(f"Payload spans {tile_span} tiles but only {len(tiles)} are available")
+
+    # Collect the low bits of just the channel values that hold the header and payload
+    remaining_bits = header_bits + message_length * 8
+    bit_chunks = []
+    for index in range(tile_span):
+        flat_pixels = first_tile if index == 0 else np.asarray(_to_rgb(tiles[index]), dtype=np.uint8).reshape(-1)
+        bit_chunks.append(flat_pixels[:remaining_bits] & 1)
+        remaining_bits -= bit_chunks[-1].size
+
+    if remaining_bits > 0:
+        raise ValueError("Tiles do not contain a valid hidden message")
+    return np.packbits(np.concatenate(bit_chunks)[header_bits:]).tobytes()
+
+# Reads the (payload length, tile span) header that hide_bytes_in_tiles wrote to the first tile.
+# Lets a receiver know how many tiles it needs before the other tiles have arrived.
+def read_tiled_header(first_tile: Image.Image | np.ndarray) -> tuple[int, int]:
+    header_bits = TILED_HEADER.size * 8
+    flat_pixels = np.asarray(_to_rgb(first_tile), dtype=np.uint8).reshape(-1)
+    if flat_pixels.size < header_bits:
+        raise ValueError("The first tile is too small to contain a payload header")
+    return TILED_HEADER.unpack(np.packbits(flat_pixels[:header_bits] & 1).tobytes())
+
+# Returns the number of RGB channel values in an image or array
+def _get_channel_count(image: Image.Image | np.ndarray) -> int:
+    if isinstance(image, Image.Image):
+        width, height = image.size
+        return width * height * 3
+    return image.size
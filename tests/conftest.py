@@ -0,0 +1,44 @@
+import socket
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from data_info import ImageParts, SplittedImageInfo
+from image_split import get_tile_box, split_image_array
+from steganography import hide_bytes_in_tiles
+
+# Carrier used by the tile tests: small enough to be quick, split into several tiles
+CARRIER_WIDTH = 96
+CARRIER_HEIGHT = 64
+CARRIER_ROWS = 2
+CARRIER_COLUMNS = 3
+
+# A message that spans more than one tile of the carrier, but not all of them
+HIDDEN_MESSAGE = bytes(range(256)) * 2
+
+
+# Returns every tile of a random carrier with HIDDEN_MESSAGE hidden in the leading ones
+@pytest.fixture
+def image_parts() -> ImageParts:
+    carrier = np.random.default_rng(0).integers(0, 256, (CARRIER_HEIGHT, CARRIER_WIDTH, 3), dtype=np.uint8)
+    tiles = [tile for row in split_image_array(carrier, CARRIER_ROWS, CARRIER_COLUMNS) for tile in row]
+    tiles = hide_bytes_in_tiles(tiles, HIDDEN_MESSAGE)
+
+    parts = []
+    for index, tile in enumerate(tiles):
+        row, col = divmod(index, CARRIER_COLUMNS)
+        left, top, _, _ = get_tile_box(CARRIER_WIDTH, CARRIER_HEIGHT, CARRIER_ROWS, CARRIER_COLUMNS, row, col)
+        parts.append(SplittedImageInfo(row, col, tile, left, top))
+    return ImageParts(CARRIER_ROWS, CARRIER_COLUMNS, CARRIER_WIDTH, CARRIER_HEIGHT, parts)
+
+
+# Returns a local port that nothing listens on
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
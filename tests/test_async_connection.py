@@ -0,0 +1,30 @@
+import asyncio
+
+from async_connection import AsyncPeerConnector
+from async_picture_encryption_socket import AsyncPictureEncryptionSocket
+from conftest import get_free_port
+
+# Connecting over loopback takes milliseconds; a hang shows up as a failure instead of blocking the run
+TEST_TIMEOUT_IN_SECONDS = 20
+
+
+def test_loopback_connect():
+    async def run() -> None:
+        sender, receiver = await AsyncPeerConnector('127.0.0.1', get_free_port()).connect()
+        await sender.send_message(b'hello')
+        assert await receiver.get_message() == b'hello'
+        await sender.close()
+        await receiver.close()
+
+    asyncio.run(asyncio.wait_for(run(), TEST_TIMEOUT_IN_SECONDS))
+
+
+def test_async_socket_round_trip():
+    async def run() -> None:
+        sock = AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=get_free_port(), session_cache=None)
+        await sock.connect()
+        await sock.send_text('hello')
+        assert await sock.receive_text() == 'hello'
+        await sock.close()
+
+    asyncio.run(asyncio.wait_for(run(), TEST_TIMEOUT_IN_SECONDS))
@@ -0,0 +1,118 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from async_connection import AsyncFramedConnection
+from flow_control import INITIAL_CREDIT, AsyncCreditGate, CreditGate, CreditWindow
+from multiplexed_connection import CHANNEL_DATA, FRAME_QUEUE_SIZE, FramedConnection
+
+# More frames than a route's queue holds, so the reader has to wait for room
+FRAME_COUNT = 3 * FRAME_QUEUE_SIZE
+
+
+def test_credit_gate_runs_out_of_credit():
+    gate = CreditGate()
+
+    assert all(gate.acquire(block=False) for _ in range(INITIAL_CREDIT))
+    assert not gate.acquire(block=False)
+    assert not gate.acquire(timeout=0.01)
+
+
+def test_credit_gate_wakes_up_on_grant():
+    gate = CreditGate(0)
+    threading.Timer(0.05, gate.grant, (2,)).start()
+
+    assert gate.acquire(timeout=5)
+    assert gate.acquire(block=False)
+    assert not gate.acquire(block=False)
+
+
+def test_closed_credit_gate_raises():
+    gate = CreditGate(0)
+    threading.Timer(0.05, gate.close).start()
+
+    with pytest.raises(Exception, match='closed'):
+        gate.acquire(timeout=5)
+
+
+def test_async_credit_gate():
+    async def run() -> None:
+        gate = AsyncCreditGate(1)
+        assert await gate.acquire(block=False)
+        assert not await gate.acquire(block=False)
+        assert not await gate.acquire(timeout=0.01)
+
+        asyncio.get_running_loop().call_later(0.05, gate.grant, 1)
+        assert await gate.acquire(timeout=5)
+
+        asyncio.get_running_loop().call_later(0.05, gate.close)
+        with pytest.raises(Exception, match='closed'):
+            await gate.acquire(timeout=5)
+
+    asyncio.run(run())
+
+
+def test_credit_window_opens_up_to_the_high_watermark():
+    window = CreditWindow(8, 4)
+
+    assert window.open() == 8 - INITIAL_CREDIT
+    assert window.outstanding == 8
+
+
+def test_credit_window_grants_at_the_low_watermark():
+    window = CreditWindow(8, 4)
+    window.open()
+
+    # Credit goes back in one batch, once the outstanding messages drop to the low watermark
+    assert [window.consume() for _ in range(4)] == [0, 0, 0, 4]
+    assert window.outstanding == 8
+    assert [window.consume() for _ in range(4)] == [0, 0, 0, 4]
+
+
+def test_credit_window_before_open():
+    window = CreditWindow(8, 2)
+
+    # Before the window opens, the sender only has the initial credit
+    assert [window.consume() for _ in range(2)] == [0, 6]
+
+
+@pytest.mark.parametrize('high_watermark, low_watermark', [(INITIAL_CREDIT - 1, 0), (8, 8), (8, -1)])
+def test_invalid_watermarks_are_rejected(high_watermark, low_watermark):
+    with pytest.raises(ValueError):
+        CreditWindow(high_watermark, low_watermark)
+
+
+def test_full_route_pauses_the_reader():
+    sender_socket, receiver_socket = socket.socketpair()
+    sender, receiver = FramedConnection(sender_socket), FramedConnection(receiver_socket)
+    try:
+        for index in range(FRAME_COUNT):
+            sender.send_frame(CHANNEL_DATA, index.to_bytes(4, 'big'))
+
+        # No frame is lost or reordered while the route's queue is full
+        assert [int.from_bytes(receiver.get_frame(CHANNEL_DATA), 'big') for _ in range(FRAME_COUNT)] == \
+            list(range(FRAME_COUNT))
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_full_route_pauses_the_async_reader():
+    async def run() -> None:
+        sender_socket, receiver_socket = socket.socketpair()
+        sender = AsyncFramedConnection(*await asyncio.open_connection(sock=sender_socket))
+        receiver = AsyncFramedConnection(*await asyncio.open_connection(sock=receiver_socket))
+        try:
+            for index in range(FRAME_COUNT):
+                await sender.send_frame(CHANNEL_DATA, index.to_bytes(4, 'big'))
+            await asyncio.sleep(0.1)
+
+            assert [int.from_bytes(await receiver.get_frame(CHANNEL_DATA), 'big') for _ in range(FRAME_COUNT)] == \
+                list(range(FRAME_COUNT))
+        finally:
+            await sender.close()
+            await receiver.close()
+
+    asyncio.run(asyncio.wait_for(run(), 20))
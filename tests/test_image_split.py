@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from data_info import ImageParts, SplittedImageInfo
+from image_split import get_tile_box, restore_image_from_parts, split_image_array
+
+
+# Splits a random image into tiles that carry their offsets, as PIL images or as pixel arrays
+def split_with_offsets(pixels: np.ndarray, rows: int, cols: int, as_images: bool) -> ImageParts:
+    height, width = pixels.shape[:2]
+    parts = []
+    for row, tiles in enumerate(split_image_array(pixels, rows, cols)):
+        for col, tile in enumerate(tiles):
+            left, top, _, _ = get_tile_box(width, height, rows, cols, row, col)
+            parts.append(SplittedImageInfo(row, col, Image.fromarray(tile) if as_images else tile, left, top))
+    return ImageParts(rows, cols, width, height, parts)
+
+
+# Sizes that the grid divides evenly, and sizes that leave remainder pixels in the last row and column
+@pytest.mark.parametrize('width, height, rows, cols', [(96, 64, 2, 3), (97, 67, 3, 4), (5, 3, 3, 5)])
+@pytest.mark.parametrize('as_images', [False, True])
+def test_restore_is_lossless_for_any_size(width, height, rows, cols, as_images):
+    pixels = np.random.default_rng(1).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    restored = restore_image_from_parts(split_with_offsets(pixels, rows, cols, as_images))
+
+    assert restored.size == (width, height)
+    assert np.array_equal(np.asarray(restored), pixels)
+
+
+def test_restore_keeps_the_hidden_tiles(image_parts):
+    restored = np.asarray(restore_image_from_parts(image_parts))
+
+    for part in image_parts.parts:
+        tile_height, tile_width = part.image.shape[:2]
+        assert np.array_equal(restored[part.top:part.top + tile_height, part.left:part.left + tile_width], part.image)
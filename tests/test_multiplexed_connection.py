@@ -0,0 +1,62 @@
+import asyncio
+import socket
+
+import pytest
+
+from async_connection import AsyncFramedConnection
+from async_picture_encryption_socket import AsyncPictureEncryptionSocket
+from conftest import get_free_port
+from flow_control import ConnectionClosed
+from multiplexed_connection import CHANNEL_DATA, FramedConnection
+
+TEST_TIMEOUT_IN_SECONDS = 20
+
+
+def test_frames_received_before_the_close_are_still_returned():
+    sender_socket, receiver_socket = socket.socketpair()
+    sender, receiver = FramedConnection(sender_socket), FramedConnection(receiver_socket)
+    sender.send_frame(CHANNEL_DATA, b'last words')
+    sender.close()
+
+    assert receiver.get_frame(CHANNEL_DATA) == b'last words'
+    with pytest.raises(ConnectionClosed):
+        receiver.get_frame(CHANNEL_DATA)
+    receiver.close()
+
+
+def test_async_frames_received_before_the_close_are_still_returned():
+    async def run() -> None:
+        sender_socket, receiver_socket = socket.socketpair()
+        sender = AsyncFramedConnection(*await asyncio.open_connection(sock=sender_socket))
+        receiver = AsyncFramedConnection(*await asyncio.open_connection(sock=receiver_socket))
+        await sender.send_frame(CHANNEL_DATA, b'last words')
+        await sender.close()
+
+        assert await receiver.get_frame(CHANNEL_DATA) == b'last words'
+        with pytest.raises(ConnectionClosed):
+            await receiver.get_frame(CHANNEL_DATA)
+        await receiver.close()
+
+    asyncio.run(asyncio.wait_for(run(), TEST_TIMEOUT_IN_SECONDS))
+
+
+def test_peer_leaving_is_a_normal_stop(capsys):
+    async def run() -> None:
+        first_port, second_port = get_free_port(), get_free_port()
+        first = AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=first_port, peer_port=second_port,
+                                             session_cache=None)
+        second = AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=second_port, peer_port=first_port,
+                                              session_cache=None)
+        await asyncio.gather(first.connect(), second.connect())
+        await first.send_text('bye')
+        assert await second.receive_text() == 'bye'
+        await first.close()
+
+        # The peer leaving ends the iteration instead of raising
+        assert [message async for message in second] == []
+        with pytest.raises(ConnectionClosed):
+            await second.receive()
+        await second.close()
+
+    asyncio.run(asyncio.wait_for(run(), TEST_TIMEOUT_IN_SECONDS))
+    assert 'failed' not in capsys.readouterr().out
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+import p2p
+from conftest import get_free_port
+from p2p import Peer2Peer
+
+# Larger than a single read, so a message takes several of them
+MESSAGE = bytes(range(256)) * 8192
+
+
+# Connects a sending and a receiving Peer2Peer to each other over loopback
+@pytest.fixture
+def peers(monkeypatch):
+    # A side that dials before the other one listens retries without the usual pause
+    monkeypatch.setattr(p2p, 'CONNECT_TIMEOUT_IN_SECONDS', 0.05)
+    first_port, second_port = get_free_port(), get_free_port()
+    receivers = []
+    # Each constructor waits for the other side to connect, so both are created at the same time
+    receiver_thread = threading.Thread(
+        target=lambda: receivers.append(Peer2Peer('127.0.0.1', first_port, second_port, chunk_size=65536)))
+    receiver_thread.start()
+    sender = Peer2Peer('127.0.0.1', second_port, first_port)
+    receiver_thread.join()
+    yield sender, receivers[0]
+    sender.close()
+    receivers[0].close()
+
+
+def test_messages_arrive_whole_and_in_order(peers):
+    sender, receiver = peers
+    for message in (MESSAGE, b'', b'last'):
+        sender.send_message(message)
+
+    assert receiver.get_message() == MESSAGE
+    assert receiver.get_message() == b''
+    assert receiver.get_message() == b'last'
+
+
+def test_file_round_trip(peers, tmp_path):
+    sender, receiver = peers
+    (tmp_path / 'sent.bin').write_bytes(MESSAGE)
+
+    sender.send_file(tmp_path / 'sent.bin')
+    receiver.get_file(tmp_path / 'received.bin')
+
+    assert (tmp_path / 'received.bin').read_bytes() == MESSAGE
@@ -0,0 +1,42 @@
+import pytest
+
+from payload_codec import CODEC_IDS, CODEC_NONE, compress_payload, decompress_payload, get_available_codecs
+
+COMPRESSIBLE_DATA = b'picture encryption socket ' * 200
+
+
+@pytest.mark.parametrize('codec', get_available_codecs())
+def test_round_trip(codec):
+    payload = compress_payload(COMPRESSIBLE_DATA, codec)
+
+    assert payload[0] == CODEC_IDS[codec]
+    assert decompress_payload(payload) == COMPRESSIBLE_DATA
+    assert decompress_payload(memoryview(payload), len(COMPRESSIBLE_DATA)) == COMPRESSIBLE_DATA
+
+
+@pytest.mark.parametrize('codec', get_available_codecs())
+def test_short_data_is_stored(codec):
+    payload = compress_payload(b'short', codec)
+
+    assert payload == bytes([CODEC_IDS[CODEC_NONE]]) + b'short'
+    assert decompress_payload(payload) == b'short'
+
+
+@pytest.mark.parametrize('codec', get_available_codecs())
+def test_expansion_beyond_max_length_is_rejected(codec):
+    payload = compress_payload(COMPRESSIBLE_DATA, codec)
+
+    with pytest.raises(ValueError):
+        decompress_payload(payload, len(COMPRESSIBLE_DATA) - 1)
+
+
+def test_unavailable_codec_is_rejected():
+    with pytest.raises(ValueError):
+        compress_payload(COMPRESSIBLE_DATA, 'brotli')
+
+
+def test_malformed_payload_is_rejected():
+    with pytest.raises(ValueError):
+        decompress_payload(b'')
+    with pytest.raises(ValueError):
+        decompress_payload(bytes([CODEC_IDS['zlib']]) + b'not zlib data')
@@ -0,0 +1,32 @@
+import asyncio
+
+from async_picture_encryption_socket import AsyncPictureEncryptionSocket
+from conftest import get_free_port
+from picture_encryption_hub import PictureEncryptionHub
+
+# A hang shows up as a failure instead of blocking the run
+TEST_TIMEOUT_IN_SECONDS = 30
+
+
+def test_echo_and_close_with_connected_peers():
+    async def run() -> None:
+        hub = PictureEncryptionHub(get_free_port(), workers=1, encode_workers=1)
+        await hub.start()
+        peer_port = get_free_port()
+        peers = [AsyncPictureEncryptionSocket('127.0.0.1', encode_workers=1, port=peer_port, peer_port=hub.port,
+                                              session_cache=None) for _ in range(2)]
+        await asyncio.gather(*(peer.connect() for peer in peers))
+
+        for index, peer in enumerate(peers):
+            await peer.send_text(f'hello {index}')
+        for _ in peers:
+            session, message = await hub.receive()
+            await session.send(message)
+        assert sorted([await peer.receive_text() for peer in peers]) == ['hello 0', 'hello 1']
+
+        # The hub closes first, while its sessions are still connected
+        await hub.close()
+        assert not hub.sessions
+        await asyncio.gather(*(peer.close() for peer in peers))
+
+    asyncio.run(asyncio.wait_for(run(), TEST_TIMEOUT_IN_SECONDS))
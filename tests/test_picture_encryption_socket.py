@@ -0,0 +1,25 @@
+import pytest
+
+from picture_encryption_socket import PictureEncryptionSocket, advance_key_exchange
+
+
+@pytest.mark.parametrize('offered_encodings, expected_encoding', [
+    (b'utf-8,utf-16', 'utf-8'),
+    (b'utf-16,utf-8', 'utf-8'),
+    (b'latin-1,utf-16', 'utf-16'),
+])
+def test_receiver_picks_its_most_preferred_offered_encoding(offered_encodings, expected_encoding):
+    user_socket = PictureEncryptionSocket('127.0.0.1', session_cache=None)
+    key_exchange = user_socket._receive_key_exchange()
+
+    assert advance_key_exchange(key_exchange) == (False, None)
+    advance_key_exchange(key_exchange, bytearray(offered_encodings))
+    assert user_socket.receive_encoding == expected_encoding
+
+
+def test_receiver_rejects_offers_without_a_common_encoding():
+    key_exchange = PictureEncryptionSocket('127.0.0.1', session_cache=None)._receive_key_exchange()
+
+    assert advance_key_exchange(key_exchange) == (False, None)
+    with pytest.raises(ValueError, match='No common text encoding'):
+        advance_key_exchange(key_exchange, bytearray(b'latin-1,ascii'))
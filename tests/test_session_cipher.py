@@ -0,0 +1,114 @@
+import secrets
+
+import pytest
+
+from session_cipher import NONCE_SIZE, TAG_SIZE, SessionCipher
+
+SHARED_KEY = secrets.token_bytes(32)
+
+
+def test_message_round_trip():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+
+    for message in (b'', b'hello', secrets.token_bytes(10000)):
+        assert receiver.decrypt(sender.encrypt(message)) == message
+
+
+def test_tampered_message_is_rejected():
+    encrypted_message = bytearray(SessionCipher(SHARED_KEY).encrypt(b'hello'))
+    encrypted_message[len(encrypted_message) // 2] ^= 0x01
+
+    with pytest.raises(ValueError):
+        SessionCipher(SHARED_KEY).decrypt(encrypted_message)
+
+
+def test_message_from_another_session_is_rejected():
+    encrypted_message = SessionCipher(secrets.token_bytes(32)).encrypt(b'hello')
+
+    with pytest.raises(ValueError):
+        SessionCipher(SHARED_KEY).decrypt(encrypted_message)
+
+
+def test_incremental_encryption_matches_whole_messages():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+    message = secrets.token_bytes(10000)
+
+    # Encrypted chunk by chunk, decrypted in one go
+    encryptor = sender.encryptor()
+    encrypted_chunks = [encryptor.update(message[offset:offset + 1000]) for offset in range(0, len(message), 1000)]
+    assert receiver.decrypt(encryptor.nonce + b''.join(encrypted_chunks) + encryptor.finalize()) == message
+
+    # Encrypted in one go, decrypted chunk by chunk
+    encrypted_message = memoryview(sender.encrypt(message))
+    decryptor = receiver.decryptor(encrypted_message[:NONCE_SIZE])
+    ciphertext = encrypted_message[NONCE_SIZE:-TAG_SIZE]
+    decrypted_chunks = [decryptor.update(ciphertext[offset:offset + 3000])
+                        for offset in range(0, len(ciphertext), 3000)]
+    decryptor.finalize(encrypted_message[-TAG_SIZE:])
+    assert b''.join(decrypted_chunks) == message
+
+
+def test_incremental_decryption_rejects_a_tampered_chunk():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+    encryptor = sender.encryptor()
+    encrypted_chunks = [bytearray(encryptor.update(chunk)) for chunk in (b'first chunk', b'second chunk')]
+    tag = encryptor.finalize()
+    encrypted_chunks[1][0] ^= 0x01
+
+    decryptor = receiver.decryptor(encryptor.nonce)
+    for chunk in encrypted_chunks:
+        decryptor.update(chunk)
+    with pytest.raises(ValueError):
+        decryptor.finalize(tag)
+
+
+def test_message_nonces_never_repeat():
+    cipher = SessionCipher(SHARED_KEY)
+
+    assert len({cipher.encryptor().nonce for _ in range(100)} | {cipher.encrypt(b'')[:NONCE_SIZE]}) == 101
+
+
+def test_transfers_are_verified_in_order():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+
+    for package in (b'first package', b'second package'):
+        receiver.verify_transfer(package, sender.sign_transfer(package))
+
+
+def test_tampered_transfer_is_rejected():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+    tag = sender.sign_transfer(b'package')
+
+    with pytest.raises(ValueError):
+        receiver.verify_transfer(b'packagE', tag)
+
+
+def test_replayed_transfer_is_rejected():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+    tag = sender.sign_transfer(b'package')
+    receiver.verify_transfer(b'package', tag)
+
+    with pytest.raises(ValueError):
+        receiver.verify_transfer(b'package', tag)
+
+
+def test_reordered_transfers_are_rejected():
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+    sender.sign_transfer(b'first package')
+    second_tag = sender.sign_transfer(b'second package')
+
+    with pytest.raises(ValueError):
+        receiver.verify_transfer(b'second package', second_tag)
+
+
+def test_file_transfer_round_trip(tmp_path):
+    sender, receiver = SessionCipher(SHARED_KEY), SessionCipher(SHARED_KEY)
+    package_path = tmp_path / 'package.bin'
+    package_path.write_bytes(secrets.token_bytes(5000))
+
+    receiver.verify_transfer_file(package_path, sender.sign_transfer_file(package_path))
+
+    tag = sender.sign_transfer_file(package_path)
+    package_path.write_bytes(b'modified')
+    with pytest.raises(ValueError):
+        receiver.verify_transfer_file(package_path, tag)
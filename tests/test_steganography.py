@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import HIDDEN_MESSAGE
+from steganography import (LENGTH_HEADER, get_image_capacity, get_tile_span, hide_bytes_in_image,
+                           hide_bytes_in_tiles, read_tiled_header, reveal_bytes_from_image, reveal_bytes_from_tiles)
+
+
+def create_carrier(width: int = 64, height: int = 48) -> Image.Image:
+    return Image.fromarray(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def test_image_round_trip():
+    carrier = create_carrier()
+    message = bytes(range(256))
+
+    assert reveal_bytes_from_image(hide_bytes_in_image(carrier, message)) == message
+
+
+def test_image_reveal_only_reads_the_payload_pixels():
+    carrier = create_carrier()
+    message = b'short message'
+    hidden = np.array(hide_bytes_in_image(carrier, message))
+
+    # The pixels after the header and payload are left untouched, so changing them doesn't matter
+    used_values = (LENGTH_HEADER.size + len(message)) * 8
+    flat_pixels = hidden.reshape(-1)
+    flat_pixels[used_values:] = 0
+    assert reveal_bytes_from_image(hidden) == message
+
+
+def test_message_beyond_capacity_is_rejected():
+    carrier = create_carrier(8, 8)
+
+    with pytest.raises(ValueError):
+        hide_bytes_in_image(carrier, bytes(get_image_capacity(8, 8) + 1))
+
+
+def test_tiles_round_trip(image_parts):
+    tiles = [part.image for part in image_parts.parts]
+    tile_span = get_tile_span(tiles, len(HIDDEN_MESSAGE))
+
+    # The header in the first tile tells how many tiles to read, so the others aren't needed
+    assert read_tiled_header(tiles[0]) == (len(HIDDEN_MESSAGE), tile_span)
+    assert reveal_bytes_from_tiles(tiles[:tile_span]) == HIDDEN_MESSAGE
+
+
+def test_missing_payload_tiles_are_rejected(image_parts):
+    tiles = [part.image for part in image_parts.parts]
+    tile_span = get_tile_span(tiles, len(HIDDEN_MESSAGE))
+
+    with pytest.raises(ValueError):
+        reveal_bytes_from_tiles(tiles[:tile_span - 1])
+
+
+def test_pil_tiles_are_copied():
+    tiles = [create_carrier(32, 32) for _ in range(2)]
+    hidden_tiles = hide_bytes_in_tiles(tiles, b'message')
+
+    assert hidden_tiles[0] is not tiles[0]
+    assert reveal_bytes_from_tiles(hidden_tiles) == b'message'
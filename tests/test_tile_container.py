@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from conftest import HIDDEN_MESSAGE
+from data_info import ImageParts
+from image_metadata import encode_image
+from steganography import reveal_bytes_from_tiles
+from tile_container import CONTAINER_HEADER, create_tile_container, is_tile_container, read_tile_container
+
+
+def create_container(image_parts: ImageParts) -> bytes:
+    return create_tile_container(image_parts, [encode_image(part.image) for part in image_parts.parts])
+
+
+def test_round_trip(image_parts):
+    received = read_tile_container(create_container(image_parts))
+
+    assert (received.rows, received.columns, received.width, received.height) == \
+           (image_parts.rows, image_parts.columns, image_parts.width, image_parts.height)
+    assert len(received.parts) == len(image_parts.parts)
+    for sent_part, received_part in zip(image_parts.parts, received.parts):
+        assert (received_part.row, received_part.column, received_part.left, received_part.top) == \
+               (sent_part.row, sent_part.column, sent_part.left, sent_part.top)
+        assert np.array_equal(np.asarray(received_part.image), sent_part.image)
+    assert reveal_bytes_from_tiles([part.image for part in received.parts]) == HIDDEN_MESSAGE
+
+
+def test_is_tile_container(image_parts, tmp_path):
+    container = create_container(image_parts)
+    container_path = tmp_path / 'container.bin'
+    container_path.write_bytes(container)
+
+    assert is_tile_container(container)
+    assert is_tile_container(container_path)
+    assert not is_tile_container(b'PK\x03\x04')
+
+
+def test_corrupted_tile_is_rejected(image_parts):
+    container = bytearray(create_container(image_parts))
+    container[-1] ^= 0xFF
+
+    with pytest.raises(ValueError, match='corrupted'):
+        read_tile_container(container)
+
+
+def test_truncated_container_is_rejected(image_parts):
+    container = create_container(image_parts)
+
+    with pytest.raises(ValueError):
+        read_tile_container(container[:CONTAINER_HEADER.size - 1])
+    with pytest.raises(ValueError):
+        read_tile_container(container[:CONTAINER_HEADER.size + 1])
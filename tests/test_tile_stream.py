@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from conftest import HIDDEN_MESSAGE
+from data_info import ImageParts
+from image_metadata import encode_image
+from steganography import get_tile_span, reveal_bytes_from_tiles
+from tile_stream import TileStreamAssembler, create_stream_header, create_stream_tile_frame, is_tile_stream
+
+
+def create_frames(image_parts: ImageParts) -> list[bytes]:
+    return [create_stream_header(image_parts)] + [create_stream_tile_frame(part, encode_image(part.image))
+                                                  for part in image_parts.parts]
+
+
+def test_round_trip(image_parts):
+    tile_span = get_tile_span([part.image for part in image_parts.parts], len(HIDDEN_MESSAGE))
+    assert 1 < tile_span < len(image_parts.parts)  # Some tiles are streamed after the payload ones
+
+    assembler = TileStreamAssembler()
+    results = [assembler.add_frame(frame) for frame in create_frames(image_parts)]
+
+    # The message is handed on as soon as the payload tiles are complete, and only once
+    received = results[tile_span]
+    assert [result for result in results if result is not None] == [received]
+    assert (received.rows, received.columns, received.width, received.height) == \
+           (image_parts.rows, image_parts.columns, image_parts.width, image_parts.height)
+    for sent_part, received_part in zip(image_parts.parts, received.parts):
+        assert (received_part.row, received_part.column, received_part.left, received_part.top) == \
+               (sent_part.row, sent_part.column, sent_part.left, sent_part.top)
+        assert np.array_equal(received_part.image, sent_part.image)
+    assert reveal_bytes_from_tiles([part.image for part in received.parts]) == HIDDEN_MESSAGE
+    assert not assembler.is_receiving()
+
+
+def test_consecutive_messages(image_parts):
+    assembler = TileStreamAssembler()
+    for _ in range(2):
+        results = [assembler.add_frame(frame) for frame in create_frames(image_parts)]
+        received = next(result for result in results if result is not None)
+        assert reveal_bytes_from_tiles([part.image for part in received.parts]) == HIDDEN_MESSAGE
+
+
+def test_is_tile_stream(image_parts):
+    header = create_stream_header(image_parts)
+
+    assert is_tile_stream(header)
+    assert not is_tile_stream(b'PECT')
+
+
+def test_corrupted_tile_is_rejected(image_parts):
+    frames = create_frames(image_parts)
+    corrupted_frame = bytearray(frames[1])
+    corrupted_frame[-1] ^= 0xFF
+
+    assembler = TileStreamAssembler()
+    assembler.add_frame(frames[0])
+    with pytest.raises(ValueError, match='corrupted'):
+        assembler.add_frame(corrupted_frame)
+
+
+def test_missing_tile_is_rejected(image_parts):
+    frames = create_frames(image_parts)
+
+    assembler = TileStreamAssembler()
+    assembler.add_frame(frames[0])
+    with pytest.raises(ValueError, match='missing'):
+        assembler.add_frame(frames[2])
+
+
+def test_malformed_header_is_rejected():
+    with pytest.raises(ValueError):
+        TileStreamAssembler().add_frame(b'PECS')
@@ -0,0 +1,70 @@
+import struct
+import zlib
+from io import BytesIO
+from pathlib import Path
+from typing import Final
+
+from PIL import Image
+
+from data_info import ImageParts, SplittedImageInfo
+
+# Every container starts with these bytes, which also tells it apart from a ZIP file ("PK")
+CONTAINER_MAGIC: Final[bytes] = b'PECT'
+CONTAINER_VERSION: Final[int] = 1
+
+# Header: magic, version, grid rows and columns, exact image width and height, number of tiles
+CONTAINER_HEADER: Final[struct.Struct] = struct.Struct('!4sBHHIIH')
+# Index entry per tile: row, column, left, top, offset and length of the tile bytes, CRC-32 of the tile bytes
+CONTAINER_INDEX_ENTRY: Final[struct.Struct] = struct.Struct('!HHIIIII')
+
+
+# Packs encoded tiles into a single binary container, replacing the ZIP + PNG tEXt metadata format.
+# Layout: header | one index entry per tile | tile bytes back to back.
+# - image_parts: the grid geometry and the tiles' positions
+# - encoded_tiles: the encoded bytes of every tile, in the same order as image_parts.parts
+def create_tile_container(image_parts: ImageParts, encoded_tiles: list[bytes]) -> bytes:
+    header = CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, image_parts.rows, image_parts.columns,
+                                   image_parts.width, image_parts.height, len(encoded_tiles))
+
+    # Tile bytes start right after the header and the index
+    offset = CONTAINER_HEADER.size + CONTAINER_INDEX_ENTRY.size * len(encoded_tiles)
+    index_entries = []
+    for part, tile_bytes in zip(image_parts.parts, encoded_tiles):
+        index_entries.append(CONTAINER_INDEX_ENTRY.pack(part.row, part.column, part.left, part.top,
+                                                        offset, len(tile_bytes), zlib.crc32(tile_bytes)))
+        offset += len(tile_bytes)
+
+    return b''.join([header, *index_entries, *encoded_tiles])
+
+# Reads a tile container and returns its tiles as lazily opened images.
+# Each tile is reached directly through its index entry, so nothing is extracted or copied
+# and no pixel data is decoded until a tile is used.
+# Raises ValueError if the container is malformed or a tile fails its checksum.
+def read_tile_container(container: bytes) -> ImageParts:
+    container_view = memoryview(container)
+    if len(container_view) < CONTAINER_HEADER.size:
+        raise ValueError("Tile container is truncated")
+    magic, version, rows, cols, width, height, number_of_tiles = CONTAINER_HEADER.unpack_from(container_view)
+    if magic != CONTAINER_MAGIC or version != CONTAINER_VERSION:
+        raise ValueError("Not a supported tile container")
+    if len(container_view) < CONTAINER_HEADER.size + number_of_tiles * CONTAINER_INDEX_ENTRY.size:
+        raise ValueError("Tile container index is truncated")
+
+    parts = []
+    for index in range(number_of_tiles):
+        entry_offset = CONTAINER_HEADER.size + index * CONTAINER_INDEX_ENTRY.size
+        row, col, left, top, offset, length, checksum = CONTAINER_INDEX_ENTRY.unpack_from(container_view,
+                                                                                          entry_offset)
+        tile_bytes = container_view[offset:offset + length]
+        if len(tile_bytes) != length or zlib.crc32(tile_bytes) != checksum:
+            raise ValueError(f"Tile ({row}, {col}) of the container is corrupted")
+        parts.append(SplittedImageInfo(row, col, Image.open(BytesIO(tile_bytes)), left, top))
+
+    return ImageParts(rows, cols, width, height, parts)
+
+# Checks whether the given bytes (or file) hold a tile container rather than a ZIP file
+def is_tile_container(data: bytes | str | Path) -> bool:
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        with open(data, 'rb') as file:
+            data = file.read(len(CONTAINER_MAGIC))
+    return bytes(data[:len(CONTAINER_MAGIC)]) == CONTAINER_MAGIC
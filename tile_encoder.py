@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from PIL.ImageFile import ImageFile
+
+from image_metadata import add_metadata_to_image, encode_image, encode_image_with_metadata
+
+
+# TileEncoderPool encodes image tiles as PNG (with their metadata) on a pool of worker processes.
+# The pool is created on first use and reused for every following message, so the
+# process start-up cost is paid once per connection and not once per message.
+class TileEncoderPool:
+    workers: int
+    executor: ProcessPoolExecutor | None
+
+    # Creates the pool description; workers <= 1 encodes the tiles on the calling thread
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.executor = None
+
+    # Starts the worker processes ahead of time so the first message doesn't pay the start-up cost
+    def start(self) -> None:
+        if self.workers <= 1:
+            return
+        executor = self.__get_executor()
+        # Submitting one trivial job per worker forces every process to be spawned now
+        futures = [executor.submit(os.getpid) for _ in range(self.workers)]
+        wait(futures)
+
+    # Encodes every tile as PNG bytes with its metadata and returns them in input order.
+    # Without metadata the tiles are encoded as plain PNG.
+    def encode(self, images: list[ImageFile | np.ndarray], metadata: list[str] | None = None) -> list[bytes]:
+        arguments = [images] if metadata is None else [images, metadata]
+        encode_function = encode_image if metadata is None else encode_image_with_metadata
+        if self.workers <= 1:
+            return list(map(encode_function, *arguments))
+        # executor.map yields results in submission order, so (row, col) order is preserved
+        return list(self.__get_executor().map(encode_function, *arguments,
+                                              chunksize=self.__chunksize(len(images))))
+
+    # Encodes every tile as plain PNG bytes and yields them in input order, each one as soon as it is ready
+    # (instead of after the whole list), so the first tiles can be sent while the rest are still encoding
+    def encode_iter(self, images: list[ImageFile | np.ndarray]) -> Iterator[bytes]:
+        if self.workers <= 1:
+            return map(encode_image, images)
+        # One tile per task, so the leading tiles are not held back by the rest of a chunk
+        return self.__get_executor().map(encode_image, images)
+
+    # Encodes every tile with its metadata and writes it to the matching output path
+    def save(self, images: list[ImageFile | np.ndarray], metadata: list[str], output_paths: list[str | Path]) -> None:
+        if self.workers <= 1:
+            for _ in map(add_metadata_to_image, images, metadata, output_paths):
+                pass
+            return
+        for _ in self.__get_executor().map(add_metadata_to_image, images, metadata, output_paths,
+                                           chunksize=self.__chunksize(len(images))):
+            pass
+
+    # Shuts down the worker processes, if they were started
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    # Lazily starts the worker processes the first time they are needed
+    def __get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # 'spawn' is safe to use from a process that already runs GUI and socket threads
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    # Splits the tiles evenly between the workers to keep inter-process overhead low
+    def __chunksize(self, number_of_tiles: int) -> int:
+        return max(1, -(-number_of_tiles // self.workers))
@@ -0,0 +1,128 @@
+import struct
+import zlib
+from io import BytesIO
+from pathlib import Path
+from typing import Final
+
+import numpy as np
+from PIL import Image
+
+from data_info import ImageParts, SplittedImageInfo
+from steganography import read_tiled_header
+
+# A streamed message starts with a header frame beginning with these bytes,
+# which tells it apart from a tile container ("PECT") or a ZIP file ("PK")
+STREAM_MAGIC: Final[bytes] = b'PECS'
+STREAM_VERSION: Final[int] = 1
+
+# Header frame: magic, version, grid rows and columns, exact image width and height, number of tile frames that follow
+STREAM_HEADER: Final[struct.Struct] = struct.Struct('!4sBHHIIH')
+# Start of every tile frame: row, column, left, top, CRC-32 of the tile bytes (which follow it)
+STREAM_TILE_HEADER: Final[struct.Struct] = struct.Struct('!HHIII')
+
+
+# Creates the header frame that announces a streamed message and its grid geometry
+def create_stream_header(image_parts: ImageParts) -> bytes:
+    return STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, image_parts.rows, image_parts.columns,
+                              image_parts.width, image_parts.height, len(image_parts.parts))
+
+# Creates the frame that carries one encoded tile and its position
+def create_stream_tile_frame(part: SplittedImageInfo, tile_bytes: bytes) -> bytes:
+    return STREAM_TILE_HEADER.pack(part.row, part.column, part.left, part.top, zlib.crc32(tile_bytes)) + tile_bytes
+
+# Checks whether the given bytes (or file) hold the header frame of a streamed message
+def is_tile_stream(data: bytes | str | Path) -> bool:
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        with open(data, 'rb') as file:
+            data = file.read(len(STREAM_MAGIC))
+    return bytes(data[:len(STREAM_MAGIC)]) == STREAM_MAGIC
+
+
+# TileStreamAssembler rebuilds streamed messages one frame at a time on the receiving side.
+# Each tile is decoded as soon as its frame arrives, straight into a buffer of the full image size,
+# so decoding overlaps with the transfer of the following tiles. As soon as the tiles that hold the
+# payload (the span recorded in the first tile) are complete, the message is handed on for reveal;
+# any tiles the sender streams after them are read and dropped without being decoded.
+class TileStreamAssembler:
+    image_parts: ImageParts | None
+    canvas: np.ndarray | None
+    remaining_frames: int
+    tile_span: int | None
+
+    def __init__(self) -> None:
+        self.__reset()
+
+    # Whether a streamed message is in progress, i.e. the next frame is a tile frame
+    def is_receiving(self) -> bool:
+        return self.image_parts is not None
+
+    # Adds the next frame of a stream (the header frame first, then the tile frames in row-major order).
+    # Returns the payload tiles once they are all decoded, otherwise None.
+    # Raises ValueError if a frame is malformed, corrupted or out of order.
+    def add_frame(self, frame: bytes) -> ImageParts | None:
+        if not self.is_receiving():
+            self.__start(frame)
+            return None
+
+        self.remaining_frames -= 1
+        completed = None
+        if self.tile_span is None or len(self.image_parts.parts) < self.tile_span:
+            self.__add_tile(frame)
+            if len(self.image_parts.parts) == self.tile_span:
+                completed = self.image_parts
+
+        # The span was checked against the frame count, so the payload is complete by the last frame
+        if self.remaining_frames == 0:
+            self.__reset()
+        return completed
+
+    # Reads the header frame and allocates the image buffer for the new message
+    def __start(self, frame: bytes) -> None:
+        if len(frame) != STREAM_HEADER.size:
+            raise ValueError("Not a tile stream header")
+        magic, version, rows, cols, width, height, number_of_tiles = STREAM_HEADER.unpack(frame)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION or number_of_tiles == 0:
+            raise ValueError("Not a supported tile stream")
+
+        self.image_parts = ImageParts(rows, cols, width, height, [])
+        self.canvas = np.empty((height, width, 3), dtype=np.uint8)
+        self.remaining_frames = number_of_tiles
+
+    # Decodes one tile frame into its place in the image buffer
+    def __add_tile(self, frame: bytes) -> None:
+        frame_view = memoryview(frame)
+        if len(frame_view) < STREAM_TILE_HEADER.size:
+            raise ValueError("Tile frame is truncated")
+        row, col, left, top, checksum = STREAM_TILE_HEADER.unpack_from(frame_view)
+        tile_bytes = frame_view[STREAM_TILE_HEADER.size:]
+        if zlib.crc32(tile_bytes) != checksum:
+            raise ValueError(f"Tile ({row}, {col}) of the stream is corrupted")
+
+        # The payload is read in row-major order, so the tiles must arrive without gaps
+        parts = self.image_parts.parts
+        if row * self.image_parts.columns + col != len(parts):
+            raise ValueError(f"Image part {len(parts)} of the {self.image_parts.rows}x"
+                             f"{self.image_parts.columns} grid is missing")
+
+        tile = Image.open(BytesIO(tile_bytes))
+        tile_pixels = np.asarray(tile if tile.mode == 'RGB' else tile.convert('RGB'))
+        tile_height, tile_width = tile_pixels.shape[:2]
+        tile_view = self.canvas[top:top + tile_height, left:left + tile_width]
+        if tile_view.shape != tile_pixels.shape:
+            raise ValueError(f"Tile ({row}, {col}) does not fit in the {self.image_parts.width}x"
+                             f"{self.image_parts.height} image")
+        tile_view[...] = tile_pixels
+        parts.append(SplittedImageInfo(row, col, tile_view, left, top))
+
+        # The first tile tells how many tiles hold the payload
+        if self.tile_span is None:
+            _, self.tile_span = read_tiled_header(tile_view)
+            if not 0 < self.tile_span <= len(parts) + self.remaining_frames:
+                raise ValueError(f"Payload spans {self.tile_span} tiles but the stream has fewer")
+
+    # Forgets the message in progress
+    def __reset(self) -> None:
+        self.image_parts = None
+        self.canvas = None
+        self.remaining_frames = 0
+        self.tile_span = None
@@ -1,4 +1,5 @@
 # Imports for GUI, networking, encryption socket wrapper, and utilities
+import importlib
 import ipaddress
 import socket
 import sys
@@ -7,11 +8,14 @@ import time
 import tkinter as tk
 import tkinter.filedialog as filedialog
 from datetime import datetime
+from queue import Full
 from tkinter import colorchooser, font, messagebox, scrolledtext, ttk
 
-from picture_encryption_socket import PictureEncryptionSocket  # Custom socket with encryption and steganography
+# The encryption socket (with its image, crypto and network dependencies) is imported when connecting,
+# so the window and the configuration dialog appear without waiting for those imports
+SOCKET_MODULE = 'picture_encryption_socket'
 
-ENCODING = 'utf-16'  # Encoding used for sending and receiving messages
+ENCODING = 'utf-16'  # Encoding used for saving the chat to a file
 
 
 # ChatClient is the main GUI application class for managing the chat interface, sending/receiving messages,
@@ -332,6 +336,9 @@ class ChatClient:
     # --- Networking: Connect to Other User Using PictureEncryptionSocket ---
     def connect_to_server(self):
         try:
+            # Custom socket with encryption and steganography
+            from picture_encryption_socket import PictureEncryptionSocket
+
             self.user_socket = PictureEncryptionSocket(self.host)
             self.display_message_local("System: Connecting...\n")
             self.user_socket.connect()
@@ -364,13 +371,13 @@ class ChatClient:
     def receive_messages(self):
         while self.is_connected and not self.stop_thread:
             try:
-                message = self.user_socket.receive()
-                if not message:
+                # The socket decodes the message with the text encoding agreed when connecting
+                decoded_message = self.user_socket.receive_text()
+                if not decoded_message:
                     self.display_message_local("\nSystem: Server closed the connection.\n")
                     self.master.after(0, self.handle_disconnection)
                     break
 
-                decoded_message = message.decode(ENCODING)
                 self.master.after(0, self.display_message_remote, decoded_message)
 
             except (socket.error, ConnectionResetError, BrokenPipeError, Exception) as e:
@@ -403,9 +410,14 @@ class ChatClient:
             try:
                 timestamp = datetime.now().strftime("%I:%M %p")
                 full_message = f"{self.username} [{timestamp}]: {message}"
-                self.user_socket.send(full_message.encode(ENCODING))
+                # Never wait for the peer's credit here: that would freeze the window
+                self.user_socket.send_text(full_message, block=False)
                 self.display_message_local(f"You [{timestamp}]: {message}")
                 self.message_entry.delete(0, tk.END)
+            except Full:
+                # The message stays in the entry, so it can be sent again
+                messagebox.showwarning("Peer Busy", "The peer is not keeping up with your messages. "
+                                       "Please try again in a moment.", parent=self.master)
             except (socket.error, BrokenPipeError) as e:
                 self.display_message_local(f"\nSystem: Failed to send message: {e}\n")
                 self.handle_disconnection()
@@ -430,8 +442,12 @@ class ChatClient:
         self.message_area.yview(tk.END)
 
     def send_message(self, message):
+        try:
+            self.user_socket.send_text(message, block=False)
+        except Full:
+            self.display_message_local("\nSystem: The peer is busy, the message was not sent.\n")
+            return
         self.display_message_local(f"{self.username}: {message}\n")
-        self.user_socket.send(message.encode(ENCODING))
         self.message_entry.delete(0, tk.END)
 
     def on_closing(self, show_error=True):
@@ -454,5 +470,7 @@ class ChatClient:
 
 if __name__ == "__main__":
     root = tk.Tk()
+    # Load the socket module in the background while the user fills in the configuration
+    threading.Thread(target=importlib.import_module, args=(SOCKET_MODULE,), daemon=True).start()
     app = ChatClient(root)
     root.mainloop()
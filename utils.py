@@ -1,12 +1,10 @@
+import math
 import random
 import string
-from io import BytesIO
+from functools import lru_cache
 from pathlib import Path
 from tempfile import gettempdir
 
-from PIL import Image
-from sympy import isprime, primitive_root
-
 # Returns the system temporary directory as a Path object
 def get_temp_dir() -> Path:
     return Path(gettempdir())
@@ -18,19 +16,23 @@ def generate_random_filename(n: int, ext: str = '') -> str:
         name += '.' + ext
     return name
 
-# Checks whether the file has a .png extension
-def is_png_file(file_path: str) -> bool:
-    return file_path.endswith('.png')
+# Converts a tile's grid position and pixel offset to a string ("2_3_160_96")
+def tile_position_to_str(row: int, col: int, left: int, top: int) -> str:
+    return f'{row}_{col}_{left}_{top}'
+
+# Parses a string in the format "row_col_left_top" back into a tuple of integers
+def str_to_tile_position(position_str: str) -> tuple[int, int, int, int]:
+    row, col, left, top = position_str.split('_')
+    return int(row), int(col), int(left), int(top)
 
-# Converts row and column indices to a string representation ("2_3")
-def row_and_column_to_str(row: int, col: int) -> str:
-    return f'{row}_{col}'
+# Converts a grid shape and the exact image size to a string ("6_8_640_480")
+def grid_to_str(rows: int, cols: int, width: int, height: int) -> str:
+    return f'{rows}_{cols}_{width}_{height}'
 
-# Parses a string in the format "row_col" back into a tuple of integers
-def str_to_row_and_column(index_str) -> tuple[int, int]:
-    splitted_indices = index_str.split('_')
-    row, col = splitted_indices
-    return int(row), int(col)
+# Parses a string in the format "rows_cols_width_height" back into a tuple of integers
+def str_to_grid(grid_str: str) -> tuple[int, int, int, int]:
+    rows, cols, width, height = grid_str.split('_')
+    return int(rows), int(cols), int(width), int(height)
 
 # Creates a new directory with a random name of length `n` inside a given parent directory
 def create_random_name_directory(n: int, directory_parent: Path) -> Path:
@@ -38,13 +40,6 @@ def create_random_name_directory(n: int, directory_parent: Path) -> Path:
     dir_path.mkdir()
     return dir_path
 
-# Converts image data from JPG format to PNG format
-def jpg_to_png(jpg_bytes: bytes) -> bytes:
-    img = Image.open(BytesIO(jpg_bytes))  # Open JPG image from bytes
-    png_bytes_io = BytesIO()
-    img.save(png_bytes_io, format="PNG")  # Save as PNG to memory
-    return png_bytes_io.getvalue()
-
 # Generates a random RGB color tuple
 def generate_random_color() -> tuple[int, int, int]:
     r = random.randint(0, 255)
@@ -52,33 +47,85 @@ def generate_random_color() -> tuple[int, int, int]:
     b = random.randint(0, 255)
     return r, g, b
 
-# Generates a random 5-digit integer (for use as private keys)
-def generate_5_digit_number() -> int:
-    return random.randint(10000, 99999)
-
 # Returns a random prime number between a range of digit lengths
 def random_prime_number(min_digits=3, max_digits=5):
     min_value = 10 ** (min_digits - 1)
     max_value = 10 ** max_digits - 1
-    primes = []
-    for num in range(min_value, max_value + 1):
-        if num < 2:
-            continue
-        is_prime = True
-        for i in range(2, int(num ** 0.5) + 1):
-            if num % i == 0:
-                is_prime = False
-                break
-        if is_prime:
-            primes.append(num)
+    primes = get_primes_in_range(min_value, max_value)
     # Return a randomly selected prime from the list
     return random.choice(primes) if primes else None
 
-# Finds a primitive root modulo a prime number `p`
+# Returns all primes between min_value and max_value (inclusive), using a sieve of Eratosthenes.
+# The result is cached, so the sieve only runs the first time a range is asked for.
+@lru_cache(maxsize=None)
+def get_primes_in_range(min_value: int, max_value: int) -> tuple[int, ...]:
+    if max_value < 2:
+        return ()
+    sieve = bytearray([1]) * (max_value + 1)
+    sieve[0] = sieve[1] = 0
+    for num in range(2, math.isqrt(max_value) + 1):
+        if sieve[num]:
+            # Cross out every multiple of num, starting from its square
+            sieve[num * num::num] = bytes(len(range(num * num, max_value + 1, num)))
+    return tuple(num for num in range(max(min_value, 2), max_value + 1) if sieve[num])
+
+# Finds a primitive root modulo a prime number `p`.
+# Roots are cached, so each prime's root is only computed once per process.
+@lru_cache(maxsize=None)
 def find_primitive_root(p):
-    if not isprime(p):
+    if not is_prime(p):
         raise ValueError("p must be a prime number.")
-    return primitive_root(p)
+    if p == 2:
+        return 1
+    # g is a primitive root when g ^ ((p - 1) / q) != 1 (mod p) for every prime factor q of p - 1
+    exponents = [(p - 1) // q for q in get_prime_factors(p - 1)]
+    for g in range(2, p):
+        if all(pow(g, exponent, p) != 1 for exponent in exponents):
+            return g
+
+# Bases for which the Miller-Rabin test is exact for every n below 3.3 * 10^24
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# Checks whether n is prime with the Miller-Rabin test.
+# Exact below 3.3 * 10^24; for larger n a composite passes with probability below 4^-13.
+def is_prime(n: int) -> bool:
+    if n < 2:
+        return False
+    for base in MILLER_RABIN_BASES:
+        if n % base == 0:
+            return n == base
+
+    # Write n - 1 as d * 2^s with d odd
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    for base in MILLER_RABIN_BASES:
+        x = pow(base, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+# Returns the distinct prime factors of n (by trial division, meant for the small legacy primes)
+def get_prime_factors(n: int) -> list[int]:
+    factors = []
+    factor = 2
+    while factor * factor <= n:
+        if n % factor == 0:
+            factors.append(factor)
+            while n % factor == 0:
+                n //= factor
+        factor += 1
+    if n > 1:
+        factors.append(n)
+    return factors
 
 # Converts an integer to bytes using little-endian encoding
 def int_to_bytes(number: int) -> bytes:
@@ -1,12 +1,15 @@
 import zipfile
+from io import BytesIO
 from pathlib import Path
 
 # Creates a ZIP archive from a list of files
 # - filepaths_to_compress: list of file paths to include in the ZIP
 # - output_zip: path where the output ZIP file should be created
-def create_zip_file(filepaths_to_compress: list[str | Path], output_zip: str | Path):
+# - comment: optional archive comment
+def create_zip_file(filepaths_to_compress: list[str | Path], output_zip: str | Path, comment: str = ''):
     # Open the ZIP file in write mode
     with zipfile.ZipFile(output_zip, 'w') as zipf:
+        zipf.comment = comment.encode()
         for file in filepaths_to_compress:
             # Add file to ZIP using only its filename (not full path)
             zipf.write(filename=file, arcname=Path(file).name)
@@ -19,3 +22,24 @@ def extract_zip_file(zip_file_path: str | Path, extract_to_folder: str | Path):
     with zipfile.ZipFile(zip_file_path, 'r') as zipf:
         # Extract all contents into the specified folder
         zipf.extractall(extract_to_folder)
+
+# Creates a ZIP archive in memory from (name, data) pairs and returns its bytes
+def create_zip_bytes(files_to_compress: list[tuple[str, bytes]], comment: str = '') -> bytes:
+    zip_bytes_io = BytesIO()
+    with zipfile.ZipFile(zip_bytes_io, 'w') as zipf:
+        zipf.comment = comment.encode()
+        for name, data in files_to_compress:
+            zipf.writestr(name, data)
+    return zip_bytes_io.getvalue()
+
+# Reads all files of an in-memory ZIP archive and returns them as (name, data) pairs
+def read_zip_bytes(zip_bytes: bytes | bytearray) -> list[tuple[str, bytes]]:
+    with zipfile.ZipFile(BytesIO(zip_bytes), 'r') as zipf:
+        return [(name, zipf.read(name)) for name in zipf.namelist()]
+
+# Returns the archive comment of a ZIP file given by path or as in-memory bytes
+def read_zip_comment(zip_file: str | Path | bytes | bytearray) -> str:
+    if isinstance(zip_file, (bytes, bytearray)):
+        zip_file = BytesIO(zip_file)
+    with zipfile.ZipFile(zip_file, 'r') as zipf:
+        return zipf.comment.decode()